@@ -1,10 +1,24 @@
 import os
+import json
+import shutil
 import subprocess
+import tempfile
 import time
+from dataclasses import replace
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from utils.path_utils import is_unc_path, normalize_unc_path, validate_path, ensure_directory_exists
 from utils.logging_utils import get_logger, log_exception, ContextLogger
+from engine.native import EngineEvent, EngineOptions, FailedFile, NativeCopyEngine, RunResult
+from engine.shared import SharedJob, find_overlaps, run_shared_jobs
+from engine.archive import write_archive
+from engine.restore import RestoreEngine, open_restore_source
+from engine.retention import RetentionPolicy, prune_destination
+from engine.scrub import ScrubOptions, ScrubReport, Scrubber
+from engine.parity import ParityOptions, protect_destination
+from engine.tiering import TieringOptions, TieringReport, migrate_runs
+from engine.archive import archive_path
+from engine.storage import StorageError, describe, is_object_url, open_backend
 
 # Optional: import win32wnet and win32netcon if available (for network drive mapping)
 try:
@@ -237,3 +251,481 @@ def run_backup(
                 unmap_network_drive(mapped_source)
             if mapped_dest:
                 unmap_network_drive(mapped_dest)
+
+
+def run_native_backup(
+    source: str,
+    dest: str,
+    log_dir: str,
+    options: Optional[EngineOptions] = None,
+    source_user: Optional[str] = None,
+    source_pwd: Optional[str] = None,
+    dest_user: Optional[str] = None,
+    dest_pwd: Optional[str] = None,
+    progress_callback: Optional[Callable[[EngineEvent], None]] = None,
+    retention: Optional[RetentionPolicy] = None
+) -> Tuple[bool, RunResult]:
+    """
+    Run a backup using the native copy engine instead of robocopy.
+    With the archive destination format the run is written as one seekable archive.
+    After a successful run the retention policy, if any, prunes old runs.
+    A JSON run report is written to log_dir.
+    
+    Args:
+        source: Source directory path
+        dest: Destination directory path
+        log_dir: Directory to store the run report
+        options: Native engine options (defaults are used if None)
+        source_user: Username for source network path
+        source_pwd: Password for source network path
+        dest_user: Username for destination network path
+        dest_pwd: Password for destination network path
+        progress_callback: Optional callable receiving EngineEvent objects
+        retention: Optional retention policy for the destination's runs
+        
+    Returns:
+        Tuple of (success: bool, result: RunResult)
+    """
+    with ContextLogger(logger, f"Native backup from {source} to {dest}"):
+        result = RunResult()
+        
+        # Validate inputs
+        is_valid, error = validate_path(source, must_exist=True)
+        if not is_valid:
+            logger.error(f"Invalid source path: {error}")
+            result.failures.append(FailedFile("", "invalid_path", f"Invalid source path: {error}", 0))
+            return False, result
+        
+        remote = is_object_url(dest)
+        is_valid, error = (True, "") if remote else validate_path(dest)
+        if not is_valid:
+            logger.error(f"Invalid destination path: {error}")
+            result.failures.append(FailedFile("", "invalid_path", f"Invalid destination path: {error}", 0))
+            return False, result
+        
+        success, error = ensure_directory_exists(log_dir)
+        if not success:
+            logger.error(f"Failed to create log directory: {error}")
+            result.failures.append(FailedFile("", "invalid_path", error, 0))
+            return False, result
+        
+        mapped_source = None
+        mapped_dest = None
+        
+        try:
+            effective_source = source
+            if is_unc_path(source) and source_user and source_pwd:
+                mapped_source = map_network_drive(source, source_user, source_pwd, temporary=True)
+                if mapped_source:
+                    effective_source = mapped_source
+                    logger.info(f"Using mapped drive for source: {mapped_source}")
+                else:
+                    logger.warning("Failed to map source drive, using UNC path directly")
+            
+            effective_dest = dest
+            if not remote and is_unc_path(dest) and dest_user and dest_pwd:
+                mapped_dest = map_network_drive(dest, dest_user, dest_pwd, temporary=True)
+                if mapped_dest:
+                    effective_dest = mapped_dest
+                    logger.info(f"Using mapped drive for destination: {mapped_dest}")
+                else:
+                    logger.warning("Failed to map destination drive, using UNC path directly")
+            
+            if remote:
+                result = _archive_to_object_store(effective_source, dest, options, dest_user, dest_pwd,
+                                                  progress_callback)
+            elif options is not None and options.destination_format == "archive":
+                result = write_archive(effective_source, effective_dest, options, progress_callback)
+            else:
+                engine = NativeCopyEngine(effective_source, effective_dest, options, progress_callback)
+                result = engine.run()
+            if result.success and not remote:
+                _apply_retention(effective_dest, retention, result)
+                _protect(effective_dest, options, result)
+            
+            log_filename = f"native_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            result.log_file = os.path.join(log_dir, log_filename)
+            with open(result.log_file, 'w', encoding='utf-8') as f:
+                json.dump(result.to_dict(), f, indent=2)
+            
+            if result.success:
+                logger.info(f"Native backup completed successfully ({result.files_copied} files, "
+                            f"{result.bytes_copied} bytes, {result.duration_seconds:.2f}s)")
+            else:
+                logger.error(f"Native backup finished with {len(result.failures)} failed files")
+                for failure in result.failures:
+                    logger.error(f"  [{failure.error_class}] {failure.path}: {failure.message}")
+            
+            return result.success, result
+            
+        except Exception as e:
+            log_exception(logger, "Native backup operation failed")
+            result.failures.append(FailedFile("", "unknown", str(e), 0))
+            return False, result
+        finally:
+            # Clean up mapped drives
+            if mapped_source:
+                unmap_network_drive(mapped_source)
+            if mapped_dest:
+                unmap_network_drive(mapped_dest)
+
+
+def _archive_to_object_store(
+    source: str,
+    dest: str,
+    options: Optional[EngineOptions],
+    access_key: Optional[str],
+    secret_key: Optional[str],
+    progress_callback: Optional[Callable[[EngineEvent], None]]
+) -> RunResult:
+    """
+    Write a run's archive to a local staging folder and upload it to an object store.
+    The staging folder is removed afterwards; the upload is a parallel multipart upload.
+    """
+    if options is None or options.destination_format != "archive":
+        return RunResult(failures=[FailedFile(
+            "", "invalid_path", "Object storage destinations require the archive destination format", 0
+        )])
+    
+    staging = tempfile.mkdtemp(prefix="robobackup_stage_")
+    try:
+        # The catalog lives with a destination folder, which an object store does not have
+        result = write_archive(source, staging, replace(options, catalog=False), progress_callback)
+        if not result.success:
+            return result
+        start = time.monotonic()
+        key = os.path.basename(archive_path(staging, result.run_id))
+        with open_backend(dest, access_key or "", secret_key or "", options.workers) as backend:
+            backend.put_file(key, archive_path(staging, result.run_id))
+        result.stats["upload"] = {
+            "destination": describe(dest),
+            "key": key,
+            "bytes": os.path.getsize(archive_path(staging, result.run_id)),
+            "seconds": round(time.monotonic() - start, 3),
+        }
+        logger.info(f"Uploaded {key} to {describe(dest)}")
+        return result
+    except StorageError as e:
+        logger.error(f"Upload to {describe(dest)} failed: {e}")
+        result.success = False
+        result.failures.append(FailedFile("", "network", str(e), 0))
+        return result
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _apply_retention(dest: str, retention: Optional[RetentionPolicy], result: RunResult):
+    """Prune a destination's old runs after a successful run; failures are logged, not fatal"""
+    if retention is None or not retention.enabled:
+        return
+    try:
+        plan, stats = prune_destination(dest, retention)
+        result.stats["retention"] = {"kept": len(plan.keep), **stats}
+    except Exception as e:
+        log_exception(logger, f"Retention failed for {dest}: {e}")
+
+
+def _protect(dest: str, options: Optional[EngineOptions], result: RunResult):
+    """Refresh a destination's parity sidecars after a successful run; failures are logged, not fatal"""
+    if options is None or not options.parity_percent:
+        return
+    try:
+        result.stats["parity"] = protect_destination(dest, ParityOptions.from_engine_options(options))
+    except Exception as e:
+        log_exception(logger, f"Parity failed for {dest}: {e}")
+
+
+def run_job(
+    job: Any,
+    log_dir: str,
+    source_user: Optional[str] = None,
+    source_pwd: Optional[str] = None,
+    dest_user: Optional[str] = None,
+    dest_pwd: Optional[str] = None,
+    progress_callback: Optional[Callable[[EngineEvent], None]] = None
+) -> Tuple[bool, str]:
+    """
+    Run a configured backup job with the copy engine it selects.
+    Native jobs get the job's engine options and retention policy; robocopy jobs its flags.
+    
+    Args:
+        job: BackupJobConfig to run
+        log_dir: Directory to store the log or run report
+        source_user: Username for source network path
+        source_pwd: Password for source network path
+        dest_user: Username for destination network path
+        dest_pwd: Password for destination network path
+        progress_callback: Optional callable receiving EngineEvent objects (native engine only)
+        
+    Returns:
+        Tuple of (success: bool, log_file_path: str)
+    """
+    if job.copy_engine == "native":
+        success, result = run_native_backup(
+            job.source_path, job.destination_path, log_dir, EngineOptions.from_job_config(job),
+            source_user, source_pwd, dest_user, dest_pwd, progress_callback, RetentionPolicy.from_job_config(job)
+        )
+        return success, result.log_file
+    return run_backup(
+        job.source_path, job.destination_path, job.robocopy_flags, log_dir,
+        source_user, source_pwd, dest_user, dest_pwd
+    )
+
+
+def run_jobs(
+    jobs: List[Any],
+    log_dir: str,
+    progress_callback: Optional[Callable[[str, EngineEvent], None]] = None
+) -> Dict[str, Tuple[bool, str]]:
+    """
+    Run several configured backup jobs that are due together, each with the copy engine it selects.
+    Native jobs run through run_native_backups, so those with overlapping sources share one scan.
+    
+    Args:
+        jobs: BackupJobConfig objects; paths must be reachable without drive mapping
+        log_dir: Directory to store the logs and run reports
+        progress_callback: Optional callable receiving (job name, EngineEvent) from native jobs
+        
+    Returns:
+        Dictionary of job name to (success, log_file_path)
+    """
+    native = [
+        SharedJob(job.name, job.source_path, job.destination_path,
+                  EngineOptions.from_job_config(job), RetentionPolicy.from_job_config(job))
+        for job in jobs if job.copy_engine == "native"
+    ]
+    outcomes = {}
+    if native:
+        for name, (success, result) in run_native_backups(native, log_dir, progress_callback).items():
+            outcomes[name] = (success, result.log_file)
+    for job in jobs:
+        if job.copy_engine != "native":
+            outcomes[job.name] = run_backup(job.source_path, job.destination_path, job.robocopy_flags, log_dir)
+    return outcomes
+
+
+def run_native_backups(
+    jobs: List[SharedJob],
+    log_dir: str,
+    progress_callback: Optional[Callable[[str, EngineEvent], None]] = None
+) -> Dict[str, Tuple[bool, RunResult]]:
+    """
+    Run several native backups that are due together.
+    Jobs whose sources overlap share one scan and one read of every file.
+    A JSON run report per job is written to log_dir.
+    
+    Args:
+        jobs: Jobs to run; sources and destinations must be reachable without drive mapping
+        log_dir: Directory to store the run reports
+        progress_callback: Optional callable receiving (job name, EngineEvent)
+        
+    Returns:
+        Dictionary of job name to (success, result)
+    """
+    with ContextLogger(logger, f"Native backup of {len(jobs)} jobs"):
+        success, error = ensure_directory_exists(log_dir)
+        if not success:
+            logger.error(f"Failed to create log directory: {error}")
+            return {job.name: (False, RunResult(failures=[FailedFile("", "invalid_path", error, 0)])) for job in jobs}
+        
+        # Archive destinations are written in their own sequential pass
+        archive_jobs = [job for job in jobs if job.options.destination_format == "archive"]
+        mirror_jobs = [job for job in jobs if job.options.destination_format != "archive"]
+        for group in find_overlaps(mirror_jobs):
+            if len(group) > 1:
+                logger.info(f"Sharing scan and reads for jobs: {', '.join(job.name for job in group)}")
+        
+        results = run_shared_jobs(mirror_jobs, progress_callback) if mirror_jobs else {}
+        for job in archive_jobs:
+            job_callback = None
+            if progress_callback is not None:
+                job_callback = lambda event, name=job.name: progress_callback(name, event)
+            results[job.name] = write_archive(job.source, job.dest, job.options, job_callback)
+        
+        for job in jobs:
+            result = results.get(job.name)
+            if result is not None and result.success:
+                _apply_retention(job.dest, job.retention, result)
+                _protect(job.dest, job.options, result)
+        
+        outcomes = {}
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for name, result in results.items():
+            safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+            result.log_file = os.path.join(log_dir, f"native_log_{stamp}_{safe_name}.json")
+            try:
+                with open(result.log_file, 'w', encoding='utf-8') as f:
+                    json.dump(result.to_dict(), f, indent=2)
+            except OSError as e:
+                logger.warning(f"Cannot write run report for {name}: {e}")
+            
+            shared = result.stats.get("shared_run")
+            if shared:
+                logger.info(f"Job {name}: shared run saved {shared['read_bytes_saved']} read bytes, "
+                            f"{shared['scan_entries_saved']} scan entries")
+            outcomes[name] = (result.success, result)
+        
+        return outcomes
+
+
+def run_restore(
+    dest: str,
+    target: str,
+    log_dir: str,
+    paths: Optional[List[str]] = None,
+    priority: Optional[List[str]] = None,
+    run_id: Optional[str] = None,
+    options: Optional[EngineOptions] = None,
+    progress_callback: Optional[Callable[[EngineEvent], None]] = None
+) -> Tuple[bool, RunResult]:
+    """
+    Restore files from a job's destination with the parallel restore engine.
+    Explicitly named files are restored first; a JSON run report is written to log_dir.
+    
+    Args:
+        dest: Job destination folder (mirror or archive), or an archive file
+        target: Folder to restore into
+        log_dir: Directory to store the run report
+        paths: Files or folders to restore, relative to the backup root (None = everything)
+        priority: Files or folders to restore before the rest
+        run_id: Archive run to restore (latest if None; ignored for mirrors)
+        options: Engine options; workers, chunk size, retries and encryption key are used
+        progress_callback: Optional callable receiving EngineEvent objects
+        
+    Returns:
+        Tuple of (success: bool, result: RunResult)
+    """
+    with ContextLogger(logger, f"Restore from {dest} to {target}"):
+        result = RunResult()
+        options = options or EngineOptions()
+        
+        success, error = ensure_directory_exists(log_dir)
+        if not success:
+            logger.error(f"Failed to create log directory: {error}")
+            result.failures.append(FailedFile("", "invalid_path", error, 0))
+            return False, result
+        
+        try:
+            source = open_restore_source(dest, run_id, options.encryption_key)
+            result = RestoreEngine(source, target, paths, priority, options, progress_callback).run()
+        except ValueError as e:
+            logger.error(f"Cannot restore from {dest}: {e}")
+            result.failures.append(FailedFile("", "invalid_path", str(e), 0))
+            return False, result
+        except Exception as e:
+            log_exception(logger, "Restore operation failed")
+            result.failures.append(FailedFile("", "unknown", str(e), 0))
+            return False, result
+        
+        result.log_file = os.path.join(log_dir, f"restore_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            with open(result.log_file, 'w', encoding='utf-8') as f:
+                json.dump(result.to_dict(), f, indent=2)
+        except OSError as e:
+            logger.warning(f"Cannot write restore report: {e}")
+        
+        if result.success:
+            logger.info(f"Restore completed successfully ({result.files_copied} files, "
+                        f"{result.bytes_copied} bytes, {result.duration_seconds:.2f}s)")
+        else:
+            logger.error(f"Restore finished with {len(result.failures)} failed files")
+            for failure in result.failures:
+                logger.error(f"  [{failure.error_class}] {failure.path}: {failure.message}")
+        return result.success, result
+
+
+def run_scrub(
+    dest: str,
+    log_dir: str,
+    options: Optional[ScrubOptions] = None
+) -> Tuple[bool, ScrubReport]:
+    """
+    Verify a backup destination against its recorded hashes.
+    A JSON scrub report is written to log_dir and kept in the destination's metadata folder.
+    
+    Args:
+        dest: Job destination folder
+        log_dir: Directory to store the scrub report
+        options: Scrub options (a throttled 7-day sample if None)
+        
+    Returns:
+        Tuple of (clean: bool, report: ScrubReport)
+    """
+    with ContextLogger(logger, f"Scrub of {dest}"):
+        options = options or ScrubOptions()
+        report = ScrubReport(dest, options.mode)
+        
+        success, error = ensure_directory_exists(log_dir)
+        if not success:
+            logger.error(f"Failed to create log directory: {error}")
+            return False, report
+        
+        try:
+            report = Scrubber(dest, options).run()
+        except Exception as e:
+            log_exception(logger, f"Scrub of {dest} failed: {e}")
+            return False, report
+        
+        log_file = os.path.join(log_dir, f"scrub_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            with open(log_file, 'w', encoding='utf-8') as f:
+                json.dump(report.to_dict(), f, indent=2)
+        except OSError as e:
+            logger.warning(f"Cannot write scrub report: {e}")
+        
+        if report.clean:
+            logger.info(f"Scrub found no problems ({report.objects_checked} objects, {report.bytes_read} bytes)")
+        else:
+            for finding in report.findings:
+                logger.error(f"  [{finding.problem}] {finding.run_id}/{finding.path}: {finding.message}")
+        return report.clean, report
+
+
+def run_tiering(
+    dest: str,
+    log_dir: str,
+    options: TieringOptions,
+    dry_run: bool = False
+) -> Tuple[bool, TieringReport]:
+    """
+    Move a destination's aged archive runs to a slower storage tier.
+    A JSON tiering report is written to log_dir.
+    
+    Args:
+        dest: Job destination folder
+        log_dir: Directory to store the tiering report
+        options: Tiering options, including the target folder or object store URL
+        dry_run: Report what would move without moving anything
+        
+    Returns:
+        Tuple of (success: bool, report: TieringReport)
+    """
+    with ContextLogger(logger, f"Tiering of {dest}"):
+        report = TieringReport(dest, describe(options.target), dry_run)
+        
+        is_valid, error = options.validate()
+        if not is_valid:
+            logger.error(f"Invalid tiering options: {error}")
+            return False, report
+        
+        success, error = ensure_directory_exists(log_dir)
+        if not success:
+            logger.error(f"Failed to create log directory: {error}")
+            return False, report
+        
+        try:
+            report = migrate_runs(dest, options, dry_run)
+        except Exception as e:
+            log_exception(logger, f"Tiering of {dest} failed: {e}")
+            return False, report
+        
+        log_file = os.path.join(log_dir, f"tiering_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            with open(log_file, 'w', encoding='utf-8') as f:
+                json.dump(report.to_dict(), f, indent=2)
+        except OSError as e:
+            logger.warning(f"Cannot write tiering report: {e}")
+        
+        for run_id, message in report.failures.items():
+            logger.error(f"  {run_id}: {message}")
+        return report.ok, report
@@ -76,6 +76,8 @@ except Exception:
 
 # Import UNC path utility
 from utils.path_utils import is_unc_path
+from utils.config import BackupJobConfig
+from backup_core import run_job
 
 # Check for required packages
 try:
@@ -1235,7 +1237,8 @@ class BackupApp:
         ttk.Button(button_frame, text="Run Backup Now", command=self.run_backup_now).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="Add to Schedule", command=self.add_to_schedule).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="Remove Selected", command=self.remove_scheduled_backup).pack(side=tk.LEFT, padx=(0, 10))
-        ttk.Button(button_frame, text="Manage Service", command=self.manage_backup_service).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Manage Service", command=self.manage_backup_service).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="Find in Backups", command=self.open_catalog_search).pack(side=tk.LEFT)
 
         # Scheduled backups list
         list_frame = ttk.LabelFrame(schedule_frame, text="Scheduled Backups", padding="10")
@@ -1755,8 +1758,9 @@ class BackupApp:
         ).start()
         self.log_message("Starting backup process...", 'info')
 
-    def run_backup(self, source, dest, flags, source_user=None, source_pwd=None, dest_user=None, dest_pwd=None):
-        """Run a backup with audit logging"""
+    def run_backup(self, source, dest, flags, source_user=None, source_pwd=None, dest_user=None, dest_pwd=None,
+                   copy_engine="robocopy", engine_settings=None):
+        """Run a backup with audit logging, using robocopy or the native copy engine"""
         user_ip = os.environ.get('COMPUTERNAME', 'unknown')
         self.audit_logger.log_event("BACKUP_START", f"Starting backup from {source} to {dest}", user_ip)
         
@@ -1843,6 +1847,24 @@ class BackupApp:
                     dest_pwd = f.decrypt(encrypted_pwd).decode()
                     self.audit_logger.log_event("CREDENTIAL_DECRYPT", "Decrypted destination credentials", user_ip)
             
+            if copy_engine == "native":
+                # Drives are already mapped, so the job runs against the effective paths
+                job = BackupJobConfig(
+                    name=f"{source} -> {dest}", source_path=effective_source, destination_path=effective_dest,
+                    robocopy_flags=flags, copy_engine="native", **(engine_settings or {})
+                )
+                self.audit_logger.log_event("BACKUP_EXECUTE", "Executing native copy engine", user_ip)
+                success, log_file = run_job(job, log_dir_used)
+                if success:
+                    self.log_message(f"Backup completed successfully (report: {log_file})", 'success')
+                    self.audit_logger.log_event("BACKUP_COMPLETE", "Native backup completed successfully", user_ip)
+                else:
+                    self.log_message(f"Backup failed (report: {log_file})", 'error')
+                    self.audit_logger.log_event("BACKUP_ERROR", "Native backup failed", user_ip)
+                if success and not self.minimized_to_tray:
+                    messagebox.showinfo("Backup Completed", "Backup finished successfully.")
+                return
+
             # Build robocopy command properly
             cmd = ["robocopy", effective_source, effective_dest]
             cmd.extend(flags.split())
@@ -1989,7 +2011,9 @@ class BackupApp:
                 backup["source_user"],
                 source_pwd,
                 backup["dest_user"],
-                dest_pwd
+                dest_pwd,
+                backup.get("copy_engine", "robocopy"),
+                backup.get("engine_settings")
             )
             return True
         finally:
@@ -2160,6 +2184,55 @@ class BackupApp:
             self.audit_logger.log_event("STARTUP_ERROR", f"Error toggling startup: {str(e)}", user_ip)
             self.startup_var.set(not self.startup_var.get())
 
+    def open_catalog_search(self):
+        """Search the destination's backup catalog for files by name"""
+        from engine.catalog import BackupCatalog, catalog_path
+        from engine.native import META_DIR_NAME
+
+        dest = self.dest_entry.get().strip()
+        path = catalog_path(os.path.join(dest, META_DIR_NAME)) if dest else ""
+        if not path or not os.path.exists(path):
+            self.log_message("No backup catalog found at the destination. Run a native engine backup first.", 'warning')
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Find in Backups")
+        dialog.geometry("760x420")
+        dialog.transient(self.root)
+
+        search_frame = ttk.Frame(dialog, padding="10")
+        search_frame.pack(fill=tk.X)
+        ttk.Label(search_frame, text="File name contains:").pack(side=tk.LEFT)
+        query_entry = ttk.Entry(search_frame, width=40)
+        query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        status_label = ttk.Label(dialog, text="", padding=(10, 0))
+
+        columns = ("run", "path", "size", "modified")
+        tree = ttk.Treeview(dialog, columns=columns, show="headings")
+        for column, title, width in zip(columns, ("Run", "Path", "Size", "Modified"), (120, 400, 90, 130)):
+            tree.heading(column, text=title)
+            tree.column(column, width=width, anchor=tk.E if column == "size" else tk.W)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 5))
+        status_label.pack(anchor=tk.W, pady=(0, 10))
+
+        def search(event=None):
+            tree.delete(*tree.get_children())
+            started = time.monotonic()
+            try:
+                with BackupCatalog(path) as catalog:
+                    hits = catalog.search(query_entry.get(), limit=500)
+            except Exception as e:
+                status_label.config(text=f"Search failed: {e}")
+                return
+            for hit in hits:
+                modified = datetime.fromtimestamp(hit.mtime_ns / 1e9).strftime('%Y-%m-%d %H:%M')
+                tree.insert("", tk.END, values=(hit.run_id, hit.path, f"{hit.size:,}", modified))
+            status_label.config(text=f"{len(hits)} matches in {time.monotonic() - started:.2f}s")
+
+        ttk.Button(search_frame, text="Search", command=search, width=10).pack(side=tk.LEFT)
+        query_entry.bind('<Return>', search)
+        query_entry.focus_set()
+
     def manage_backup_service(self):
         """Manage the backup service (create, start, stop, remove)"""
         try:
@@ -0,0 +1,315 @@
+"""
+Native copy engine package for RoboBackup Tool
+"""
+
+from .retry import (
+    RetryQueue,
+    classify_error,
+    backoff_delay
+)
+
+from .space import (
+    get_free_space,
+    check_free_space,
+    preallocate
+)
+
+from .durability import (
+    DURABILITY_MODES,
+    DurabilityManager,
+    syncfs
+)
+
+from .metadata import (
+    MetadataUpdate,
+    MetadataQueue,
+    apply_metadata
+)
+
+from .journal import (
+    JobJournal,
+    JournalState
+)
+
+from .buffers import (
+    BufferPool,
+    align_up
+)
+
+from .iohints import (
+    FADVISE_AVAILABLE,
+    open_for_sequential_read,
+    advise_willneed,
+    advise_dontneed
+)
+
+from .pipeline import (
+    TRANSFORMS,
+    CopyPipeline,
+    CopyUnit,
+    StageStats,
+    iter_decoded_chunks
+)
+
+from .manifest import (
+    Manifest,
+    ManifestEntry,
+    ManifestDiff,
+    diff_manifests,
+    list_manifests,
+    load_latest_manifest
+)
+
+from .columnar import (
+    NUMPY_AVAILABLE,
+    ColumnarManifest,
+    ColumnarDiff,
+    diff_columnar,
+    load_columnar
+)
+
+from .paths import (
+    PathStore,
+    UnsafePathError,
+    safe_join
+)
+
+from .sis import (
+    SingleInstanceIndex,
+    hash_file
+)
+
+from .native import (
+    EngineOptions,
+    EngineEvent,
+    FileEntry,
+    FileTable,
+    FailedFile,
+    RunResult,
+    NativeCopyEngine,
+    scan_tree,
+    scan_table,
+    needs_copy,
+    load_mirror_format
+)
+
+from .shared import (
+    SharedJob,
+    SharedSourceRun,
+    find_overlaps,
+    run_shared_jobs
+)
+
+from .tarstream import (
+    TarStreamWriter,
+    write_tar_stream,
+    load_tar_index
+)
+
+from .archive import (
+    ArchiveMember,
+    ArchiveWriter,
+    ArchiveReader,
+    write_archive,
+    list_archives,
+    open_archive
+)
+
+from .restore import (
+    RestoreEngine,
+    MirrorRestoreSource,
+    ArchiveRestoreSource,
+    open_restore_source
+)
+
+from .catalog import (
+    FTS5_TRIGRAM_AVAILABLE,
+    BackupCatalog,
+    CatalogHit,
+    CatalogRun,
+    catalog_path
+)
+
+from .browse import (
+    SnapshotIndex,
+    BrowseEntry,
+    BrowsePage,
+    list_snapshots,
+    open_snapshot
+)
+
+from .retention import (
+    RetentionPolicy,
+    RetentionPlan,
+    select_runs,
+    plan_retention,
+    apply_retention,
+    prune_destination
+)
+
+from .gc import (
+    BloomFilter,
+    GCReport,
+    collect_garbage
+)
+
+from .scrub import (
+    ScrubOptions,
+    ScrubReport,
+    ScrubFinding,
+    IOThrottle,
+    Scrubber,
+    load_scrub_report
+)
+
+from .parity import (
+    ParityOptions,
+    ParityRepair,
+    parity_path,
+    write_sidecar,
+    repair_file,
+    protect_destination,
+    repair_destination
+)
+
+from .storage import (
+    StorageBackend,
+    StorageError,
+    ObjectInfo,
+    LocalBackend,
+    S3Backend,
+    open_backend,
+    is_object_url
+)
+
+from .s3local import (
+    LocalS3Server
+)
+
+from .listing import (
+    DestinationListing
+)
+
+from .tiering import (
+    TieringOptions,
+    TieringReport,
+    plan_tiering,
+    migrate_runs
+)
+
+__all__ = [
+    'RetryQueue',
+    'classify_error',
+    'backoff_delay',
+    'get_free_space',
+    'check_free_space',
+    'preallocate',
+    'DURABILITY_MODES',
+    'DurabilityManager',
+    'syncfs',
+    'MetadataUpdate',
+    'MetadataQueue',
+    'apply_metadata',
+    'JobJournal',
+    'JournalState',
+    'BufferPool',
+    'align_up',
+    'FADVISE_AVAILABLE',
+    'open_for_sequential_read',
+    'advise_willneed',
+    'advise_dontneed',
+    'TRANSFORMS',
+    'CopyPipeline',
+    'CopyUnit',
+    'StageStats',
+    'iter_decoded_chunks',
+    'Manifest',
+    'ManifestEntry',
+    'ManifestDiff',
+    'diff_manifests',
+    'list_manifests',
+    'load_latest_manifest',
+    'NUMPY_AVAILABLE',
+    'ColumnarManifest',
+    'ColumnarDiff',
+    'diff_columnar',
+    'load_columnar',
+    'PathStore',
+    'UnsafePathError',
+    'safe_join',
+    'SingleInstanceIndex',
+    'hash_file',
+    'EngineOptions',
+    'EngineEvent',
+    'FileEntry',
+    'FileTable',
+    'FailedFile',
+    'RunResult',
+    'NativeCopyEngine',
+    'scan_tree',
+    'scan_table',
+    'needs_copy',
+    'load_mirror_format',
+    'SharedJob',
+    'SharedSourceRun',
+    'find_overlaps',
+    'run_shared_jobs',
+    'TarStreamWriter',
+    'write_tar_stream',
+    'load_tar_index',
+    'ArchiveMember',
+    'ArchiveWriter',
+    'ArchiveReader',
+    'write_archive',
+    'list_archives',
+    'open_archive',
+    'RestoreEngine',
+    'MirrorRestoreSource',
+    'ArchiveRestoreSource',
+    'open_restore_source',
+    'FTS5_TRIGRAM_AVAILABLE',
+    'BackupCatalog',
+    'CatalogHit',
+    'CatalogRun',
+    'catalog_path',
+    'SnapshotIndex',
+    'BrowseEntry',
+    'BrowsePage',
+    'list_snapshots',
+    'open_snapshot',
+    'RetentionPolicy',
+    'RetentionPlan',
+    'select_runs',
+    'plan_retention',
+    'apply_retention',
+    'prune_destination',
+    'BloomFilter',
+    'GCReport',
+    'collect_garbage',
+    'ScrubOptions',
+    'ScrubReport',
+    'ScrubFinding',
+    'IOThrottle',
+    'Scrubber',
+    'load_scrub_report',
+    'ParityOptions',
+    'ParityRepair',
+    'parity_path',
+    'write_sidecar',
+    'repair_file',
+    'protect_destination',
+    'repair_destination',
+    'StorageBackend',
+    'StorageError',
+    'ObjectInfo',
+    'LocalBackend',
+    'S3Backend',
+    'open_backend',
+    'is_object_url',
+    'LocalS3Server',
+    'DestinationListing',
+    'TieringOptions',
+    'TieringReport',
+    'plan_tiering',
+    'migrate_runs'
+]
@@ -0,0 +1,544 @@
+"""
+Seekable archive format for the RoboBackup native copy engine
+Independently compressed members with a footer index, so one file is restored with one seek
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+from utils.logging_utils import get_logger, log_exception
+from .retry import RetryQueue, classify_error
+from .iohints import open_for_sequential_read
+from .pipeline import COMPRESS_LEVEL
+from .paths import UnsafePathError, safe_join
+from .catalog import BackupCatalog, catalog_path, run_locations
+from .storage import StorageBackend, open_backend
+from .native import META_DIR_NAME, EngineEvent, EngineOptions, FailedFile, FileEntry, RunResult, _walk, new_run_id
+
+logger = get_logger(__name__)
+
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = ".rba"
+
+# Layout:
+#   ARCHIVE_MAGIC
+#   member data, each member a complete zlib stream (or stored as is)
+#   index: zlib-compressed JSON
+#   trailer: index offset, index length, index CRC-32, TRAILER_MAGIC
+ARCHIVE_MAGIC = b"RBA1"
+TRAILER_MAGIC = b"RBAI"
+_TRAILER = struct.Struct(">QQI4s")
+
+CODEC_ZLIB = "zlib"
+CODEC_STORE = "store"
+
+
+@dataclass
+class ArchiveMember:
+    """One file inside an archive"""
+    path: str
+    offset: int  # start of the stored data
+    length: int  # stored bytes
+    size: int  # original bytes
+    mtime_ns: int
+    mode: int
+    codec: str
+    sha256: str  # digest of the original content
+
+    def to_row(self) -> list:
+        return [self.path, self.offset, self.length, self.size, self.mtime_ns, self.mode, self.codec, self.sha256]
+
+
+class ArchiveWriter:
+    """
+    Sequential writer for a seekable archive.
+
+    Each member is compressed as its own zlib stream, so any member can be read
+    without touching the others. A member that does not shrink is rewritten
+    stored. The archive is built under a temporary name and only appears at its
+    final path once the index and trailer are written and synced.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 1024 * 1024, compress: bool = True):
+        """
+        Initialize archive writer
+
+        Args:
+            path: Final archive path
+            chunk_size: Read buffer size
+            compress: Compress members; False stores everything
+        """
+        self.path = path
+        self.tmp_path = path + ".partial"
+        self.compress = compress
+        self.members: List[ArchiveMember] = []
+        self.directories: List[list] = []
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self._file = open(self.tmp_path, "wb")
+        self._file.write(ARCHIVE_MAGIC)
+        self.offset = len(ARCHIVE_MAGIC)
+
+    def add_directory(self, entry: FileEntry):
+        """Record a directory so empty folders and folder times survive a restore"""
+        self.directories.append([entry.rel_path, entry.mtime_ns, entry.mode])
+
+    def _copy(self, fileobj: BinaryIO, size: int, compressor) -> str:
+        """Write up to size bytes from fileobj and return the SHA-256 of what was read"""
+        digest = hashlib.sha256()
+        remaining = size
+        while remaining:
+            n = fileobj.readinto(self._view[:min(remaining, len(self._buffer))])
+            if not n:
+                raise OSError(f"File shrank while archiving ({size - remaining} of {size} bytes)")
+            chunk = self._view[:n]
+            digest.update(chunk)
+            self._file.write(compressor.compress(chunk) if compressor else chunk)
+            remaining -= n
+        if compressor:
+            self._file.write(compressor.flush())
+        return digest.hexdigest()
+
+    def add_file(self, rel_path: str, fileobj: BinaryIO, st: os.stat_result) -> ArchiveMember:
+        """
+        Add a regular file from an open, seekable file.
+
+        Args:
+            rel_path: Member path
+            fileobj: File opened for reading, supporting readinto()
+            st: stat of the open file; exactly st.st_size bytes are archived
+
+        Returns:
+            The new member
+
+        Raises:
+            OSError: If the file cannot be read; the archive is left as it was before the call
+        """
+        start = self.offset
+        codec = CODEC_ZLIB if self.compress and st.st_size else CODEC_STORE
+        try:
+            compressor = zlib.compressobj(COMPRESS_LEVEL) if codec == CODEC_ZLIB else None
+            digest = self._copy(fileobj, st.st_size, compressor)
+            if codec == CODEC_ZLIB and self._file.tell() - start >= st.st_size:
+                # Incompressible: store it instead so extraction is a plain copy
+                codec = CODEC_STORE
+                self._file.seek(start)
+                self._file.truncate()
+                fileobj.seek(0)
+                digest = self._copy(fileobj, st.st_size, None)
+        except OSError:
+            self._file.seek(start)
+            self._file.truncate()
+            raise
+        self.offset = self._file.tell()
+        member = ArchiveMember(rel_path, start, self.offset - start, st.st_size, st.st_mtime_ns,
+                               st.st_mode & 0o7777, codec, digest)
+        self.members.append(member)
+        return member
+
+    def close(self, run_id: str = ""):
+        """Write the index and trailer, sync, and move the archive into place"""
+        index = zlib.compress(json.dumps({
+            "version": ARCHIVE_VERSION,
+            "run_id": run_id,
+            "members": [m.to_row() for m in self.members],
+            "directories": self.directories,
+        }, separators=(",", ":")).encode("utf-8"), COMPRESS_LEVEL)
+        self._file.write(index)
+        self._file.write(_TRAILER.pack(self.offset, len(index), zlib.crc32(index), TRAILER_MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discard the partial archive"""
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class ArchiveReader:
+    """
+    Random-access reader for an archive written by ArchiveWriter.
+
+    Opening reads only the trailer and the index. Every thread reading member
+    data gets its own file handle, so members can be extracted in parallel.
+    """
+
+    def __init__(self, path: str, backend: Optional[StorageBackend] = None):
+        """
+        Open an archive and load its index
+
+        Args:
+            path: Archive file, or its key when backend is given
+            backend: Storage backend holding the archive, e.g. a slower tier; closed with the reader
+
+        Raises:
+            ValueError: If the file is not a complete archive of a supported version
+        """
+        self.path = path
+        self.backend = backend
+        self._local = threading.local()
+        self._handles: List[BinaryIO] = []
+        self._handles_lock = threading.Lock()
+        with self._open() as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"Not a RoboBackup archive: {path}")
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            if end < len(ARCHIVE_MAGIC) + _TRAILER.size:
+                raise ValueError(f"Truncated archive: {path}")
+            f.seek(end - _TRAILER.size)
+            index_offset, index_length, index_crc, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic != TRAILER_MAGIC or index_offset + index_length + _TRAILER.size != end:
+                raise ValueError(f"Archive has no valid index: {path}")
+            f.seek(index_offset)
+            raw = f.read(index_length)
+        if zlib.crc32(raw) != index_crc:
+            raise ValueError(f"Archive index is corrupt: {path}")
+        data = json.loads(zlib.decompress(raw).decode("utf-8"))
+        if data.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version in {path}")
+        self.run_id = data.get("run_id", "")
+        self.members: Dict[str, ArchiveMember] = {row[0]: ArchiveMember(*row) for row in data["members"]}
+        self.directories: List[list] = data.get("directories", [])
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the file handles opened by reader threads, and the backend if any"""
+        with self._handles_lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles.clear()
+        self._local = threading.local()
+        if self.backend is not None:
+            self.backend.close()
+
+    def _open(self, buffered: bool = True) -> BinaryIO:
+        if self.backend is not None:
+            return self.backend.open(self.path)
+        return open(self.path, "rb") if buffered else open(self.path, "rb", buffering=0)
+
+    def _handle(self) -> BinaryIO:
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = self._local.handle = self._open(buffered=False)
+            with self._handles_lock:
+                self._handles.append(handle)
+        return handle
+
+    def iter_member(self, member: ArchiveMember, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """
+        Yield the original content of a member, verifying its checksum.
+
+        Raises:
+            ValueError: If the stored data is corrupt
+        """
+        handle = self._handle()
+        handle.seek(member.offset)
+        decompressor = zlib.decompressobj() if member.codec == CODEC_ZLIB else None
+        digest = hashlib.sha256()
+        remaining = member.length
+        try:
+            while remaining:
+                data = handle.read(min(remaining, chunk_size))
+                if not data:
+                    raise ValueError(f"Archive ends inside member {member.path}")
+                remaining -= len(data)
+                if decompressor:
+                    data = decompressor.decompress(data)
+                digest.update(data)
+                yield data
+            if decompressor:
+                tail = decompressor.flush()
+                digest.update(tail)
+                yield tail
+        except zlib.error as e:
+            raise ValueError(f"Corrupt member {member.path}: {e}")
+        if digest.hexdigest() != member.sha256:
+            raise ValueError(f"Checksum mismatch in member {member.path}")
+
+    def read(self, rel_path: str) -> bytes:
+        """Return the content of one member"""
+        return b"".join(self.iter_member(self.members[rel_path]))
+
+    def extract(self, rel_path: str, dest_root: str, chunk_size: int = 1024 * 1024) -> ArchiveMember:
+        """
+        Restore one member under dest_root with its modification time and permissions.
+
+        The file is written under a temporary name and renamed into place once its
+        checksum has been verified, so a corrupt member never replaces a good file.
+
+        Raises:
+            KeyError: If the archive has no such member
+            UnsafePathError: If the member's path would leave dest_root
+            ValueError: If the member is corrupt
+            OSError: If the file cannot be written
+        """
+        member = self.members[rel_path]
+        target = safe_join(dest_root, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + ".rbtmp"
+        try:
+            with open(tmp, "wb") as out:
+                for data in self.iter_member(member, chunk_size):
+                    out.write(data)
+            os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        # Times before permissions, so a read-only mode cannot block the utime call
+        os.utime(target, ns=(member.mtime_ns, member.mtime_ns))
+        if member.mode:
+            os.chmod(target, stat.S_IMODE(member.mode))
+        return member
+
+    def extract_all(
+        self,
+        dest_root: str,
+        paths: Optional[Iterable[str]] = None,
+        workers: int = 4,
+        progress_callback: Optional[Callable[[EngineEvent], None]] = None
+    ) -> RunResult:
+        """
+        Restore many members in parallel.
+
+        Args:
+            dest_root: Folder to restore into
+            paths: Member paths to restore; None restores the whole archive
+            workers: Extraction threads (zlib and file I/O release the GIL)
+            progress_callback: Optional callable receiving EngineEvent objects
+
+        Returns:
+            RunResult of the extraction
+        """
+        result = RunResult(run_id=self.run_id)
+        start = time.monotonic()
+
+        def emit(kind: str, path: str = "", nbytes: int = 0, message: str = ""):
+            if progress_callback is None:
+                return
+            try:
+                progress_callback(EngineEvent(kind, path, nbytes, message))
+            except Exception:
+                log_exception(logger, "Progress callback raised an exception")
+
+        wanted = list(self.members) if paths is None else list(paths)
+        result.files_total = len(wanted)
+        emit("scan_complete", message=f"{len(wanted)} members to extract")
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="rba-extract") as pool:
+            futures = {pool.submit(self.extract, path, dest_root): path for path in wanted}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    member = future.result()
+                except KeyError:
+                    result.failures.append(FailedFile(path, "not_found", "Not in archive", 1))
+                    emit("file_failed", path, message="not_found: Not in archive")
+                    continue
+                except UnsafePathError as e:
+                    result.failures.append(FailedFile(path, "invalid_path", str(e), 1))
+                    emit("file_failed", path, message=f"invalid_path: {e}")
+                    continue
+                except ValueError as e:
+                    result.failures.append(FailedFile(path, "corrupt", str(e), 1))
+                    emit("file_failed", path, message=f"corrupt: {e}")
+                    continue
+                except OSError as e:
+                    error_class, _ = classify_error(e)
+                    result.failures.append(FailedFile(path, error_class, str(e), 1))
+                    emit("file_failed", path, message=f"{error_class}: {e}")
+                    continue
+                result.files_copied += 1
+                result.bytes_copied += member.size
+                emit("file_copied", path, member.size)
+
+        if paths is None:
+            # Deepest first, so restoring a child does not disturb its parent's time
+            for rel_dir, mtime_ns, mode in sorted(self.directories, key=lambda d: -d[0].count("/")):
+                try:
+                    target = safe_join(dest_root, rel_dir)
+                    os.makedirs(target, exist_ok=True)
+                    os.utime(target, ns=(mtime_ns, mtime_ns))
+                    if mode:
+                        os.chmod(target, stat.S_IMODE(mode))
+                except UnsafePathError as e:
+                    logger.error(f"Refusing to restore folder {rel_dir}: {e}")
+                except OSError as e:
+                    logger.warning(f"Cannot restore folder {rel_dir}: {e}")
+
+        result.duration_seconds = time.monotonic() - start
+        result.success = not result.failures
+        emit("run_complete", nbytes=result.bytes_copied,
+             message=f"{result.files_copied} extracted, {len(result.failures)} failed")
+        return result
+
+
+def archive_path(dest: str, run_id: str) -> str:
+    """Archive file of a run inside a destination folder"""
+    return os.path.join(dest, run_id + ARCHIVE_SUFFIX)
+
+
+def open_archive(dest: str, run_id: str, access_key: str = "", secret_key: str = "") -> ArchiveReader:
+    """
+    Open a run's archive wherever it is stored: in the destination folder, or on
+    the storage tier the catalog records it was moved to.
+
+    Args:
+        dest: Job destination folder
+        run_id: Run ID
+        access_key: Access key ID, if the tier is an object store
+        secret_key: Secret access key, if the tier is an object store
+
+    Raises:
+        ValueError: If the run has no archive in either place, or the archive is unreadable
+    """
+    path = archive_path(dest, run_id)
+    if os.path.exists(path):
+        return ArchiveReader(path)
+    location = run_locations(os.path.join(dest, META_DIR_NAME)).get(run_id)
+    if not location:
+        raise ValueError(f"No archive for run {run_id} in {dest}")
+    backend = open_backend(location, access_key, secret_key)
+    try:
+        return ArchiveReader(os.path.basename(path), backend)
+    except BaseException:
+        backend.close()
+        raise
+
+
+def list_archives(dest: str) -> List[str]:
+    """Run IDs of the complete archives in a destination folder, oldest first"""
+    try:
+        names = os.listdir(dest)
+    except OSError:
+        return []
+    return sorted(name[:-len(ARCHIVE_SUFFIX)] for name in names if name.endswith(ARCHIVE_SUFFIX))
+
+
+def write_archive(
+    source: str,
+    dest: str,
+    options: Optional[EngineOptions] = None,
+    progress_callback: Optional[Callable[[EngineEvent], None]] = None
+) -> RunResult:
+    """
+    Back up a source tree as one seekable archive in the destination folder.
+
+    Args:
+        source: Directory to archive
+        dest: Destination folder; the archive is named after the run ID
+        options: Engine options; exclusions, chunk size, page-cache hints and retries are used
+        progress_callback: Optional callable receiving EngineEvent objects
+
+    Returns:
+        RunResult; stats carry the archive path, stored bytes and member count
+    """
+    options = options or EngineOptions()
+    tiered = run_locations(os.path.join(dest, META_DIR_NAME))
+    result = RunResult(run_id=new_run_id(
+        lambda run_id: run_id in tiered or os.path.exists(archive_path(dest, run_id))
+        or os.path.exists(archive_path(dest, run_id) + ".partial")
+    ))
+    start = time.monotonic()
+
+    def emit(kind: str, path: str = "", nbytes: int = 0, message: str = ""):
+        if progress_callback is None:
+            return
+        try:
+            progress_callback(EngineEvent(kind, path, nbytes, message))
+        except Exception:
+            log_exception(logger, "Progress callback raised an exception")
+
+    if not os.path.isdir(source):
+        result.failures.append(FailedFile("", "not_found", f"Source folder does not exist: {source}", 1))
+        emit("run_complete", message="Source folder does not exist")
+        return result
+
+    os.makedirs(dest, exist_ok=True)
+    path = archive_path(dest, result.run_id)
+    writer = ArchiveWriter(path, options.chunk_size)
+    retry_queue = RetryQueue(options.retry_base_delay, options.retry_max_delay, options.retry_jitter)
+
+    def add(entry: FileEntry, attempt: int):
+        abs_path = os.path.join(source, *entry.rel_path.split("/"))
+        try:
+            fsrc = open_for_sequential_read(abs_path) if options.io_hints else open(abs_path, "rb", buffering=0)
+            with fsrc:
+                member = writer.add_file(entry.rel_path, fsrc, os.fstat(fsrc.fileno()))
+        except OSError as e:
+            error_class, transient = classify_error(e)
+            if transient and attempt < options.retry_attempts:
+                retry_queue.schedule(entry, attempt + 1)
+                result.retries += 1
+                emit("file_retry", entry.rel_path, message=f"{error_class}: {e}")
+                return
+            result.failures.append(FailedFile(entry.rel_path, error_class, str(e), attempt + 1))
+            emit("file_failed", entry.rel_path, message=f"{error_class}: {e}")
+            return
+        result.files_copied += 1
+        result.bytes_copied += member.size
+        emit("file_copied", entry.rel_path, member.size)
+
+    try:
+        directories: List[FileEntry] = []
+        for rel_dir, name, st in _walk(source, options.exclude_folders, options.exclude_files, directories):
+            result.files_total += 1
+            add(FileEntry(f"{rel_dir}/{name}" if rel_dir else name, st.st_size, st.st_mtime_ns, st.st_mode), 0)
+        for directory in directories:
+            writer.add_directory(directory)
+        emit("scan_complete", message=f"{result.files_total} files archived")
+
+        while len(retry_queue):
+            item = retry_queue.pop_due()
+            if item is None:
+                time.sleep(min(retry_queue.time_until_next() or 0.05, 1.0))
+                continue
+            add(*item)
+
+        writer.close(result.run_id)
+        if options.catalog:
+            try:
+                with BackupCatalog(catalog_path(os.path.join(dest, META_DIR_NAME))) as catalog:
+                    catalog.record_run(result.run_id, ((m.path, m.size, m.mtime_ns) for m in writer.members),
+                                       "archive", source)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Cannot update catalog for {result.run_id}: {e}")
+    except Exception as e:
+        log_exception(logger, "Archive backup failed")
+        writer.abort()
+        result.failures.append(FailedFile("", classify_error(e)[0], str(e), 1))
+        path = ""
+
+    result.duration_seconds = time.monotonic() - start
+    result.success = not result.failures
+    result.stats["archive"] = path
+    result.stats["archive_members"] = len(writer.members)
+    result.stats["archive_bytes"] = writer.offset
+    emit("run_complete", nbytes=result.bytes_copied,
+         message=f"{result.files_copied} archived, {len(result.failures)} failed")
+    return result
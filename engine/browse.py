@@ -0,0 +1,358 @@
+"""
+Snapshot browsing for the RoboBackup native copy engine
+Directory listings on demand from an index keyed on parent directory
+"""
+
+import json
+import os
+import shutil
+from array import array
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+from utils.logging_utils import get_logger
+from .manifest import Manifest, list_manifests, manifest_dir, manifest_path
+from .paths import ROOT_DIR, PathStore
+from .columnar import NUMPY_AVAILABLE, np, _require_numpy
+from .archive import archive_path, list_archives, open_archive
+from .catalog import run_locations
+from .native import META_DIR_NAME
+
+logger = get_logger(__name__)
+
+BROWSE_VERSION = 1
+BROWSE_SUFFIX = ".browse"
+
+# Directories are numbered breadth-first with siblings sorted by name, so the
+# children of a directory are one contiguous ID range; files are grouped by
+# directory in the same order. Every column is a flat array.
+BROWSE_COLUMNS = (
+    "dir_parent", "dir_name_offsets", "dir_name_data",
+    "dir_child_start", "dir_child_count", "dir_file_start", "dir_file_count",
+    "file_name_offsets", "file_name_data", "file_size", "file_mtime_ns",
+)
+
+
+def _sort_key(name: str) -> Tuple[str, str]:
+    """Listing order: case-insensitive, as Explorer shows it, with a stable tie-break"""
+    return name.lower(), name
+
+
+@dataclass
+class BrowseEntry:
+    """One child of a directory"""
+    name: str
+    path: str
+    is_dir: bool
+    size: int = 0
+    mtime_ns: int = 0
+
+
+@dataclass
+class BrowsePage:
+    """A slice of a directory listing; subdirectories come before files"""
+    directory: str
+    entries: List[BrowseEntry]
+    offset: int
+    total: int
+
+    @property
+    def has_more(self) -> bool:
+        """True if entries follow this page"""
+        return self.offset + len(self.entries) < self.total
+
+
+class SnapshotIndex:
+    """
+    Parent-directory index over one snapshot.
+
+    Listing a directory reads only that directory's rows: its children are a
+    contiguous range of directory IDs and its files a contiguous range of file
+    rows. A saved index is opened with memory-mapped columns, so opening a
+    snapshot of any size costs the same and only the listed pages are read.
+    """
+
+    def __init__(self, run_id: str, columns: dict):
+        """
+        Initialize snapshot index from its columns
+
+        Args:
+            run_id: Run the snapshot belongs to
+            columns: Arrays named as in BROWSE_COLUMNS (array.array, bytes or NumPy arrays)
+        """
+        self.run_id = run_id
+        for name in BROWSE_COLUMNS:
+            setattr(self, name, columns[name])
+
+    @property
+    def file_count(self) -> int:
+        return len(self.file_size)
+
+    @property
+    def dir_count(self) -> int:
+        return len(self.dir_parent)
+
+    @staticmethod
+    def _text(offsets, data, index: int) -> str:
+        start, end = int(offsets[index]), int(offsets[index + 1])
+        return bytes(data[start:end]).decode("utf-8")
+
+    def dir_name(self, dir_id: int) -> str:
+        """Last component of a directory path"""
+        return self._text(self.dir_name_offsets, self.dir_name_data, dir_id)
+
+    def file_name(self, row: int) -> str:
+        """Name of a file row"""
+        return self._text(self.file_name_offsets, self.file_name_data, row)
+
+    @classmethod
+    def from_store(cls, run_id: str, store: PathStore, stat) -> "SnapshotIndex":
+        """
+        Build an index from a PathStore.
+
+        Args:
+            run_id: Run the snapshot belongs to
+            store: Paths of the snapshot
+            stat: Callable mapping a file ID of the store to (size, mtime_ns)
+        """
+        dir_parent = array("q", [-1])
+        dir_names = bytearray()
+        dir_name_offsets = array("q", [0, 0])  # the root has an empty name
+        child_start, child_count = array("q"), array("q")
+        file_start, file_count = array("q"), array("q")
+        file_names = bytearray()
+        file_name_offsets = array("q", [0])
+        sizes, mtimes = array("q"), array("q")
+
+        order = [ROOT_DIR]
+        position = 0
+        while position < len(order):
+            old_id = order[position]
+            children = sorted(store.subdirs_of(old_id), key=lambda d: _sort_key(store.dir_name(d)))
+            child_start.append(len(order))
+            child_count.append(len(children))
+            for child in children:
+                order.append(child)
+                dir_parent.append(position)
+                dir_names.extend(store.dir_name(child).encode("utf-8"))
+                dir_name_offsets.append(len(dir_names))
+
+            files = sorted(((store.name(f), f) for f in store.files_in(old_id)), key=lambda nf: _sort_key(nf[0]))
+            file_start.append(len(sizes))
+            file_count.append(len(files))
+            for name, file_id in files:
+                file_names.extend(name.encode("utf-8"))
+                file_name_offsets.append(len(file_names))
+                size, mtime_ns = stat(file_id)
+                sizes.append(size)
+                mtimes.append(mtime_ns)
+            position += 1
+
+        return cls(run_id, {
+            "dir_parent": dir_parent, "dir_name_offsets": dir_name_offsets, "dir_name_data": bytes(dir_names),
+            "dir_child_start": child_start, "dir_child_count": child_count,
+            "dir_file_start": file_start, "dir_file_count": file_count,
+            "file_name_offsets": file_name_offsets, "file_name_data": bytes(file_names),
+            "file_size": sizes, "file_mtime_ns": mtimes,
+        })
+
+    @classmethod
+    def from_manifest(cls, manifest: Manifest) -> "SnapshotIndex":
+        """Build an index from a run's manifest"""
+        return cls.from_store(manifest.run_id, manifest.paths, manifest.size_mtime)
+
+    @classmethod
+    def from_entries(cls, run_id: str, entries: Iterable[Tuple[str, int, int]]) -> "SnapshotIndex":
+        """Build an index from (path, size, mtime_ns) tuples"""
+        store = PathStore()
+        stats = []
+        for path, size, mtime_ns in entries:
+            store.add(path)
+            stats.append((size, mtime_ns))
+        return cls.from_store(run_id, store, stats.__getitem__)
+
+    def save(self, path: str):
+        """
+        Write the columns as .npy files into a folder, replacing it atomically.
+
+        Args:
+            path: Destination folder, normally ending in BROWSE_SUFFIX
+        """
+        _require_numpy()
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in BROWSE_COLUMNS:
+            column = getattr(self, name)
+            dtype = np.uint8 if name.endswith("_data") else np.int64
+            if isinstance(column, (bytes, bytearray)):
+                column = np.frombuffer(column, dtype=np.uint8)
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(column, dtype=dtype))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": BROWSE_VERSION, "run_id": self.run_id, "files": self.file_count}, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "SnapshotIndex":
+        """
+        Open an index written by save().
+
+        Raises:
+            ValueError: If the folder is not a supported snapshot index
+        """
+        _require_numpy()
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != BROWSE_VERSION:
+            raise ValueError(f"Unsupported snapshot index version in {path}")
+        mode = "r" if mmap else None
+        columns = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mode) for name in BROWSE_COLUMNS}
+        if len(columns["file_size"]) != meta.get("files"):
+            raise ValueError(f"Truncated snapshot index in {path}")
+        return cls(meta.get("run_id", ""), columns)
+
+    def find_dir(self, rel_dir: str) -> Optional[int]:
+        """
+        Look up a directory by binary search through each level's sorted children.
+        Names match case-insensitively.
+
+        Args:
+            rel_dir: '/'-separated directory path, '' for the root
+
+        Returns:
+            Directory ID, or None if the snapshot has no such directory
+        """
+        dir_id = ROOT_DIR
+        for name in rel_dir.replace("\\", "/").strip("/").split("/") if rel_dir.strip("/\\") else ():
+            folded = name.lower()
+            lo = int(self.dir_child_start[dir_id])
+            end = lo + int(self.dir_child_count[dir_id])
+            hi = end
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.dir_name(mid).lower() < folded:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            # Names match case-insensitively, as on Windows; an exact match wins
+            match = None
+            while lo < end and self.dir_name(lo).lower() == folded:
+                if match is None or self.dir_name(lo) == name:
+                    match = lo
+                lo += 1
+            if match is None:
+                return None
+            dir_id = match
+        return dir_id
+
+    def dir_path(self, dir_id: int) -> str:
+        """Relative path of a directory ID, with the snapshot's spelling"""
+        parts = []
+        while dir_id > ROOT_DIR:
+            parts.append(self.dir_name(dir_id))
+            dir_id = int(self.dir_parent[dir_id])
+        return "/".join(reversed(parts))
+
+    def list_dir(self, rel_dir: str = "", offset: int = 0, limit: int = 500) -> BrowsePage:
+        """
+        List one page of a directory.
+
+        Args:
+            rel_dir: '/'-separated directory path, '' for the root
+            offset: Index of the first entry to return
+            limit: Maximum number of entries
+
+        Returns:
+            BrowsePage with subdirectories first, then files, each sorted by name
+
+        Raises:
+            KeyError: If the snapshot has no such directory
+        """
+        dir_id = self.find_dir(rel_dir)
+        if dir_id is None:
+            raise KeyError(rel_dir)
+        directory = self.dir_path(dir_id)
+        prefix = f"{directory}/" if directory else ""
+        child_start, children = int(self.dir_child_start[dir_id]), int(self.dir_child_count[dir_id])
+        file_start, files = int(self.dir_file_start[dir_id]), int(self.dir_file_count[dir_id])
+        total = children + files
+
+        entries = []
+        for index in range(max(0, offset), min(total, offset + limit)):
+            if index < children:
+                name = self.dir_name(child_start + index)
+                entries.append(BrowseEntry(name, prefix + name, True))
+            else:
+                row = file_start + index - children
+                name = self.file_name(row)
+                entries.append(BrowseEntry(name, prefix + name, False, int(self.file_size[row]),
+                                           int(self.file_mtime_ns[row])))
+        return BrowsePage(directory, entries, max(0, offset), total)
+
+
+def browse_path(meta_dir: str, run_id: str) -> str:
+    """Folder of a run's saved snapshot index"""
+    return os.path.join(manifest_dir(meta_dir), run_id + BROWSE_SUFFIX)
+
+
+def list_snapshots(dest: str) -> List[str]:
+    """
+    Run IDs that can be browsed at a destination, oldest first.
+
+    Runs come from manifests, archives, and the catalog's record of archives
+    moved to another storage tier.
+    """
+    meta_dir = os.path.join(dest, META_DIR_NAME)
+    return sorted(set(list_manifests(meta_dir)) | set(list_archives(dest)) | set(run_locations(meta_dir)))
+
+
+def open_snapshot(dest: str, run_id: Optional[str] = None) -> SnapshotIndex:
+    """
+    Open a snapshot of a destination for browsing.
+
+    A saved index is memory-mapped; runs without one are indexed from their
+    manifest or archive index on first open, and the index is saved for next time.
+
+    Args:
+        dest: Job destination folder
+        run_id: Run to open; the latest run if None
+
+    Returns:
+        SnapshotIndex of the run
+
+    Raises:
+        ValueError: If the run has no manifest or archive
+    """
+    meta_dir = os.path.join(dest, META_DIR_NAME)
+    if run_id is None:
+        runs = list_snapshots(dest)
+        if not runs:
+            raise ValueError(f"No snapshots in {dest}")
+        run_id = runs[-1]
+
+    folder = browse_path(meta_dir, run_id)
+    if NUMPY_AVAILABLE and os.path.isdir(folder):
+        try:
+            return SnapshotIndex.load(folder)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable snapshot index {run_id}: {e}")
+
+    if os.path.exists(manifest_path(meta_dir, run_id)):
+        index = SnapshotIndex.from_manifest(Manifest.load(manifest_path(meta_dir, run_id)))
+    elif os.path.exists(archive_path(dest, run_id)) or run_id in run_locations(meta_dir):
+        # Archives moved to another storage tier are read from there
+        with open_archive(dest, run_id) as reader:
+            index = SnapshotIndex.from_entries(
+                run_id, ((m.path, m.size, m.mtime_ns) for m in reader.members.values())
+            )
+    else:
+        raise ValueError(f"No snapshot {run_id} in {dest}")
+
+    # Keep the index so the next open is memory-mapped
+    if NUMPY_AVAILABLE:
+        try:
+            index.save(folder)
+        except OSError as e:
+            logger.debug(f"Cannot save snapshot index {run_id}: {e}")
+    return index
@@ -0,0 +1,113 @@
+"""
+Buffer pool for the RoboBackup native copy engine
+Fixed set of preallocated, page-aligned buffers reused for every chunk read
+"""
+
+import mmap
+import queue
+import threading
+import time
+from typing import Any, Dict
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Buffers start on page boundaries and are a whole number of pages long
+BUFFER_ALIGNMENT = mmap.PAGESIZE
+
+
+def align_up(size: int, alignment: int = BUFFER_ALIGNMENT) -> int:
+    """Round size up to a multiple of alignment"""
+    return (size + alignment - 1) // alignment * alignment
+
+
+class BufferPool:
+    """
+    Fixed pool of reusable read buffers carved out of one anonymous memory map.
+
+    Readers fill a buffer with readinto() and pass memoryview slices of it down
+    the pipeline; the writer releases the buffer once the data is on its way to
+    disk. The pool never grows, so acquire() blocks when every buffer is in use:
+    copy memory is count * size bytes regardless of how many files are copied.
+    """
+
+    def __init__(self, count: int = 32, size: int = 1024 * 1024):
+        """
+        Initialize buffer pool
+
+        Args:
+            count: Number of buffers
+            size: Size of each buffer in bytes, rounded up to the page size
+        """
+        if count < 1:
+            raise ValueError("Buffer pool needs at least one buffer")
+        self.count = count
+        self.size = align_up(max(1, size))
+        # An anonymous map is page-aligned, so every slice at a multiple of size is too
+        self._arena = mmap.mmap(-1, self.count * self.size)
+        self._view = memoryview(self._arena)
+        self._free: "queue.LifoQueue[memoryview]" = queue.LifoQueue()
+        for i in range(self.count):
+            self._free.put(self._view[i * self.size:(i + 1) * self.size])
+        self._lock = threading.Lock()
+        self.acquires = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def budget_bytes(self) -> int:
+        """Total memory held by the pool"""
+        return self.count * self.size
+
+    def acquire(self) -> memoryview:
+        """
+        Take a free buffer, blocking until one is released if the pool is exhausted.
+
+        Returns:
+            A writable memoryview of exactly self.size bytes
+        """
+        try:
+            buf = self._free.get_nowait()
+            waited = 0.0
+        except queue.Empty:
+            start = time.perf_counter()
+            buf = self._free.get()
+            waited = time.perf_counter() - start
+        with self._lock:
+            self.acquires += 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds += waited
+        return buf
+
+    def release(self, buf: memoryview):
+        """Return a buffer obtained from acquire()"""
+        self._free.put(buf)
+
+    def available(self) -> int:
+        """Number of buffers currently free"""
+        return self._free.qsize()
+
+    def stats(self) -> Dict[str, Any]:
+        """Summarize pool usage"""
+        return {
+            "count": self.count,
+            "size": self.size,
+            "budget_bytes": self.budget_bytes,
+            "acquires": self.acquires,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 6),
+        }
+
+    def close(self):
+        """Release the memory map; all buffers must have been returned"""
+        while True:
+            try:
+                self._free.get_nowait().release()
+            except queue.Empty:
+                break
+        try:
+            self._view.release()
+            self._arena.close()
+        except BufferError:
+            logger.warning("Buffer pool closed while buffers were still in use")
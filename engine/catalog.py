@@ -0,0 +1,388 @@
+"""
+Backup catalog for the RoboBackup native copy engine
+SQLite record of the files written by every run, with a trigram index for substring search on names
+"""
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+CATALOG_VERSION = 2
+CATALOG_NAME = "catalog.db"
+
+# Directory ID of the backup root in the dirs table
+ROOT_DIR = 0
+
+# Trigram queries need at least this many characters; shorter ones scan the names table
+MIN_TRIGRAM_QUERY = 3
+
+
+def _fts5_trigram_available() -> bool:
+    """True if the bundled SQLite has FTS5 with the trigram tokenizer (3.34+)"""
+    try:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(x, tokenize='trigram')")
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+FTS5_TRIGRAM_AVAILABLE = _fts5_trigram_available()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    recorded TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    location TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (parent, name)
+);
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    run INTEGER NOT NULL,
+    dir INTEGER NOT NULL,
+    name INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_by_run ON files (run);
+INSERT OR IGNORE INTO dirs (id, parent, name) VALUES (0, -1, '');
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS name_index USING fts5(
+    name, content='names', content_rowid='id', tokenize='trigram'
+);
+"""
+
+
+@dataclass
+class CatalogHit:
+    """One file version found by a catalog search"""
+    path: str
+    size: int
+    mtime_ns: int
+    run_id: str
+
+
+@dataclass
+class CatalogRun:
+    """One run recorded in the catalog"""
+    run_id: str
+    kind: str
+    source: str
+    recorded: str
+    files: int
+    bytes: int
+    location: str = ""  # storage tier the run's data was moved to; '' = the destination itself
+
+
+def _like_pattern(text: str) -> str:
+    """Escape a substring for LIKE ... ESCAPE '\\'"""
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class BackupCatalog:
+    """
+    Catalog of the files each run wrote to a destination.
+
+    Directories and file names are interned, so a file version costs one row of
+    integers. Names are indexed with an FTS5 trigram index when SQLite provides
+    one, which answers substring searches over millions of files without a scan.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open or create a catalog
+
+        Args:
+            path: Database file, normally inside the destination's metadata folder
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._dir_cache: Dict[int, str] = {ROOT_DIR: ""}
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # Version 1 catalogs predate storage tiers
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(runs)")]
+            if "location" not in columns:
+                self._conn.execute("ALTER TABLE runs ADD COLUMN location TEXT NOT NULL DEFAULT ''")
+            self.fts = FTS5_TRIGRAM_AVAILABLE
+            if self.fts:
+                self._conn.executescript(_FTS_SCHEMA)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(CATALOG_VERSION),)
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the database"""
+        self._conn.close()
+
+    def _intern_dir(self, cache: Dict[str, int], rel_dir: str) -> int:
+        """ID of a directory, adding it and its ancestors; the caller holds a transaction"""
+        dir_id = cache.get(rel_dir)
+        if dir_id is not None:
+            return dir_id
+        parent_path, _, name = rel_dir.rpartition("/")
+        parent = self._intern_dir(cache, parent_path) if rel_dir else ROOT_DIR
+        row = self._conn.execute("SELECT id FROM dirs WHERE parent = ? AND name = ?", (parent, name)).fetchone()
+        if row is None:
+            dir_id = self._conn.execute("INSERT INTO dirs (parent, name) VALUES (?, ?)", (parent, name)).lastrowid
+        else:
+            dir_id = row[0]
+        cache[rel_dir] = dir_id
+        return dir_id
+
+    def _intern_name(self, cache: Dict[str, int], name: str) -> int:
+        """ID of a file name, adding it to the name index; the caller holds a transaction"""
+        name_id = cache.get(name)
+        if name_id is not None:
+            return name_id
+        row = self._conn.execute("SELECT id FROM names WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            name_id = self._conn.execute("INSERT INTO names (name) VALUES (?)", (name,)).lastrowid
+            if self.fts:
+                self._conn.execute("INSERT INTO name_index (rowid, name) VALUES (?, ?)", (name_id, name))
+        else:
+            name_id = row[0]
+        cache[name] = name_id
+        return name_id
+
+    def record_run(
+        self,
+        run_id: str,
+        files: Iterable[Tuple[str, int, int]],
+        kind: str = "mirror",
+        source: str = ""
+    ) -> int:
+        """
+        Record the files a run wrote. A resumed run adds to its earlier record.
+
+        Args:
+            run_id: Run ID
+            files: (relative path, size, mtime_ns) of every file the run wrote
+            kind: Destination format of the run
+            source: Source folder of the run
+
+        Returns:
+            Number of files recorded
+        """
+        dirs: Dict[str, int] = {"": ROOT_DIR}
+        names: Dict[str, int] = {}
+        count = total = 0
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is not None:
+                run = row[0]
+            else:
+                run = self._conn.execute(
+                    "INSERT INTO runs (run_id, kind, source, recorded, files, bytes) VALUES (?, ?, ?, ?, 0, 0)",
+                    (run_id, kind, source, datetime.now().isoformat(timespec="seconds"))
+                ).lastrowid
+            batch = []
+            for rel_path, size, mtime_ns in files:
+                parent, _, name = rel_path.rpartition("/")
+                batch.append((run, self._intern_dir(dirs, parent), self._intern_name(names, name), size, mtime_ns))
+                count += 1
+                total += size
+                if len(batch) >= 10000:
+                    self._conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch)
+                    batch.clear()
+            self._conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch)
+            self._conn.execute(
+                "UPDATE runs SET files = files + ?, bytes = bytes + ? WHERE id = ?", (count, total, run)
+            )
+        return count
+
+    def _delete_run(self, run_id: str) -> bool:
+        """Delete a run's rows; the caller holds the lock and a transaction"""
+        row = self._conn.execute("SELECT id FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return False
+        self._conn.execute("DELETE FROM files WHERE run = ?", row)
+        self._conn.execute("DELETE FROM runs WHERE id = ?", row)
+        return True
+
+    def remove_run(self, run_id: str) -> bool:
+        """
+        Forget a run, e.g. after retention deleted it. Interned names and directories are kept.
+
+        Returns:
+            True if the run was in the catalog
+        """
+        with self._lock, self._conn:
+            return self._delete_run(run_id)
+
+    def compact(self, repack_threshold: float = 0.25) -> Dict[str, int]:
+        """
+        Drop names and directories no recorded file refers to any more, and
+        rewrite the database file when enough of it is free pages.
+
+        Args:
+            repack_threshold: Fraction of free pages above which the file is rewritten (VACUUM)
+
+        Returns:
+            Counts of names and directories removed, and 1 under "repacked" if the file was rewritten
+        """
+        with self._lock:
+            with self._conn:
+                dead = self._conn.execute(
+                    "SELECT id, name FROM names WHERE id NOT IN (SELECT DISTINCT name FROM files)"
+                ).fetchall()
+                if self.fts:
+                    self._conn.executemany(
+                        "INSERT INTO name_index (name_index, rowid, name) VALUES ('delete', ?, ?)", dead
+                    )
+                self._conn.executemany("DELETE FROM names WHERE id = ?", [(name_id,) for name_id, _ in dead])
+                # Leaf directories first; a parent becomes a leaf once its last child goes
+                dirs_removed = 0
+                while True:
+                    removed = self._conn.execute(
+                        "DELETE FROM dirs WHERE id != ? AND id NOT IN (SELECT DISTINCT dir FROM files) "
+                        "AND id NOT IN (SELECT DISTINCT parent FROM dirs)", (ROOT_DIR,)
+                    ).rowcount
+                    if not removed:
+                        break
+                    dirs_removed += removed
+            self._dir_cache = {ROOT_DIR: ""}
+            pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            free = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+            repacked = bool(pages) and free / pages >= repack_threshold
+            if repacked:
+                self._conn.execute("VACUUM")
+        return {"names_removed": len(dead), "dirs_removed": dirs_removed, "repacked": int(repacked)}
+
+    def set_location(self, run_id: str, location: str, kind: str = "archive"):
+        """
+        Record where a run's data is stored, e.g. after it was moved to a slower tier.
+
+        Args:
+            run_id: Run ID; a run missing from the catalog is added without files
+            location: Folder or object store URL holding the run, '' for the destination itself
+            kind: Destination format, for runs that are added
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO runs (run_id, kind, source, recorded, files, bytes, location) "
+                "VALUES (?, ?, '', ?, 0, 0, ?) ON CONFLICT (run_id) DO UPDATE SET location = excluded.location",
+                (run_id, kind, datetime.now().isoformat(timespec="seconds"), location)
+            )
+
+    def locations(self) -> Dict[str, str]:
+        """Run ID -> location of the runs stored somewhere other than the destination"""
+        with self._lock:
+            rows = self._conn.execute("SELECT run_id, location FROM runs WHERE location != ''").fetchall()
+        return dict(rows)
+
+    def runs(self) -> List[CatalogRun]:
+        """Recorded runs, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, kind, source, recorded, files, bytes, location FROM runs ORDER BY run_id"
+            ).fetchall()
+        return [CatalogRun(*row) for row in rows]
+
+    def dir_path(self, dir_id: int) -> str:
+        """Relative path of a directory ID"""
+        path = self._dir_cache.get(dir_id)
+        if path is not None:
+            return path
+        parent, name = self._conn.execute("SELECT parent, name FROM dirs WHERE id = ?", (dir_id,)).fetchone()
+        parent_path = self.dir_path(parent)
+        path = f"{parent_path}/{name}" if parent_path else name
+        self._dir_cache[dir_id] = path
+        return path
+
+    def search(self, text: str, run_id: Optional[str] = None, limit: int = 100) -> List[CatalogHit]:
+        """
+        Find file versions whose name contains a substring, newest runs first.
+
+        Args:
+            text: Case-insensitive substring of the file name
+            run_id: Only search this run
+            limit: Maximum number of hits
+
+        Returns:
+            Matching file versions
+        """
+        text = text.strip()
+        if not text:
+            return []
+        if self.fts and len(text) >= MIN_TRIGRAM_QUERY:
+            hits = "SELECT rowid AS id FROM name_index WHERE name_index MATCH ?"
+            argument = '"' + text.replace('"', '""') + '"'
+        else:
+            hits = "SELECT id FROM names WHERE name LIKE ? ESCAPE '\\'"
+            argument = _like_pattern(text)
+        query = (
+            f"WITH hits(id) AS ({hits}) "
+            "SELECT f.dir, n.name, f.size, f.mtime_ns, r.run_id "
+            "FROM hits JOIN files f ON f.name = hits.id JOIN names n ON n.id = f.name JOIN runs r ON r.id = f.run"
+        )
+        args: list = [argument]
+        if run_id is not None:
+            query += " WHERE r.run_id = ?"
+            args.append(run_id)
+        query += " ORDER BY r.run_id DESC, f.dir, n.name LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+            results = []
+            for dir_id, name, size, mtime_ns, found_run in rows:
+                directory = self.dir_path(dir_id)
+                results.append(CatalogHit(f"{directory}/{name}" if directory else name, size, mtime_ns, found_run))
+        return results
+
+
+def catalog_path(meta_dir: str) -> str:
+    """Catalog database of a destination"""
+    return os.path.join(meta_dir, CATALOG_NAME)
+
+
+def run_locations(meta_dir: str) -> Dict[str, str]:
+    """
+    Runs of a destination whose data was moved to another storage tier.
+
+    Returns:
+        Run ID -> folder or object store URL; empty if the destination has no catalog
+    """
+    path = catalog_path(meta_dir)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with BackupCatalog(path) as catalog:
+            return catalog.locations()
+    except sqlite3.Error as e:
+        logger.warning(f"Cannot read run locations from {path}: {e}")
+        return {}
@@ -0,0 +1,256 @@
+"""
+Columnar manifests for the RoboBackup native copy engine
+NumPy arrays of path IDs, sizes, mtimes and hash prefixes for vectorized change detection
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Tuple
+from utils.logging_utils import get_logger
+from .manifest import manifest_dir
+
+# Optional: numpy is only needed for columnar manifests
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = get_logger(__name__)
+
+COLUMNAR_VERSION = 2
+COLUMNAR_SUFFIX = ".cols"
+
+# Column files inside a columnar manifest folder, all sorted by path_id
+COLUMNS = ("path_id", "size", "mtime_ns", "hash_prefix", "path_offsets", "path_data")
+
+
+def path_id(path: str) -> int:
+    """Stable 64-bit ID of a relative path, identical in every manifest"""
+    return int.from_bytes(hashlib.blake2b(path.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hash_prefix(digest: str) -> int:
+    """First 64 bits of a hex content digest, or 0 if the hash is unknown"""
+    return int(digest[:16], 16) if digest else 0
+
+
+def _require_numpy():
+    """Raise if numpy is not installed"""
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("Columnar manifests require numpy")
+
+
+@dataclass
+class ColumnarDiff:
+    """Differences between two columnar manifests as row indices"""
+    added: "np.ndarray"  # rows of the new manifest
+    removed: "np.ndarray"  # rows of the old manifest
+    modified: "np.ndarray"  # rows of the new manifest
+    added_dirs: List[str] = field(default_factory=list)
+    removed_dirs: List[str] = field(default_factory=list)
+
+    @property
+    def unchanged(self) -> bool:
+        """True if the manifests describe the same files and directories"""
+        return not (
+            len(self.added) or len(self.removed) or len(self.modified) or self.added_dirs or self.removed_dirs
+        )
+
+
+class ColumnarManifest:
+    """
+    Manifest held as parallel NumPy columns sorted by path ID.
+
+    Each file costs 32 bytes of fixed-width columns plus its UTF-8 path, and a
+    saved manifest is opened with memory-mapped .npy files, so even tens of
+    millions of entries load without parsing and are paged in on demand.
+    Directory paths, far fewer than files, are kept as a plain list.
+    """
+
+    def __init__(
+        self, run_id: str, path_ids, sizes, mtimes, hash_prefixes, path_offsets, path_data,
+        dirs: Iterable[str] = ()
+    ):
+        """
+        Initialize columnar manifest from already sorted columns
+
+        Args:
+            run_id: Run that produced the manifest
+            path_ids: uint64 path IDs, sorted and unique
+            sizes: int64 file sizes
+            mtimes: int64 modification times in nanoseconds
+            hash_prefixes: uint64 content hash prefixes (0 = unknown)
+            path_offsets: uint64 offsets into path_data, one more than the number of files
+            path_data: uint8 concatenated UTF-8 paths
+            dirs: Relative paths of every directory below the root, empty ones included
+        """
+        self.run_id = run_id
+        self.path_id = path_ids
+        self.size = sizes
+        self.mtime_ns = mtimes
+        self.hash_prefix = hash_prefixes
+        self.path_offsets = path_offsets
+        self.path_data = path_data
+        self.dirs = list(dirs)
+
+    def __len__(self) -> int:
+        return len(self.path_id)
+
+    @classmethod
+    def from_entries(
+        cls, run_id: str, entries: Iterable[Tuple[str, int, int, str]], dirs: Iterable[str] = ()
+    ) -> "ColumnarManifest":
+        """
+        Build a columnar manifest from (path, size, mtime_ns, hash) tuples and directory paths.
+
+        Raises:
+            ValueError: If two paths share a path ID
+        """
+        _require_numpy()
+        paths: List[bytes] = []
+        rows = []
+        for path, size, mtime_ns, digest in entries:
+            paths.append(path.encode("utf-8"))
+            rows.append((path_id(path), size, mtime_ns, hash_prefix(digest)))
+
+        count = len(rows)
+        ids = np.fromiter((r[0] for r in rows), dtype=np.uint64, count=count)
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        if count > 1 and not np.all(ids[1:] != ids[:-1]):
+            raise ValueError("Path ID collision in columnar manifest")
+
+        sizes = np.fromiter((r[1] for r in rows), dtype=np.int64, count=count)[order]
+        mtimes = np.fromiter((r[2] for r in rows), dtype=np.int64, count=count)[order]
+        prefixes = np.fromiter((r[3] for r in rows), dtype=np.uint64, count=count)[order]
+        sorted_paths = [paths[i] for i in order]
+        offsets = np.zeros(count + 1, dtype=np.uint64)
+        np.cumsum([len(p) for p in sorted_paths], out=offsets[1:])
+        data = np.frombuffer(b"".join(sorted_paths), dtype=np.uint8)
+        return cls(run_id, ids, sizes, mtimes, prefixes, offsets, data, dirs)
+
+    @classmethod
+    def from_manifest(cls, manifest) -> "ColumnarManifest":
+        """Convert a Manifest"""
+        return cls.from_entries(
+            manifest.run_id, ((e.path, e.size, e.mtime_ns, e.hash) for e in manifest),
+            (directory for directory in manifest.dirs_under("") if directory)
+        )
+
+    def path(self, row: int) -> str:
+        """Relative path of a row"""
+        start, end = int(self.path_offsets[row]), int(self.path_offsets[row + 1])
+        return self.path_data[start:end].tobytes().decode("utf-8")
+
+    def paths(self, rows) -> List[str]:
+        """Relative paths of several rows"""
+        return [self.path(int(row)) for row in rows]
+
+    def save(self, path: str):
+        """
+        Write the columns as .npy files into a folder, replacing it atomically.
+
+        Args:
+            path: Destination folder, normally ending in COLUMNAR_SUFFIX
+        """
+        _require_numpy()
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in COLUMNS:
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": COLUMNAR_VERSION, "run_id": self.run_id, "count": len(self), "dirs": self.dirs}, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "ColumnarManifest":
+        """
+        Open a columnar manifest written by save().
+
+        Args:
+            path: Manifest folder
+            mmap: Memory-map the columns instead of reading them into memory
+
+        Raises:
+            ValueError: If the folder is not a supported columnar manifest
+        """
+        _require_numpy()
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != COLUMNAR_VERSION:
+            raise ValueError(f"Unsupported columnar manifest version in {path}")
+        mode = "r" if mmap else None
+        columns = [np.load(os.path.join(path, name + ".npy"), mmap_mode=mode) for name in COLUMNS]
+        if len(columns[0]) != meta.get("count"):
+            raise ValueError(f"Truncated columnar manifest in {path}")
+        return cls(meta.get("run_id", ""), *columns, meta.get("dirs", []))
+
+
+def diff_columnar(old: ColumnarManifest, new: ColumnarManifest) -> ColumnarDiff:
+    """
+    Compare two columnar manifests with a vectorized sorted join on path ID.
+
+    Hash prefixes are only compared where both sides know the hash, so a scan
+    without content hashes can be diffed against a hashed manifest.
+
+    Args:
+        old: Previous manifest
+        new: Current manifest
+
+    Returns:
+        ColumnarDiff with row indices of added, removed and modified files, and added and removed directories
+    """
+    _require_numpy()
+    old_dirs, new_dirs = set(old.dirs), set(new.dirs)
+    added_dirs, removed_dirs = sorted(new_dirs - old_dirs), sorted(old_dirs - new_dirs)
+    if len(old) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return ColumnarDiff(np.arange(len(new)), empty, empty, added_dirs, removed_dirs)
+
+    pos = np.searchsorted(old.path_id, new.path_id)
+    np.minimum(pos, len(old) - 1, out=pos)
+    matched = old.path_id[pos] == new.path_id
+
+    rows = np.flatnonzero(matched)
+    at = pos[rows]
+    old_hash, new_hash = old.hash_prefix[at], new.hash_prefix[rows]
+    changed = (
+        (old.size[at] != new.size[rows])
+        | (old.mtime_ns[at] != new.mtime_ns[rows])
+        | ((old_hash != new_hash) & (old_hash != 0) & (new_hash != 0))
+    )
+
+    present = np.zeros(len(old), dtype=bool)
+    present[at] = True
+    return ColumnarDiff(
+        added=np.flatnonzero(~matched),
+        removed=np.flatnonzero(~present),
+        modified=rows[changed],
+        added_dirs=added_dirs,
+        removed_dirs=removed_dirs,
+    )
+
+
+def columnar_path(meta_dir: str, run_id: str) -> str:
+    """Folder of a run's columnar manifest"""
+    return os.path.join(manifest_dir(meta_dir), run_id + COLUMNAR_SUFFIX)
+
+
+def load_columnar(meta_dir: str, run_id: str) -> Optional[ColumnarManifest]:
+    """Open a run's columnar manifest, or None if it is missing, unreadable or numpy is unavailable"""
+    path = columnar_path(meta_dir, run_id)
+    if not NUMPY_AVAILABLE or not os.path.isdir(path):
+        return None
+    try:
+        return ColumnarManifest.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Skipping unreadable columnar manifest {run_id}: {e}")
+        return None
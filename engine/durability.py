@@ -0,0 +1,172 @@
+"""
+Durability utilities for the RoboBackup native copy engine
+Decides when written data is forced to stable storage and accounts for the time spent doing it
+"""
+
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+import time
+from typing import List
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# none: never sync; per_file: fsync every file; batched: sync every N bytes or N seconds;
+# job_end: sync once when the run finishes
+DURABILITY_MODES = ("none", "per_file", "batched", "job_end")
+
+_libc = None
+if sys.platform.startswith("linux"):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(_libc, "syncfs"):
+            _libc = None
+    except OSError:
+        _libc = None
+
+
+def syncfs(path: str) -> bool:
+    """
+    Flush every dirty buffer of the filesystem holding path.
+
+    Uses syncfs(2) on Linux, falling back to os.sync() on other POSIX systems.
+
+    Args:
+        path: Any path on the target filesystem
+
+    Returns:
+        True if a filesystem-wide sync was performed, False if the platform has none (Windows)
+    """
+    if _libc is not None:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if _libc.syncfs(fd) == 0:
+                return True
+            err = ctypes.get_errno()
+            logger.debug(f"syncfs failed on {path}: {os.strerror(err)}")
+        finally:
+            os.close(fd)
+    if hasattr(os, "sync"):
+        os.sync()
+        return True
+    return False
+
+
+def fsync_path(path: str):
+    """Open a closed file again and fsync it (FlushFileBuffers needs write access on Windows)"""
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurabilityManager:
+    """
+    Applies a job's durability policy and measures the time spent in sync calls.
+
+    Workers call sync_file() before closing each file and file_written() once the
+    file has been renamed into place; finish() is called once at the end of the run.
+    """
+
+    def __init__(
+        self,
+        dest: str,
+        mode: str = "job_end",
+        batch_bytes: int = 256 * 1024 * 1024,
+        batch_seconds: float = 30.0
+    ):
+        """
+        Initialize durability manager
+
+        Args:
+            dest: Destination root, used to pick the filesystem to sync
+            mode: One of DURABILITY_MODES
+            batch_bytes: In batched mode, sync after this many bytes (0 disables)
+            batch_seconds: In batched mode, sync after this many seconds (0 disables)
+        """
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Invalid durability mode: {mode}")
+        self.dest = dest
+        self.mode = mode
+        self.batch_bytes = batch_bytes
+        self.batch_seconds = batch_seconds
+        self.sync_seconds = 0.0
+        self.sync_calls = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._pending_bytes = 0
+        self._pending_paths: List[str] = []
+        self._last_sync = time.monotonic()
+
+    def sync_file(self, fileobj):
+        """Flush and fsync an open file when the policy is per_file"""
+        if self.mode != "per_file":
+            return
+        start = time.perf_counter()
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+        self._account(start)
+
+    def file_written(self, path: str, nbytes: int):
+        """
+        Record a completed file and sync the batch if a threshold has been reached.
+
+        Args:
+            path: Final destination path of the file
+            nbytes: Bytes written
+        """
+        if self.mode not in ("batched", "job_end"):
+            return
+        with self._lock:
+            self._pending_bytes += nbytes
+            self._pending_paths.append(path)
+            if self.mode != "batched":
+                return
+            due = (
+                (self.batch_bytes and self._pending_bytes >= self.batch_bytes)
+                or (self.batch_seconds and time.monotonic() - self._last_sync >= self.batch_seconds)
+            )
+            batch = self._take_batch() if due else None
+        # Sync outside the lock so other workers can keep recording files
+        if batch is not None:
+            self._sync(batch)
+
+    def finish(self):
+        """Sync whatever is still pending at the end of the run"""
+        with self._lock:
+            batch = self._take_batch() if self._pending_paths else None
+        if batch is not None:
+            self._sync(batch)
+
+    def _take_batch(self) -> List[str]:
+        """Detach the pending batch; caller must hold the lock"""
+        paths = self._pending_paths
+        self._pending_paths = []
+        self._pending_bytes = 0
+        self._last_sync = time.monotonic()
+        return paths
+
+    def _sync(self, paths: List[str]):
+        """Sync the destination filesystem, or each file where no filesystem-wide sync exists"""
+        start = time.perf_counter()
+        try:
+            if not syncfs(self.dest):
+                for path in paths:
+                    try:
+                        fsync_path(path)
+                    except OSError as e:
+                        logger.warning(f"Cannot fsync {path}: {e}")
+        except OSError as e:
+            logger.warning(f"Sync of {self.dest} failed: {e}")
+        self._account(start)
+
+    def _account(self, start: float):
+        """Add the time since start to the sync statistics"""
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.sync_seconds += elapsed
+            self.sync_calls += 1
@@ -0,0 +1,300 @@
+"""
+Garbage collection for the RoboBackup native copy engine
+Mark-and-sweep over a destination's metadata, with a Bloom filter of live content
+"""
+
+import math
+import os
+import shutil
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+from utils.logging_utils import get_logger, log_exception
+from .manifest import Manifest, list_manifests, manifest_dir, manifest_path
+from .columnar import COLUMNAR_SUFFIX, NUMPY_AVAILABLE, hash_prefix, load_columnar, np
+from .browse import BROWSE_SUFFIX, list_snapshots
+from .archive import ARCHIVE_SUFFIX, ArchiveReader, archive_path
+from .catalog import BackupCatalog, catalog_path
+from .sis import SIS_INDEX_NAME, SingleInstanceIndex
+from .retention import _active_run
+from .native import META_DIR_NAME
+
+logger = get_logger(__name__)
+
+# Keys added per batch when marking with NumPy
+_MARK_BATCH = 1 << 20
+
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit content hash prefixes.
+
+    The keys are already uniformly distributed, so the k probe positions are
+    derived from the key itself by double hashing. A key that was added always
+    tests as present; a key that was not added tests as present with roughly the
+    configured error rate, which during garbage collection only means some dead
+    data is kept until the next pass.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize an empty filter
+
+        Args:
+            capacity: Expected number of keys
+            error_rate: Target false-positive rate at capacity
+            max_bytes: Memory ceiling; a larger capacity raises the error rate instead
+        """
+        capacity = max(1, capacity)
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.size = max(64, min(bits, max_bytes * 8))
+        self.hashes = max(1, min(16, round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+    def _positions(self, key: int) -> Iterable[int]:
+        h1, h2 = key % self.size, (key >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: int):
+        """Add one 64-bit key"""
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def add_many(self, keys):
+        """Add an array of 64-bit keys, vectorized when NumPy is available"""
+        if not NUMPY_AVAILABLE:
+            for key in keys:
+                self.add(int(key))
+            return
+        keys = np.asarray(keys, dtype=np.uint64)
+        view = np.frombuffer(self.bits, dtype=np.uint8)
+        size = np.uint64(self.size)
+        h1, h2 = keys % size, (keys >> np.uint64(32)) | np.uint64(1)
+        for i in range(self.hashes):
+            positions = (h1 + np.uint64(i) * h2) % size
+            np.bitwise_or.at(view, positions >> np.uint64(3),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        self.count += len(keys)
+
+    def __contains__(self, key: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+@dataclass
+class GCReport:
+    """What a garbage collection pass found and removed"""
+    dest: str
+    dry_run: bool = False
+    live_runs: int = 0
+    live_keys: int = 0  # content hashes marked, counting repeats across runs
+    bloom_bytes: int = 0
+    sis_dropped: int = 0
+    deleted: List[str] = field(default_factory=list)
+    bytes_freed: int = 0
+    catalog_runs_removed: int = 0
+    catalog_names_removed: int = 0
+    catalog_repacked: bool = False
+    duration_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "dest": self.dest,
+            "dry_run": self.dry_run,
+            "live_runs": self.live_runs,
+            "live_keys": self.live_keys,
+            "bloom_bytes": self.bloom_bytes,
+            "sis_dropped": self.sis_dropped,
+            "deleted": self.deleted,
+            "bytes_freed": self.bytes_freed,
+            "catalog_runs_removed": self.catalog_runs_removed,
+            "catalog_names_removed": self.catalog_names_removed,
+            "catalog_repacked": self.catalog_repacked,
+            "duration_seconds": round(self.duration_seconds, 3),
+        }
+
+
+def _tree_size(path: str) -> int:
+    """Bytes in a file or folder"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def _mark_run(bloom: BloomFilter, dest: str, run_id: str) -> int:
+    """Add the content hashes of one run to the filter; one run is held in memory at a time"""
+    meta_dir = os.path.join(dest, META_DIR_NAME)
+    columns = load_columnar(meta_dir, run_id)
+    if columns is not None:
+        prefixes = columns.hash_prefix
+        for start in range(0, len(prefixes), _MARK_BATCH):
+            batch = np.asarray(prefixes[start:start + _MARK_BATCH])
+            bloom.add_many(batch[batch != 0])
+        return int(np.count_nonzero(prefixes))
+
+    marked = 0
+    if os.path.exists(manifest_path(meta_dir, run_id)):
+        for entry in Manifest.load(manifest_path(meta_dir, run_id)):
+            if entry.hash:
+                bloom.add(hash_prefix(entry.hash))
+                marked += 1
+    if os.path.exists(archive_path(dest, run_id)):
+        with ArchiveReader(archive_path(dest, run_id)) as reader:
+            for member in reader.members.values():
+                bloom.add(hash_prefix(member.sha256))
+                marked += 1
+    return marked
+
+
+def _capacity(dest: str, sis: SingleInstanceIndex) -> int:
+    """Number of keys to size the filter for: files across recorded runs, or the SIS index"""
+    path = catalog_path(os.path.join(dest, META_DIR_NAME))
+    if os.path.exists(path):
+        try:
+            with BackupCatalog(path) as catalog:
+                return max(len(sis), sum(run.files for run in catalog.runs()))
+        except sqlite3.Error:
+            pass
+    return max(len(sis), 100000)
+
+
+def _orphans(dest: str, live: set, grace_seconds: float, active: Optional[str]) -> List[str]:
+    """
+    Stream the metadata folder and the destination root for objects no live run
+    owns: columnar and snapshot indexes without a manifest or archive, and
+    temporary files older than the grace period left by interrupted writes.
+    Nothing else in the destination root is touched, since it holds backed-up files.
+    """
+    found = []
+    cutoff = time.time() - grace_seconds
+    folder = manifest_dir(os.path.join(dest, META_DIR_NAME))
+    scans = (
+        (folder, (".tmp",), (COLUMNAR_SUFFIX, BROWSE_SUFFIX)),
+        (os.path.join(dest, META_DIR_NAME), (".tmp",), ()),
+        (dest, (ARCHIVE_SUFFIX + ".partial",), ()),
+    )
+    for directory, temporary, owned in scans:
+        try:
+            scanner = os.scandir(directory)
+        except OSError:
+            continue
+        with scanner:
+            for item in scanner:
+                name = item.name
+                if name.endswith(temporary):
+                    # A running job may be writing it
+                    if active is None and item.stat(follow_symlinks=False).st_mtime < cutoff:
+                        found.append(item.path)
+                    continue
+                for suffix in owned:
+                    if name.endswith(suffix) and name[:-len(suffix)] not in live:
+                        found.append(item.path)
+                        break
+    return found
+
+
+def collect_garbage(
+    dest: str,
+    dry_run: bool = False,
+    error_rate: float = 0.001,
+    max_bloom_mb: int = 256,
+    repack_threshold: float = 0.25,
+    grace_seconds: float = 3600
+) -> GCReport:
+    """
+    Mark everything the remaining runs of a destination reference, then sweep the rest.
+
+    Mark: the content hash of every file in every remaining manifest and archive
+    goes into a Bloom filter, one run at a time, so memory is the filter plus one
+    run. Sweep: single-instance index entries whose content is certainly dead are
+    dropped, metadata of runs that no longer exist and stale temporary files are
+    deleted, and the catalog forgets missing runs and is rewritten once enough of
+    it is free space.
+
+    Args:
+        dest: Job destination folder
+        dry_run: Report without changing anything
+        error_rate: Bloom filter false-positive rate; a false positive only keeps garbage
+        max_bloom_mb: Memory ceiling for the filter
+        repack_threshold: Free-page fraction above which the catalog file is rewritten
+        grace_seconds: Temporary files younger than this are left alone
+
+    Returns:
+        GCReport
+    """
+    start = time.monotonic()
+    report = GCReport(dest, dry_run)
+    meta_dir = os.path.join(dest, META_DIR_NAME)
+    active = _active_run(dest)
+    # Includes runs moved to another storage tier, which keep their catalog record and metadata
+    live = set(list_snapshots(dest))
+    if active is not None:
+        live.add(active)
+    report.live_runs = len(live)
+
+    # Mark
+    sis = SingleInstanceIndex.load(os.path.join(meta_dir, SIS_INDEX_NAME))
+    bloom = None
+    # Index entries are recorded in mirror manifests; without any there is nothing to mark them against
+    if len(sis) and list_manifests(meta_dir):
+        bloom = BloomFilter(_capacity(dest, sis), error_rate, max_bloom_mb * 1024 * 1024)
+        report.bloom_bytes = bloom.nbytes
+        for run_id in sorted(live):
+            try:
+                report.live_keys += _mark_run(bloom, dest, run_id)
+            except (OSError, ValueError) as e:
+                # An unreadable run could still reference anything; sweep nothing from the index
+                logger.warning(f"Cannot mark run {run_id}, keeping the single-instance index: {e}")
+                bloom = None
+                break
+
+    # Sweep
+    if bloom is not None:
+        if dry_run:
+            report.sis_dropped = sum(1 for digest in sis.digests() if hash_prefix(digest) not in bloom)
+        else:
+            report.sis_dropped = sis.prune(lambda digest: hash_prefix(digest) in bloom)
+            if report.sis_dropped:
+                sis.save()
+
+    for path in _orphans(dest, live, grace_seconds, active):
+        try:
+            size = _tree_size(path)
+            if not dry_run:
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        except OSError as e:
+            logger.warning(f"Cannot delete {path}: {e}")
+            continue
+        report.deleted.append(path)
+        report.bytes_freed += size
+
+    path = catalog_path(meta_dir)
+    if os.path.exists(path):
+        try:
+            with BackupCatalog(path) as catalog:
+                # Mirror runs leave no trace when manifests are turned off; only drop them if manifests are kept
+                has_manifests = bool(list_manifests(meta_dir))
+                gone = [run.run_id for run in catalog.runs()
+                        if run.run_id not in live and (run.kind == "archive" or has_manifests)]
+                report.catalog_runs_removed = len(gone)
+                if not dry_run:
+                    for run_id in gone:
+                        catalog.remove_run(run_id)
+                    compacted = catalog.compact(repack_threshold)
+                    report.catalog_names_removed = compacted["names_removed"]
+                    report.catalog_repacked = bool(compacted["repacked"])
+        except sqlite3.Error as e:
+            log_exception(logger, f"Cannot collect catalog garbage in {dest}: {e}")
+
+    report.duration_seconds = time.monotonic() - start
+    logger.info(f"Garbage collection of {dest}: {len(report.deleted)} objects, {report.bytes_freed} bytes, "
+                f"{report.sis_dropped} index entries{' (dry run)' if dry_run else ''}")
+    return report
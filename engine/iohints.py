@@ -0,0 +1,59 @@
+"""
+Page-cache hints for the RoboBackup native copy engine
+Keeps backup I/O from evicting the working set of other services on the machine
+"""
+
+import os
+from typing import BinaryIO
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# posix_fadvise exists on Linux and most Unixes, not on Windows or macOS
+FADVISE_AVAILABLE = hasattr(os, "posix_fadvise")
+
+# Windows only: maps to FILE_FLAG_SEQUENTIAL_SCAN
+_O_SEQUENTIAL = getattr(os, "O_SEQUENTIAL", 0)
+
+
+def _fadvise(fd: int, offset: int, length: int, advice_name: str):
+    """Issue one posix_fadvise call; hints are best effort and never fail a copy"""
+    if not FADVISE_AVAILABLE:
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+    except OSError as e:
+        logger.debug(f"posix_fadvise {advice_name} failed: {e}")
+
+
+def open_for_sequential_read(path: str) -> BinaryIO:
+    """
+    Open a file unbuffered and tell the OS it will be read once, front to back.
+
+    Args:
+        path: File to open
+
+    Returns:
+        Raw binary file object supporting readinto()
+    """
+    if _O_SEQUENTIAL:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0) | _O_SEQUENTIAL)
+        return os.fdopen(fd, "rb", buffering=0)
+    fileobj = open(path, "rb", buffering=0)
+    _fadvise(fileobj.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+    return fileobj
+
+
+def advise_willneed(fd: int, offset: int, length: int):
+    """Ask the kernel to start reading a range ahead of time"""
+    _fadvise(fd, offset, length, "POSIX_FADV_WILLNEED")
+
+
+def advise_dontneed(fd: int, offset: int, length: int):
+    """
+    Tell the kernel a range will not be needed again.
+
+    Clean pages are dropped immediately; dirty pages are dropped once written back,
+    so writers repeat the hint for ranges they wrote earlier.
+    """
+    _fadvise(fd, offset, length, "POSIX_FADV_DONTNEED")
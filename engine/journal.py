@@ -0,0 +1,191 @@
+"""
+Job journal for the RoboBackup native copy engine
+Append-only write-ahead log of planned, started and completed work units for crash recovery
+"""
+
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+JOURNAL_VERSION = 1
+
+# Record types, one JSON array per line:
+#   ["B", version, run_id, source, durability]   run begins
+#   ["P", path, size, mtime_ns, mode, atime_ns]   planned file
+#   ["D", path, mtime_ns, mode, atime_ns]   planned directory
+#   ["R"]   plan complete, the journal can be replayed from here on
+#   ["S", path]   copy started
+#   ["C", path]   copy completed and renamed into place
+REC_BEGIN = "B"
+REC_PLANNED = "P"
+REC_DIR = "D"
+REC_READY = "R"
+REC_STARTED = "S"
+REC_COMPLETED = "C"
+
+
+@dataclass
+class JournalState:
+    """Work recorded by an interrupted run"""
+    run_id: str
+    source: str
+    durability: str = ""  # durability mode of the interrupted run; "" if the journal predates it
+    planned: Dict[str, tuple] = field(default_factory=dict)  # path -> (size, mtime_ns, mode, atime_ns)
+    dirs: List[tuple] = field(default_factory=list)  # (path, mtime_ns, mode, atime_ns)
+    started: Set[str] = field(default_factory=set)
+    completed: Set[str] = field(default_factory=set)
+
+    def remaining(self) -> List[str]:
+        """Planned paths that never completed, in plan order"""
+        return [path for path in self.planned if path not in self.completed]
+
+
+class JobJournal:
+    """
+    Append-only journal written alongside a run.
+
+    Records are line-buffered so every completed unit reaches the OS as soon as
+    it is written; they become durable together with the data under the job's
+    durability policy. The journal is deleted when a run finishes, so a journal
+    found at startup always belongs to an interrupted run.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize job journal
+
+        Args:
+            path: Journal file path
+        """
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _write(self, record: list):
+        """Append one record"""
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def begin(self, run_id: str, source: str, durability: str = ""):
+        """Start a fresh journal, replacing any previous one"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8", buffering=1)
+        self._write([REC_BEGIN, JOURNAL_VERSION, run_id, source, durability])
+
+    def reopen(self):
+        """Continue appending to an interrupted run's journal"""
+        self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+
+    def record_plan(self, files: list, dirs: list):
+        """
+        Record the planned work units and mark the plan as complete.
+
+        Args:
+            files: FileEntry objects that will be copied
+            dirs: FileEntry objects for the source directories
+        """
+        for entry in dirs:
+            self._write([REC_DIR, entry.rel_path, entry.mtime_ns, entry.mode, entry.atime_ns])
+        for entry in files:
+            self._write([REC_PLANNED, entry.rel_path, entry.size, entry.mtime_ns, entry.mode, entry.atime_ns])
+        self._write([REC_READY])
+        self.flush()
+
+    def mark_started(self, rel_path: str):
+        """Record that a copy is about to begin"""
+        self._write([REC_STARTED, rel_path])
+
+    def mark_completed(self, rel_path: str):
+        """
+        Record that a file has been renamed into place.
+
+        Only under per_file durability has the data been synced by then; in the
+        other modes the record can outlive the data in a crash, so a resumed run
+        checks the file's content before trusting it.
+        """
+        self._write([REC_COMPLETED, rel_path])
+
+    def flush(self):
+        """Push buffered records to the OS and to stable storage"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close the journal, leaving it on disk"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        """Close and delete the journal once the run has finished"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Cannot remove job journal {self.path}: {e}")
+
+    @staticmethod
+    def load(path: str, source: str) -> Optional[JournalState]:
+        """
+        Replay a journal left behind by an interrupted run.
+
+        Args:
+            path: Journal file path
+            source: Source of the current run; a journal for another source is ignored
+
+        Returns:
+            JournalState, or None if there is no usable journal
+        """
+        if not os.path.exists(path):
+            return None
+
+        state = None
+        ready = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from the crash; everything before it is valid
+                        break
+                    kind = record[0]
+                    if kind == REC_BEGIN:
+                        if record[1] != JOURNAL_VERSION:
+                            return None
+                        state = JournalState(run_id=record[2], source=record[3],
+                                             durability=record[4] if len(record) > 4 else "")
+                    elif state is None:
+                        return None
+                    elif kind == REC_PLANNED:
+                        state.planned[record[1]] = tuple(record[2:6])
+                    elif kind == REC_DIR:
+                        state.dirs.append(tuple(record[1:5]))
+                    elif kind == REC_READY:
+                        ready = True
+                    elif kind == REC_STARTED:
+                        state.started.add(record[1])
+                    elif kind == REC_COMPLETED:
+                        state.completed.add(record[1])
+        except (OSError, IndexError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable job journal {path}: {e}")
+            return None
+
+        if state is None or not ready:
+            # The run died while planning; nothing was copied under this journal
+            return None
+        if os.path.normcase(os.path.abspath(state.source)) != os.path.normcase(os.path.abspath(source)):
+            logger.info(f"Ignoring job journal for a different source: {state.source}")
+            return None
+        return state
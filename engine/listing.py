@@ -0,0 +1,181 @@
+"""
+Cached destination listing for the RoboBackup native copy engine
+Sizes and times of the files at a mirror destination, kept current by the engine so runs need not enumerate it
+"""
+
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from array import array
+from typing import Iterable, Iterator, List, Optional, Tuple
+from utils.logging_utils import get_logger
+from .paths import PathStore
+
+logger = get_logger(__name__)
+
+LISTING_VERSION = 1
+LISTING_NAME = "listing.json.gz"
+
+# Size of a path that was deleted after it was listed
+_REMOVED = -1
+
+
+class DestinationListing:
+    """
+    Relative path -> (size, mtime_ns) of every file at a mirror destination.
+
+    The engine records each file it writes, links or deletes, so the listing
+    stays current without enumerating the destination. Changes made outside
+    the engine are caught by check_sample() on every run and by a full
+    re-enumeration (replace()) once the listing is older than its
+    revalidation period. Lookups ignore case, as Windows shares do.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize an empty listing
+
+        Args:
+            path: Listing file, normally inside the destination's metadata folder
+        """
+        self.path = path
+        self.listed_at = 0.0  # time of the last full enumeration; 0 = never
+        self._paths = PathStore()
+        self._sizes = array("q")
+        self._mtimes = array("q")
+        self._live = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._live
+
+    def age_seconds(self) -> float:
+        """Seconds since the destination was last enumerated"""
+        return time.time() - self.listed_at if self.listed_at else float("inf")
+
+    def _add(self, rel_path: str, size: int, mtime_ns: int):
+        """Record a path; the caller holds the lock"""
+        file_id = self._paths.find(rel_path, casefold=True)
+        if file_id is None:
+            self._paths.add(rel_path)
+            self._sizes.append(size)
+            self._mtimes.append(mtime_ns)
+            self._live += 1
+            return
+        if self._sizes[file_id] == _REMOVED:
+            self._live += 1
+        self._sizes[file_id] = size
+        self._mtimes[file_id] = mtime_ns
+
+    def get(self, rel_path: str) -> Optional[Tuple[int, int]]:
+        """(size, mtime_ns) of a listed file, or None if it is not at the destination"""
+        with self._lock:
+            file_id = self._paths.find(rel_path, casefold=True)
+            if file_id is None or self._sizes[file_id] == _REMOVED:
+                return None
+            return self._sizes[file_id], self._mtimes[file_id]
+
+    def record(self, rel_path: str, size: int, mtime_ns: int):
+        """Record a file written at the destination"""
+        with self._lock:
+            self._add(rel_path, size, mtime_ns)
+
+    def forget(self, rel_path: str):
+        """Record a file deleted from the destination"""
+        with self._lock:
+            file_id = self._paths.find(rel_path, casefold=True)
+            if file_id is not None and self._sizes[file_id] != _REMOVED:
+                self._sizes[file_id] = _REMOVED
+                self._live -= 1
+
+    def paths(self) -> List[str]:
+        """Snapshot of the listed paths"""
+        with self._lock:
+            return [path for file_id, path in enumerate(self._paths) if self._sizes[file_id] != _REMOVED]
+
+    def _items(self) -> Iterator[Tuple[str, int, int]]:
+        """(path, size, mtime_ns) of every listed file; the caller holds the lock"""
+        for file_id, path in enumerate(self._paths):
+            if self._sizes[file_id] != _REMOVED:
+                yield path, self._sizes[file_id], self._mtimes[file_id]
+
+    def replace(self, files: Iterable[Tuple[str, int, int]]):
+        """
+        Replace the whole listing with a fresh enumeration of the destination.
+
+        Args:
+            files: (rel_path, size, mtime_ns) of every file at the destination
+        """
+        with self._lock:
+            self._paths = PathStore()
+            self._sizes = array("q")
+            self._mtimes = array("q")
+            self._live = 0
+            for rel_path, size, mtime_ns in files:
+                self._add(rel_path, size, mtime_ns)
+            self.listed_at = time.time()
+
+    def invalidate(self):
+        """Make the next run enumerate the destination again"""
+        self.listed_at = 0.0
+
+    def check_sample(self, dest: str, count: int, tolerance_ns: int = 0) -> List[str]:
+        """
+        Stat a random sample of listed files and report those that changed.
+
+        Args:
+            dest: Destination root the listed paths are relative to
+            count: Number of files to check
+            tolerance_ns: Timestamp difference still considered equal
+
+        Returns:
+            Paths whose file is missing or has another size or time than listed
+        """
+        with self._lock:
+            live = [file_id for file_id in range(len(self._sizes)) if self._sizes[file_id] != _REMOVED]
+            sample = random.sample(live, min(count, len(live)))
+            expected = [(self._paths.path(i), self._sizes[i], self._mtimes[i]) for i in sample]
+
+        changed = []
+        for rel_path, size, mtime_ns in expected:
+            try:
+                st = os.stat(os.path.join(dest, *rel_path.split("/")))
+            except OSError:
+                changed.append(rel_path)
+                continue
+            if st.st_size != size or abs(st.st_mtime_ns - mtime_ns) > tolerance_ns:
+                changed.append(rel_path)
+        return changed
+
+    def save(self):
+        """Write the listing atomically as gzip-compressed JSON"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with self._lock:
+            rows = [list(item) for item in self._items()]
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"version": LISTING_VERSION, "listed_at": self.listed_at, "entries": rows},
+                      f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, path: str) -> "DestinationListing":
+        """Read a listing written by save(); a missing or unreadable file gives an empty, never-listed one"""
+        listing = cls(path)
+        if not os.path.exists(path):
+            return listing
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != LISTING_VERSION:
+                raise ValueError("unsupported version")
+            for rel_path, size, mtime_ns in data["entries"]:
+                listing._add(rel_path, size, mtime_ns)
+            listing.listed_at = float(data["listed_at"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable destination listing {path}: {e}")
+            return cls(path)
+        return listing
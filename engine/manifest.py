@@ -0,0 +1,311 @@
+"""
+Backup manifests for the RoboBackup native copy engine
+Records the files of each run with a Merkle-style digest per directory
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from utils.logging_utils import get_logger
+from .paths import ROOT_DIR, PathStore
+
+logger = get_logger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".json.gz"
+
+
+@dataclass
+class ManifestEntry:
+    """One file as it exists at the destination"""
+    path: str
+    size: int
+    mtime_ns: int
+    hash: str = ""  # content digest if known
+
+
+@dataclass
+class ManifestDiff:
+    """Differences between two manifests"""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    added_dirs: List[str] = field(default_factory=list)
+    removed_dirs: List[str] = field(default_factory=list)
+    pruned_dirs: int = 0  # identical subtrees skipped with a single comparison
+
+    @property
+    def unchanged(self) -> bool:
+        """True if the manifests describe the same files and directories"""
+        return not (self.added or self.removed or self.modified or self.added_dirs or self.removed_dirs)
+
+
+class Manifest:
+    """
+    Set of files with a digest for every directory.
+
+    A directory digest covers the sorted (name, size, mtime, hash) of its files
+    and the (name, digest) of its subdirectories, so two directories with the
+    same digest have identical contents all the way down and can be skipped
+    without looking at a single child. Empty directories added with add_dir()
+    are part of the tree, so the root digest covers them too.
+
+    Paths live in a PathStore and sizes and mtimes in typed arrays, so a
+    manifest costs a few dozen bytes per file; ManifestEntry objects are only
+    built when an entry is read.
+    """
+
+    def __init__(self, run_id: str = "", entries: Optional[Iterable[ManifestEntry]] = None):
+        """
+        Initialize manifest
+
+        Args:
+            run_id: Run that produced the manifest
+            entries: Initial entries
+        """
+        self.run_id = run_id
+        self.created = datetime.now().isoformat()
+        self.paths = PathStore()
+        self._sizes = array("q")
+        self._mtimes = array("q")
+        self._hashes: List[str] = []
+        self._dir_hashes: Optional[Dict[int, str]] = None
+        for entry in entries or []:
+            self.add(entry)
+
+    def add(self, entry: ManifestEntry):
+        """Append an entry; a manifest holds each path once, so callers must not repeat one"""
+        self.paths.add(entry.path)
+        self._sizes.append(entry.size)
+        self._mtimes.append(entry.mtime_ns)
+        self._hashes.append(entry.hash or "")
+        self._dir_hashes = None
+
+    def add_dir(self, path: str):
+        """Record a directory, so it is part of the tree even when no file lies below it"""
+        self.paths.intern_dir(path)
+        self._dir_hashes = None
+
+    def _entry(self, file_id: int, path: Optional[str] = None) -> ManifestEntry:
+        """Build the entry for a file ID"""
+        return ManifestEntry(
+            path if path is not None else self.paths.path(file_id),
+            self._sizes[file_id], self._mtimes[file_id], self._hashes[file_id]
+        )
+
+    def size_mtime(self, file_id: int) -> Tuple[int, int]:
+        """Size and mtime_ns of a file ID"""
+        return self._sizes[file_id], self._mtimes[file_id]
+
+    def get(self, path: str) -> Optional[ManifestEntry]:
+        """Look up an entry by relative path"""
+        file_id = self.paths.find(path)
+        return self._entry(file_id, path) if file_id is not None else None
+
+    def hash_if_unchanged(self, path: str, size: int, mtime_ns: int) -> str:
+        """Return the recorded content hash if size and mtime still match, else an empty string"""
+        file_id = self.paths.find(path)
+        if file_id is not None and self._sizes[file_id] == size and self._mtimes[file_id] == mtime_ns:
+            return self._hashes[file_id]
+        return ""
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self) -> Iterator[ManifestEntry]:
+        """Every entry in insertion order"""
+        for file_id, path in enumerate(self.paths):
+            yield self._entry(file_id, path)
+
+    def _ensure_tree(self):
+        """Compute the directory digests if entries changed since the last build"""
+        if self._dir_hashes is None:
+            self._build_tree()
+
+    def _build_tree(self):
+        """Compute every directory digest bottom-up"""
+        store = self.paths
+        depth = [0] * store.dir_count
+        for dir_id in range(1, store.dir_count):
+            # Parents are always interned before their children
+            depth[dir_id] = depth[store.dir_parent(dir_id)] + 1
+
+        dir_hashes: Dict[int, str] = {}
+        for dir_id in sorted(range(store.dir_count), key=depth.__getitem__, reverse=True):
+            digest = hashlib.sha256()
+            files = sorted((store.name(f), f) for f in store.files_in(dir_id))
+            for name, f in files:
+                digest.update(f"F\0{name}\0{self._sizes[f]}\0{self._mtimes[f]}\0{self._hashes[f]}\n".encode("utf-8"))
+            for name, child in sorted((store.dir_name(c), c) for c in store.subdirs_of(dir_id)):
+                digest.update(f"D\0{name}\0{dir_hashes[child]}\n".encode("utf-8"))
+            dir_hashes[dir_id] = digest.hexdigest()
+        self._dir_hashes = dir_hashes
+
+    @property
+    def dir_hashes(self) -> Dict[str, str]:
+        """Digest of every directory, keyed by relative path ('' is the root)"""
+        self._ensure_tree()
+        return {self.paths.dir_path(dir_id): digest for dir_id, digest in self._dir_hashes.items()}
+
+    def dir_hash(self, directory: str) -> Optional[str]:
+        """Digest of one directory, or None if it is not in the manifest"""
+        self._ensure_tree()
+        dir_id = self.paths.find_dir(directory)
+        return self._dir_hashes.get(dir_id) if dir_id is not None else None
+
+    @property
+    def root_hash(self) -> str:
+        """Digest of the whole tree"""
+        self._ensure_tree()
+        return self._dir_hashes[ROOT_DIR]
+
+    def files_in(self, directory: str) -> Dict[str, ManifestEntry]:
+        """Files directly inside a directory, keyed by name"""
+        dir_id = self.paths.find_dir(directory)
+        if dir_id is None:
+            return {}
+        prefix = f"{directory}/" if directory else ""
+        return {
+            name: self._entry(file_id, prefix + name)
+            for name, file_id in self.paths.names_in(dir_id).items()
+        }
+
+    def subdirs_of(self, directory: str) -> Set[str]:
+        """Names of the subdirectories directly inside a directory"""
+        dir_id = self.paths.find_dir(directory)
+        if dir_id is None:
+            return set()
+        return {self.paths.dir_name(child) for child in self.paths.subdirs_of(dir_id)}
+
+    def files_under(self, directory: str) -> Iterable[str]:
+        """Every file path in a subtree"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            yield from (entry.path for entry in self.files_in(current).values())
+            for name in self.subdirs_of(current):
+                stack.append(f"{current}/{name}" if current else name)
+
+    def dirs_under(self, directory: str) -> Iterable[str]:
+        """A directory and every directory below it"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            yield current
+            stack.extend(f"{current}/{name}" if current else name for name in self.subdirs_of(current))
+
+    def to_dict(self) -> dict:
+        """Convert the manifest to a JSON-serializable dictionary"""
+        return {
+            "version": MANIFEST_VERSION,
+            "run_id": self.run_id,
+            "created": self.created,
+            "root_hash": self.root_hash,
+            "dirs": self.dir_hashes,
+            "files": [[e.path, e.size, e.mtime_ns, e.hash] for e in self],
+        }
+
+    def save(self, path: str):
+        """Write the manifest atomically as gzip-compressed JSON"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        """
+        Read a manifest written by save().
+
+        Raises:
+            ValueError: If the file is not a supported manifest
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version in {path}")
+        manifest = cls(data.get("run_id", ""))
+        manifest.created = data.get("created", manifest.created)
+        for directory in data.get("dirs", {}):
+            manifest.add_dir(directory)
+        for path_, size, mtime_ns, digest in data["files"]:
+            manifest.add(ManifestEntry(path_, size, mtime_ns, digest))
+        return manifest
+
+
+def diff_manifests(old: Manifest, new: Manifest) -> ManifestDiff:
+    """
+    Compare two manifests, skipping every subtree whose digest is unchanged.
+
+    Args:
+        old: Previous manifest
+        new: Current manifest
+
+    Returns:
+        ManifestDiff with added, removed and modified file paths, and added and removed directories
+    """
+    result = ManifestDiff()
+    stack = [""]
+    while stack:
+        directory = stack.pop()
+        if old.dir_hash(directory) == new.dir_hash(directory):
+            result.pruned_dirs += 1
+            continue
+
+        old_files, new_files = old.files_in(directory), new.files_in(directory)
+        for name, entry in new_files.items():
+            before = old_files.get(name)
+            if before is None:
+                result.added.append(entry.path)
+            elif (before.size, before.mtime_ns, before.hash) != (entry.size, entry.mtime_ns, entry.hash):
+                result.modified.append(entry.path)
+        for name, entry in old_files.items():
+            if name not in new_files:
+                result.removed.append(entry.path)
+
+        old_dirs, new_dirs = old.subdirs_of(directory), new.subdirs_of(directory)
+        for name in old_dirs | new_dirs:
+            child = f"{directory}/{name}" if directory else name
+            if name in old_dirs and name in new_dirs:
+                stack.append(child)
+            elif name in new_dirs:
+                result.added.extend(new.files_under(child))
+                result.added_dirs.extend(new.dirs_under(child))
+            else:
+                result.removed.extend(old.files_under(child))
+                result.removed_dirs.extend(old.dirs_under(child))
+    return result
+
+
+def manifest_dir(meta_dir: str) -> str:
+    """Folder holding the per-run manifests inside the destination's metadata folder"""
+    return os.path.join(meta_dir, "manifests")
+
+
+def list_manifests(meta_dir: str) -> List[str]:
+    """Run IDs that have a manifest, oldest first"""
+    folder = manifest_dir(meta_dir)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name[:-len(MANIFEST_SUFFIX)] for name in os.listdir(folder) if name.endswith(MANIFEST_SUFFIX))
+
+
+def manifest_path(meta_dir: str, run_id: str) -> str:
+    """Path of a run's manifest"""
+    return os.path.join(manifest_dir(meta_dir), run_id + MANIFEST_SUFFIX)
+
+
+def load_latest_manifest(meta_dir: str) -> Optional[Manifest]:
+    """Load the newest readable manifest, or None if there is none"""
+    for run_id in reversed(list_manifests(meta_dir)):
+        try:
+            return Manifest.load(manifest_path(meta_dir, run_id))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Skipping unreadable manifest {run_id}: {e}")
+    return None
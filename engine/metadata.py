@@ -0,0 +1,113 @@
+"""
+Metadata utilities for the RoboBackup native copy engine
+Queues timestamp and attribute updates and applies them in a batched pass after the data phase
+"""
+
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import groupby
+from typing import List
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class MetadataUpdate:
+    """Timestamps and permission bits to apply to one destination path"""
+    path: str
+    atime_ns: int
+    mtime_ns: int
+    mode: int
+    is_dir: bool = False
+    depth: int = 0
+
+
+def apply_metadata(update: MetadataUpdate):
+    """
+    Apply one queued update.
+
+    Timestamps are set before permissions so a read-only mode cannot block the utime call.
+
+    Args:
+        update: The update to apply
+
+    Raises:
+        OSError: If the destination path cannot be updated
+    """
+    os.utime(update.path, ns=(update.atime_ns, update.mtime_ns))
+    if not update.is_dir:
+        os.chmod(update.path, stat.S_IMODE(update.mode))
+
+
+class MetadataQueue:
+    """
+    Collects metadata updates while data is being copied and applies them afterwards.
+
+    File updates are applied in parallel in path order. Directory timestamps are applied
+    bottom-up, deepest level first, because writing into a directory changes its mtime.
+    """
+
+    def __init__(self, workers: int = 4):
+        """
+        Initialize metadata queue
+
+        Args:
+            workers: Number of threads used to apply updates
+        """
+        self.workers = max(1, workers)
+        self._files: List[MetadataUpdate] = []
+        self._dirs: List[MetadataUpdate] = []
+        self._lock = threading.Lock()
+        self.applied = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def add(self, update: MetadataUpdate):
+        """Queue an update for the metadata pass"""
+        with self._lock:
+            if update.is_dir:
+                self._dirs.append(update)
+            else:
+                self._files.append(update)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._files) + len(self._dirs)
+
+    def _apply_one(self, update: MetadataUpdate) -> bool:
+        try:
+            apply_metadata(update)
+            return True
+        except OSError as e:
+            logger.warning(f"Cannot set metadata on {update.path}: {e}")
+            return False
+
+    def _apply_batch(self, executor: ThreadPoolExecutor, updates: List[MetadataUpdate]):
+        for ok in executor.map(self._apply_one, updates):
+            if ok:
+                self.applied += 1
+            else:
+                self.failed += 1
+
+    def apply_all(self):
+        """Apply every queued update: files first, then directories from the deepest level up"""
+        start = time.perf_counter()
+        with self._lock:
+            files, self._files = self._files, []
+            dirs, self._dirs = self._dirs, []
+
+        files.sort(key=lambda u: u.path)
+        dirs.sort(key=lambda u: -u.depth)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="metadata") as executor:
+            self._apply_batch(executor, files)
+            # Each level completes before its parents are touched
+            for _, level in groupby(dirs, key=lambda u: u.depth):
+                self._apply_batch(executor, list(level))
+
+        self.seconds += time.perf_counter() - start
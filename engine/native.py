@@ -0,0 +1,1448 @@
+"""
+Native copy engine for RoboBackup Tool
+Pure-Python alternative to robocopy with a worker pool and deferred per-file retries
+"""
+
+import filecmp
+import fnmatch
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dataclasses import dataclass, field, asdict
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set
+from utils.logging_utils import get_logger, log_exception
+from utils.path_utils import ensure_directory_exists
+from .retry import RetryQueue, classify_error
+from .space import check_free_space, preallocate
+from .durability import DURABILITY_MODES, DurabilityManager
+from .metadata import MetadataQueue, MetadataUpdate
+from .journal import JobJournal, JournalState
+from .pipeline import CHUNK_TRANSFORMS, TRANSFORMS, CopyPipeline, CopyUnit, iter_decoded_chunks
+from .iohints import open_for_sequential_read
+from .manifest import Manifest, ManifestEntry, diff_manifests, list_manifests, load_latest_manifest, manifest_path
+from .paths import PathStore
+from .columnar import NUMPY_AVAILABLE, ColumnarManifest, columnar_path, diff_columnar, load_columnar
+from .sis import SIS_INDEX_NAME, SingleInstanceIndex, hash_file
+from .catalog import BackupCatalog, catalog_path
+from .listing import LISTING_NAME, DestinationListing
+
+logger = get_logger(__name__)
+
+# Suffix used for files that are still being written
+PARTIAL_SUFFIX = ".rbpart"
+
+# Folder at the destination root holding engine state (journal, manifests)
+META_DIR_NAME = ".robobackup"
+
+# Destination entries the engine never mirrors or purges
+PROTECTED_DEST_NAMES = {"#backup_logs", META_DIR_NAME}
+
+# Record of the chunk transforms a mirror destination's files are written with
+FORMAT_NAME = "format.json"
+
+# Timestamp tolerance used for /FFT-style comparisons (FAT file times have 2s granularity)
+FFT_TOLERANCE_NS = 2_000_000_000
+
+# How a run is laid out at the destination
+DESTINATION_FORMATS = ("mirror", "archive")
+
+
+@dataclass
+class EngineOptions:
+    """Tunable options for a native engine run"""
+    workers: int = 4
+    mirror: bool = True  # delete destination files that no longer exist in the source (/MIR)
+    fft: bool = True  # assume FAT file times, 2-second granularity (/FFT)
+    chunk_size: int = 1024 * 1024
+    buffer_count: int = 32  # pooled read buffers; copy memory is buffer_count * chunk_size
+    io_hints: bool = False  # page-cache hints so backups do not evict other services' data
+    retry_attempts: int = 3
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 60.0
+    retry_jitter: float = 0.5
+    free_space_policy: str = "refuse"  # off, warn, refuse
+    free_space_reserve_bytes: int = 0
+    preallocate: bool = True
+    preallocate_min_bytes: int = 8 * 1024 * 1024
+    durability: str = "job_end"  # none, per_file, batched, job_end
+    sync_every_bytes: int = 256 * 1024 * 1024
+    sync_every_seconds: float = 30.0
+    journal: bool = True
+    writers: int = 2
+    transforms: List[str] = field(default_factory=list)  # hash, compress, encrypt
+    cpu_workers: int = 0  # 0 = one per CPU
+    cpu_executor: str = "process"  # process, thread
+    queue_depth: int = 16
+    encryption_key: Optional[bytes] = None
+    manifest: bool = True  # write a manifest of every completed run
+    trust_manifest: bool = False  # plan against the last manifest instead of stat-ing the destination
+    columnar_manifest: bool = True  # also save manifests as NumPy columns for vectorized diffs
+    dest_listing: bool = False  # plan and purge against a cached destination listing instead of enumerating it
+    dest_listing_revalidate_days: float = 7.0  # enumerate the destination again once the listing is this old
+    dest_listing_sample: int = 256  # listed files stat-ed per run to catch changes made outside the engine
+    single_instance: bool = False  # hard-link files whose content is already stored at the destination
+    single_instance_min_bytes: int = 64 * 1024
+    destination_format: str = "mirror"  # mirror: a copy of the tree, archive: one seekable archive per run
+    catalog: bool = True  # record the files each run writes in a searchable catalog
+    parity_percent: int = 0  # Reed-Solomon parity sidecars with this overhead; 0 = none
+    parity_min_bytes: int = 64 * 1024 * 1024  # mirror files below this get no sidecar
+    exclude_folders: List[str] = field(default_factory=list)
+    exclude_files: List[str] = field(default_factory=list)
+
+    def validate(self) -> tuple[bool, str]:
+        """Validate engine options"""
+        if self.workers < 1:
+            return False, "Engine workers must be at least 1"
+        if self.chunk_size < 4096:
+            return False, "Chunk size must be at least 4096 bytes"
+        if self.buffer_count < 1:
+            return False, "Buffer count must be at least 1"
+        if self.retry_attempts < 0:
+            return False, "Retry attempts cannot be negative"
+        if self.retry_base_delay < 0 or self.retry_max_delay < self.retry_base_delay:
+            return False, "Retry delays must satisfy 0 <= base delay <= max delay"
+        if not 0 <= self.retry_jitter <= 1:
+            return False, "Retry jitter must be between 0 and 1"
+        if self.free_space_policy not in ("off", "warn", "refuse"):
+            return False, "Free space policy must be one of: off, warn, refuse"
+        if self.free_space_reserve_bytes < 0 or self.preallocate_min_bytes < 0:
+            return False, "Free space reserve and preallocation threshold cannot be negative"
+        if self.single_instance_min_bytes < 0:
+            return False, "Single-instance threshold cannot be negative"
+        if self.durability not in DURABILITY_MODES:
+            return False, f"Durability must be one of: {', '.join(DURABILITY_MODES)}"
+        if self.sync_every_bytes < 0 or self.sync_every_seconds < 0:
+            return False, "Sync thresholds cannot be negative"
+        if self.writers < 1 or self.queue_depth < 1 or self.cpu_workers < 0:
+            return False, "Writers and queue depth must be at least 1, CPU workers cannot be negative"
+        unknown = [t for t in self.transforms if t not in TRANSFORMS]
+        if unknown:
+            return False, f"Unknown transforms: {', '.join(unknown)}"
+        if "encrypt" in self.transforms and not self.encryption_key:
+            return False, "The encrypt transform requires an encryption key"
+        if self.cpu_executor not in ("process", "thread"):
+            return False, "CPU executor must be 'process' or 'thread'"
+        if self.destination_format not in DESTINATION_FORMATS:
+            return False, f"Destination format must be one of: {', '.join(DESTINATION_FORMATS)}"
+        if self.destination_format == "archive" and "encrypt" in self.transforms:
+            return False, "Archive destinations do not support the encrypt transform"
+        if not 0 <= self.parity_percent <= 100 or self.parity_min_bytes < 0:
+            return False, "Parity overhead must be between 0 and 100 percent and its threshold not negative"
+        if self.dest_listing_revalidate_days < 0 or self.dest_listing_sample < 0:
+            return False, "Destination listing revalidation period and sample size cannot be negative"
+        return True, ""
+
+    @classmethod
+    def from_job_config(cls, job: Any) -> "EngineOptions":
+        """Build engine options from a BackupJobConfig"""
+        return cls(
+            workers=job.engine_workers,
+            chunk_size=job.engine_chunk_size_kb * 1024,
+            buffer_count=job.engine_buffer_count,
+            io_hints=job.engine_io_hints,
+            mirror="/MIR" in job.robocopy_flags.upper().split(),
+            fft="/FFT" in job.robocopy_flags.upper().split(),
+            retry_attempts=job.engine_retry_attempts,
+            retry_base_delay=job.engine_retry_base_delay,
+            retry_max_delay=job.engine_retry_max_delay,
+            free_space_policy=job.engine_free_space_policy,
+            free_space_reserve_bytes=job.engine_free_space_reserve_mb * 1024 * 1024,
+            preallocate=job.engine_preallocate,
+            durability=job.engine_durability,
+            sync_every_bytes=job.engine_sync_every_mb * 1024 * 1024,
+            sync_every_seconds=job.engine_sync_every_seconds,
+            journal=job.engine_journal,
+            writers=job.engine_writers,
+            transforms=list(job.engine_transforms),
+            manifest=job.engine_manifest,
+            trust_manifest=job.engine_trust_manifest,
+            columnar_manifest=job.engine_columnar_manifest,
+            dest_listing=job.engine_dest_listing,
+            dest_listing_revalidate_days=job.engine_dest_listing_revalidate_days,
+            dest_listing_sample=job.engine_dest_listing_sample,
+            single_instance=job.engine_single_instance,
+            single_instance_min_bytes=job.engine_single_instance_min_kb * 1024,
+            destination_format=job.engine_destination_format,
+            catalog=job.engine_catalog,
+            parity_percent=job.engine_parity_percent,
+            parity_min_bytes=job.engine_parity_min_mb * 1024 * 1024,
+            exclude_folders=list(job.exclude_folders),
+            exclude_files=list(job.exclude_files),
+        )
+
+
+@dataclass
+class FileEntry:
+    """A regular file (or, when collected separately, a directory) discovered in the source tree"""
+    rel_path: str
+    size: int
+    mtime_ns: int
+    mode: int
+    atime_ns: int = 0
+
+
+@dataclass
+class FailedFile:
+    """A file that could not be copied after all retries"""
+    path: str
+    error_class: str
+    message: str
+    attempts: int
+
+
+@dataclass
+class EngineEvent:
+    """Progress event emitted by the engine"""
+    kind: str  # scan_complete, file_copied, file_retry, file_failed, run_complete
+    path: str = ""
+    bytes: int = 0
+    message: str = ""
+
+
+@dataclass
+class RunResult:
+    """Outcome of a native engine run"""
+    success: bool = False
+    run_id: str = ""
+    files_total: int = 0
+    files_copied: int = 0
+    files_skipped: int = 0
+    files_deleted: int = 0
+    bytes_copied: int = 0
+    retries: int = 0
+    duration_seconds: float = 0.0
+    failures: List[FailedFile] = field(default_factory=list)
+    stats: Dict[str, Any] = field(default_factory=dict)
+    log_file: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the result to a JSON-serializable dictionary"""
+        return asdict(self)
+
+
+def _matches_any(name: str, patterns: List[str]) -> bool:
+    """Case-insensitive wildcard match of a file or folder name against exclude patterns"""
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, pattern.lower()) for pattern in patterns)
+
+
+def is_excluded_dir(rel_path: str, name: str, exclude_folders: List[str]) -> bool:
+    """Return True if a directory matches an exclude pattern by name or relative path (/XD)"""
+    rel = rel_path.replace("\\", "/").lower()
+    for pattern in exclude_folders:
+        pattern = pattern.replace("\\", "/").rstrip("/").lower()
+        if fnmatch.fnmatchcase(name.lower(), pattern) or fnmatch.fnmatchcase(rel, pattern):
+            return True
+    return False
+
+
+class FileTable:
+    """
+    Scanned files with their paths in a PathStore and stat fields in typed arrays.
+
+    Iterating yields FileEntry objects built on demand, so a scan of millions of
+    files holds a few dozen bytes per file instead of one object per file.
+    """
+
+    def __init__(self):
+        """Initialize an empty file table"""
+        self.paths = PathStore()
+        self._sizes = array("q")
+        self._mtimes = array("q")
+        self._modes = array("q")
+        self._atimes = array("q")
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def append(self, dir_id: int, name: str, size: int, mtime_ns: int, mode: int, atime_ns: int) -> int:
+        """Add a file to a directory interned in self.paths and return its ID"""
+        self._sizes.append(size)
+        self._mtimes.append(mtime_ns)
+        self._modes.append(mode)
+        self._atimes.append(atime_ns)
+        return self.paths.add_file(dir_id, name)
+
+    def fields(self, file_id: int) -> tuple:
+        """(size, mtime_ns, mode, atime_ns) of a file ID"""
+        return self._sizes[file_id], self._mtimes[file_id], self._modes[file_id], self._atimes[file_id]
+
+    def entry(self, file_id: int) -> FileEntry:
+        """Build the FileEntry of a file ID"""
+        return FileEntry(
+            self.paths.path(file_id), self._sizes[file_id], self._mtimes[file_id],
+            self._modes[file_id], self._atimes[file_id]
+        )
+
+    def __iter__(self) -> Iterator[FileEntry]:
+        for file_id, path in enumerate(self.paths):
+            yield FileEntry(path, self._sizes[file_id], self._mtimes[file_id], self._modes[file_id], self._atimes[file_id])
+
+    def contains(self, rel_path: str) -> bool:
+        """True if a path was scanned, ignoring case as robocopy does on Windows"""
+        return self.paths.find(rel_path, casefold=True) is not None
+
+    def names_in(self, rel_dir: str) -> Set[str]:
+        """Lowercase names of the files scanned in a directory"""
+        dir_id = self.paths.find_dir(rel_dir, casefold=True)
+        return set(self.paths.names_in(dir_id, casefold=True)) if dir_id is not None else set()
+
+
+def _walk(
+    root: str,
+    exclude_folders: List[str],
+    exclude_files: List[str],
+    directories: Optional[List[FileEntry]]
+) -> Iterator[tuple]:
+    """Yield (rel_dir, name, stat_result) for every included file, directory by directory"""
+    stack = [""]
+
+    while stack:
+        rel_dir = stack.pop()
+        abs_dir = os.path.join(root, rel_dir) if rel_dir else root
+        try:
+            with os.scandir(abs_dir) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logger.warning(f"Cannot list directory {abs_dir}: {e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_symlink():
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_excluded_dir(rel_path, entry.name, exclude_folders):
+                        subdirs.append(rel_path)
+                        if directories is not None:
+                            st = entry.stat(follow_symlinks=False)
+                            directories.append(FileEntry(rel_path, 0, st.st_mtime_ns, st.st_mode, st.st_atime_ns))
+                elif entry.is_file(follow_symlinks=False):
+                    if _matches_any(entry.name, exclude_files):
+                        continue
+                    yield rel_dir, entry.name, entry.stat(follow_symlinks=False)
+            except OSError as e:
+                logger.warning(f"Cannot stat {os.path.join(abs_dir, entry.name)}: {e}")
+
+        # Reverse so directories are visited in sorted order
+        stack.extend(reversed(subdirs))
+
+
+def scan_tree(
+    root: str,
+    exclude_folders: Optional[List[str]] = None,
+    exclude_files: Optional[List[str]] = None,
+    directories: Optional[List[FileEntry]] = None
+) -> Iterator[FileEntry]:
+    """
+    Walk a directory tree and yield the regular files it contains.
+
+    Symbolic links and junctions are skipped, matching robocopy's /XJD /XJF.
+
+    Args:
+        root: Directory to scan
+        exclude_folders: Folder name or relative path patterns to skip (/XD)
+        exclude_files: File name patterns to skip (/XF)
+        directories: If given, an entry for every included subdirectory is appended to it
+
+    Yields:
+        FileEntry for each file, with a '/'-separated path relative to root
+    """
+    for rel_dir, name, st in _walk(root, exclude_folders or [], exclude_files or [], directories):
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        yield FileEntry(rel_path, st.st_size, st.st_mtime_ns, st.st_mode, st.st_atime_ns)
+
+
+def scan_table(
+    root: str,
+    exclude_folders: Optional[List[str]] = None,
+    exclude_files: Optional[List[str]] = None,
+    directories: Optional[List[FileEntry]] = None
+) -> FileTable:
+    """
+    Walk a directory tree like scan_tree(), collecting the files into a FileTable.
+
+    Each directory is interned once, so files only add their name and stat fields.
+    """
+    table = FileTable()
+    current_dir, dir_id = None, 0
+    for rel_dir, name, st in _walk(root, exclude_folders or [], exclude_files or [], directories):
+        if rel_dir != current_dir:
+            current_dir, dir_id = rel_dir, table.paths.intern_dir(rel_dir)
+        table.append(dir_id, name, st.st_size, st.st_mtime_ns, st.st_mode, st.st_atime_ns)
+    return table
+
+
+def needs_copy(entry: FileEntry, dest_path: str, fft: bool = True, compare_size: bool = True) -> bool:
+    """
+    Decide whether a source file differs from its destination copy.
+
+    Uses robocopy's default change detection: size and last-write time.
+
+    Args:
+        entry: Source file entry
+        dest_path: Absolute destination path
+        fft: Allow a 2-second timestamp difference (/FFT)
+        compare_size: Compare sizes too (off when the destination holds transformed streams)
+
+    Returns:
+        True if the file must be copied
+    """
+    try:
+        st = os.stat(dest_path)
+    except OSError:
+        return True
+    return differs(entry, st.st_size, st.st_mtime_ns, fft, compare_size)
+
+
+def differs(entry: FileEntry, size: int, mtime_ns: int, fft: bool = True, compare_size: bool = True) -> bool:
+    """needs_copy() against a known destination size and time instead of a stat"""
+    if compare_size and size != entry.size:
+        return True
+    tolerance = FFT_TOLERANCE_NS if fft else 0
+    return abs(mtime_ns - entry.mtime_ns) > tolerance
+
+
+def new_run_id(taken: Callable[[str], bool]) -> str:
+    """
+    ID for a run starting now: its start time to the second, followed by a
+    counter (_01, _02, ...) when a run with that ID already exists.
+
+    Args:
+        taken: Returns True for an ID already used at the destination
+    """
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    run_id, counter = stamp, 0
+    while taken(run_id):
+        counter += 1
+        run_id = f"{stamp}_{counter:02d}"
+    return run_id
+
+
+def format_path(meta_dir: str) -> str:
+    """Format record of a mirror destination"""
+    return os.path.join(meta_dir, FORMAT_NAME)
+
+
+def load_mirror_format(meta_dir: str) -> Optional[tuple]:
+    """
+    Chunk transforms the files of a mirror destination are written with.
+
+    Returns:
+        Stage names in the order they were applied, or None if no native run
+        recorded them (files are stored as is)
+
+    Raises:
+        ValueError: If the record exists but cannot be read
+    """
+    try:
+        with open(format_path(meta_dir), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return tuple(data["transforms"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Unreadable format record in {meta_dir}: {e}")
+
+
+def save_mirror_format(meta_dir: str, stages: tuple):
+    """Record the chunk transforms a mirror destination's files are written with, atomically"""
+    os.makedirs(meta_dir, exist_ok=True)
+    path = format_path(meta_dir)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"transforms": list(stages)}, f)
+    os.replace(tmp, path)
+
+
+def _remove_outdated(path: str, what: str):
+    """Delete a metadata file this run would leave out of date; a missing file is fine"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Cannot remove outdated {what} {path}: {e}")
+
+
+class NativeCopyEngine:
+    """
+    Copies a source tree to a destination through a CopyPipeline.
+
+    The engine is the pipeline's handler: it hands out files, opens partial
+    outputs and renames them into place. Files that fail with a transient error
+    (locked, network, I/O) are moved to a RetryQueue with exponential backoff
+    instead of blocking a reader, so healthy readers keep draining the main queue
+    while the failed file waits.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        dest: str,
+        options: Optional[EngineOptions] = None,
+        progress_callback: Optional[Callable[[EngineEvent], None]] = None
+    ):
+        """
+        Initialize native copy engine
+
+        Args:
+            source: Source directory
+            dest: Destination directory
+            options: Engine options (defaults are used if None)
+            progress_callback: Optional callable receiving EngineEvent objects
+        """
+        self.source = source
+        self.dest = dest
+        self.options = options or EngineOptions()
+        self.progress_callback = progress_callback
+
+        is_valid, error = self.options.validate()
+        if not is_valid:
+            raise ValueError(f"Invalid engine options: {error}")
+
+        self._queue: "queue.Queue[FileEntry]" = queue.Queue()
+        self._retry_queue = RetryQueue(
+            self.options.retry_base_delay,
+            self.options.retry_max_delay,
+            self.options.retry_jitter
+        )
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._pending = 0
+        self._source_dirs: List[FileEntry] = []
+        self._scanned = FileTable()
+        self._prescan: Optional[tuple] = None
+        self._start = time.monotonic()
+        self._previous_manifest: Optional[Manifest] = None
+        self._previous_columnar: Optional[ColumnarManifest] = None
+        self._removed: Optional[List[str]] = None  # extras known from a manifest diff
+        self._removed_dirs: List[str] = []  # folders the same diff found gone from the source
+        self._metadata = MetadataQueue(self.options.workers)
+        self._result = RunResult()
+        self._durability = DurabilityManager(
+            dest,
+            self.options.durability,
+            self.options.sync_every_bytes,
+            self.options.sync_every_seconds
+        )
+        self._journal = JobJournal(os.path.join(dest, META_DIR_NAME, "journal.jnl"))
+        self._resumed = False
+        self._seq = 0
+        self._bytes_written = 0
+        # Compressed or encrypted outputs never match the source size
+        self._chunk_stages = tuple(t for t in self.options.transforms if t in CHUNK_TRANSFORMS)
+        self._transformed = bool(self._chunk_stages)
+        self._reformat = False  # the destination's files were written with other transforms
+        self.file_hashes: Dict[str, str] = {}
+        # Single-instance store: the pipeline must hash files to index them
+        self.pipeline_transforms = list(self.options.transforms)
+        if self.options.single_instance and "hash" not in self.pipeline_transforms:
+            self.pipeline_transforms.insert(0, "hash")
+        self._sis: Optional[SingleInstanceIndex] = None
+        self._waiting: Dict[str, List[FileEntry]] = {}  # content hash -> files waiting for its first copy
+        self._waiting_on: Dict[str, str] = {}  # path of a first copy -> content hash
+        self._sis_linked = 0
+        self._sis_bytes_avoided = 0
+        self._written: List[tuple] = []  # (rel_path, size, mtime_ns) of written files, for the catalog
+        self._listing: Optional[DestinationListing] = None
+
+    @property
+    def result(self) -> RunResult:
+        """Result of the current or last run"""
+        return self._result
+
+    def cancel(self):
+        """Ask the workers to stop after their current file"""
+        self._cancel.set()
+
+    def _emit(self, kind: str, path: str = "", nbytes: int = 0, message: str = ""):
+        """Send a progress event to the callback, never letting it break the run"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(EngineEvent(kind, path, nbytes, message))
+        except Exception:
+            log_exception(logger, "Progress callback raised an exception")
+
+    def _dest_path(self, rel_path: str) -> str:
+        return os.path.join(self.dest, *rel_path.split("/"))
+
+    def _src_path(self, rel_path: str) -> str:
+        return os.path.join(self.source, *rel_path.split("/"))
+
+    def plan(self) -> List[FileEntry]:
+        """
+        Scan the source and return the files that need copying.
+
+        With trust_manifest and a previous manifest, the scan is compared with the
+        manifest instead of the destination, so unchanged subtrees cost nothing.
+        Otherwise a cached destination listing (dest_listing) stands in for a stat
+        of every destination file.
+
+        Returns:
+            List of FileEntry objects that are new or changed
+        """
+        if self._prescan is not None:
+            self._scanned, self._source_dirs = self._prescan
+            self._prescan = None
+        else:
+            self._source_dirs = []
+            self._scanned = scan_table(
+                self.source, self.options.exclude_folders, self.options.exclude_files, self._source_dirs
+            )
+
+        planned = None
+        if self.options.trust_manifest and self._previous_columnar is not None:
+            planned = self._plan_from_columnar(self._previous_columnar)
+        if planned is None and self.options.trust_manifest and self._previous_manifest is not None:
+            planned = self._plan_from_manifest(self._previous_manifest)
+        if planned is None and self._listing is not None:
+            self._revalidate_listing()
+            listing = self._listing
+            planned = []
+            for entry in self._scanned:
+                listed = listing.get(entry.rel_path)
+                if listed is None or differs(entry, *listed, self.options.fft, not self._transformed):
+                    planned.append(entry)
+        if planned is None:
+            planned = [
+                entry for entry in self._scanned
+                if needs_copy(entry, self._dest_path(entry.rel_path), self.options.fft, not self._transformed)
+            ]
+        self._result.files_total = len(self._scanned)
+        self._result.files_skipped = len(self._scanned) - len(planned)
+        return planned
+
+    def _build_manifest(self, previous: Optional[Manifest]) -> Manifest:
+        """
+        Describe the scanned source, empty folders included, as a manifest.
+
+        Content hashes come from this run's copies, or from the previous manifest
+        for files whose size and mtime have not changed. Files that failed keep
+        their previous entry, so the next run still sees them as changed.
+        """
+        failed = {failure.path for failure in self._result.failures}
+        manifest = Manifest(self._result.run_id)
+        for directory in self._source_dirs:
+            manifest.add_dir(directory.rel_path)
+        for entry in self._scanned:
+            if entry.rel_path in failed:
+                before = previous.get(entry.rel_path) if previous is not None else None
+                if before is not None:
+                    manifest.add(before)
+                continue
+            digest = self.file_hashes.get(entry.rel_path, "")
+            if not digest and previous is not None:
+                digest = previous.hash_if_unchanged(entry.rel_path, entry.size, entry.mtime_ns)
+            manifest.add(ManifestEntry(entry.rel_path, entry.size, entry.mtime_ns, digest))
+        return manifest
+
+    def _plan_from_columnar(self, previous: ColumnarManifest) -> Optional[List[FileEntry]]:
+        """
+        Plan the files that differ from the previous manifest with a vectorized join.
+
+        Returns:
+            Planned files, or None if the scan cannot be put in columnar form
+        """
+        try:
+            current = ColumnarManifest.from_entries(
+                self._result.run_id, ((e.rel_path, e.size, e.mtime_ns, "") for e in self._scanned),
+                (directory.rel_path for directory in self._source_dirs)
+            )
+        except ValueError as e:
+            logger.warning(f"Falling back to the manifest tree diff: {e}")
+            self._previous_manifest = load_latest_manifest(os.path.join(self.dest, META_DIR_NAME))
+            return None
+
+        diff = diff_columnar(previous, current)
+        self._result.stats["columnar_diff"] = True
+        if diff.unchanged:
+            logger.info(f"Source matches manifest {previous.run_id}; nothing to copy")
+            self._result.stats["noop"] = True
+            self._removed = []
+            return []
+
+        self._removed = previous.paths(diff.removed)
+        self._removed_dirs = diff.removed_dirs
+        changed = set(current.paths(diff.added))
+        changed.update(current.paths(diff.modified))
+        return [entry for entry in self._scanned if entry.rel_path in changed]
+
+    def _plan_from_manifest(self, previous: Manifest) -> List[FileEntry]:
+        """Plan the files that differ from the previous manifest, pruning identical subtrees"""
+        current = self._build_manifest(previous)
+        if current.root_hash == previous.root_hash:
+            logger.info(f"Source matches manifest {previous.run_id}; nothing to copy")
+            self._result.stats["noop"] = True
+            self._removed = []
+            return []
+
+        diff = diff_manifests(previous, current)
+        self._result.stats["pruned_dirs"] = diff.pruned_dirs
+        self._removed = diff.removed
+        self._removed_dirs = diff.removed_dirs
+        changed = set(diff.added)
+        changed.update(diff.modified)
+        return [entry for entry in self._scanned if entry.rel_path in changed]
+
+    def _resume(self, state: JournalState) -> List[FileEntry]:
+        """
+        Rebuild the plan of an interrupted run from its journal instead of rescanning.
+
+        Completed units are trusted only when the destination still holds their data
+        (see _completed_intact); partial files left by units that were in progress
+        are removed.
+
+        Args:
+            state: Replayed journal
+
+        Returns:
+            List of FileEntry objects that still need copying
+        """
+        self._source_dirs = [
+            FileEntry(path, 0, mtime_ns, mode, atime_ns) for path, mtime_ns, mode, atime_ns in state.dirs
+        ]
+        # Without per-file syncs a completed record can reach disk before the file's data
+        synced = state.durability == "per_file"
+        planned = []
+        for path, (size, mtime_ns, mode, atime_ns) in state.planned.items():
+            entry = FileEntry(path, size, mtime_ns, mode, atime_ns)
+            dst = self._dest_path(path)
+            if path in state.completed and self._completed_intact(path, size, synced):
+                # Copied before the interruption, but its metadata pass never ran
+                self._metadata.add(MetadataUpdate(dst, atime_ns, mtime_ns, mode))
+                continue
+            if path in state.started:
+                try:
+                    os.remove(dst + PARTIAL_SUFFIX)
+                except OSError:
+                    pass
+            planned.append(entry)
+
+        self._result.files_total = len(state.planned)
+        self._result.files_skipped = len(state.planned) - len(planned)
+        return planned
+
+    def _format_changed(self) -> bool:
+        """True if the destination's files were written with other chunk transforms than this run's"""
+        try:
+            recorded = load_mirror_format(os.path.join(self.dest, META_DIR_NAME))
+        except ValueError as e:
+            logger.warning(f"{e}; copying every file again")
+            return True
+        if (recorded or ()) == self._chunk_stages:
+            return False
+        logger.info(f"Destination transforms change from {','.join(recorded or ()) or 'none'} to "
+                    f"{','.join(self._chunk_stages) or 'none'}; copying every file again")
+        return True
+
+    def _completed_intact(self, rel_path: str, size: int, synced: bool) -> bool:
+        """
+        True if a file an interrupted run journaled as completed holds the planned data.
+
+        Transformed files are always decoded and their length checked. Plain files
+        are compared with the source unless the run synced each file before
+        journaling it, in which case the size is enough.
+
+        Args:
+            rel_path: Relative path of the file
+            size: Planned source size
+            synced: The interrupted run used per_file durability
+        """
+        dst = self._dest_path(rel_path)
+        try:
+            if self._transformed:
+                with open(dst, "rb") as f:
+                    chunks = iter_decoded_chunks(f, self.options.encryption_key, self._chunk_stages)
+                    decoded = sum(len(chunk) for chunk in chunks)
+                return decoded == size
+            if os.stat(dst).st_size != size:
+                return False
+            return synced or filecmp.cmp(self._src_path(rel_path), dst, shallow=False)
+        except Exception as e:
+            # Missing, torn or undecodable: copy it again
+            logger.debug(f"Recopying {rel_path} after the interruption: {e}")
+            return False
+
+    def _next_item(self) -> Optional[tuple]:
+        """Return the next (entry, attempt) to work on, preferring retries that are due"""
+        due = self._retry_queue.pop_due()
+        if due is not None:
+            return due
+        try:
+            return self._queue.get_nowait(), 0
+        except queue.Empty:
+            return None
+
+    # Pipeline handler
+
+    def backlog(self) -> int:
+        """Files waiting in the main and retry queues"""
+        return self._queue.qsize() + len(self._retry_queue)
+
+    def next_unit(self) -> Optional[CopyUnit]:
+        """Hand the next file to a pipeline reader, waiting for retries that are not due yet"""
+        while not self._cancel.is_set():
+            item = self._next_item()
+            if item is not None:
+                return self.start_unit(*item)
+            with self._lock:
+                if self._pending <= 0:
+                    return None
+            wait = self._retry_queue.time_until_next()
+            self._cancel.wait(min(wait if wait is not None else 0.05, 0.25))
+        return None
+
+    def start_unit(self, entry: FileEntry, attempt: int = 0) -> CopyUnit:
+        """Journal a file as started and wrap it in a CopyUnit"""
+        self._journal.mark_started(entry.rel_path)
+        with self._lock:
+            self._seq += 1
+            return CopyUnit(entry, attempt, self._seq)
+
+    def open_source(self, unit: CopyUnit) -> BinaryIO:
+        """Open a source file unbuffered, so readinto() fills pooled buffers directly"""
+        if self.options.io_hints:
+            return open_for_sequential_read(self._src_path(unit.entry.rel_path))
+        return open(self._src_path(unit.entry.rel_path), "rb", buffering=0)
+
+    def open_output(self, unit: CopyUnit) -> BinaryIO:
+        """
+        Open the partial output of a file, preallocating it when it is large.
+
+        Timestamps and permissions are not applied to outputs; they are queued for
+        the metadata pass so data writes are not interleaved with metadata round trips.
+        """
+        dst = self._dest_path(unit.entry.rel_path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        fdst = open(dst + PARTIAL_SUFFIX, "wb")
+        try:
+            unit.state = (
+                self.options.preallocate
+                and not self._transformed
+                and unit.entry.size >= self.options.preallocate_min_bytes
+                and preallocate(fdst.fileno(), unit.entry.size)
+            )
+        except BaseException:
+            fdst.close()
+            raise
+        return fdst
+
+    def finish_output(self, unit: CopyUnit):
+        """Close a completed output and rename it into place"""
+        dst = self._dest_path(unit.entry.rel_path)
+        fdst = unit.output
+        try:
+            if unit.state:
+                # The source may have shrunk since it was scanned
+                fdst.truncate()
+            self._durability.sync_file(fdst)
+        finally:
+            fdst.close()
+        os.replace(dst + PARTIAL_SUFFIX, dst)
+
+    def abort_output(self, unit: CopyUnit):
+        """Close and delete a partial output"""
+        if unit.output is not None:
+            try:
+                unit.output.close()
+            except OSError:
+                pass
+        try:
+            os.remove(self._dest_path(unit.entry.rel_path) + PARTIAL_SUFFIX)
+        except OSError:
+            pass
+
+    def unit_done(self, unit: CopyUnit, error: Optional[BaseException]):
+        """Record a finished file, deferring transient failures to the retry queue"""
+        entry, attempt = unit.entry, unit.attempt
+        if error is not None:
+            error_class, transient = classify_error(error)
+            if transient and attempt < self.options.retry_attempts:
+                delay = self._retry_queue.schedule(entry, attempt + 1)
+                logger.debug(f"Deferring {entry.rel_path} ({error_class}) for {delay:.1f}s: {error}")
+                self.record_retry(entry, error_class, error)
+                return
+            self._release_waiting(entry.rel_path, None)
+            self.record_failure(entry, error, attempt + 1)
+            return
+
+        dst = self._dest_path(entry.rel_path)
+        self._journal.mark_completed(entry.rel_path)
+        self._metadata.add(MetadataUpdate(dst, entry.atime_ns, entry.mtime_ns, entry.mode))
+        self._durability.file_written(dst, unit.bytes_written)
+        if self._sis is not None and unit.digest:
+            self._sis.add(unit.digest, entry.rel_path, entry.size, unit.bytes_written, entry.mtime_ns)
+            self._release_waiting(entry.rel_path, dst)
+        with self._lock:
+            self._result.files_copied += 1
+            self._result.bytes_copied += unit.bytes_read
+            self._bytes_written += unit.bytes_written
+            if unit.digest:
+                self.file_hashes[entry.rel_path] = unit.digest
+            if self.options.catalog:
+                self._written.append((entry.rel_path, entry.size, entry.mtime_ns))
+            self._pending -= 1
+        if self._listing is not None:
+            self._listing.record(entry.rel_path, unit.bytes_written, entry.mtime_ns)
+        self._emit("file_copied", entry.rel_path, unit.bytes_read)
+
+    def _link(self, entry: FileEntry, existing: str, digest: str) -> bool:
+        """
+        Hard-link a planned file to a destination file with the same content.
+
+        Returns:
+            False if the link could not be made and the file must be copied
+        """
+        dst = self._dest_path(entry.rel_path)
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.remove(dst + PARTIAL_SUFFIX)
+            except FileNotFoundError:
+                pass
+            os.link(existing, dst + PARTIAL_SUFFIX)
+            os.replace(dst + PARTIAL_SUFFIX, dst)
+            stored_size = os.stat(dst).st_size
+        except OSError as e:
+            logger.debug(f"Cannot link {entry.rel_path}, copying it instead: {e}")
+            return False
+
+        self._journal.mark_completed(entry.rel_path)
+        self._metadata.add(MetadataUpdate(dst, entry.atime_ns, entry.mtime_ns, entry.mode))
+        self._sis.add(digest, entry.rel_path, entry.size, stored_size, entry.mtime_ns)
+        with self._lock:
+            self._result.files_copied += 1
+            self._sis_linked += 1
+            self._sis_bytes_avoided += entry.size
+            self.file_hashes[entry.rel_path] = digest
+            if self.options.catalog:
+                self._written.append((entry.rel_path, entry.size, entry.mtime_ns))
+        if self._listing is not None:
+            self._listing.record(entry.rel_path, stored_size, entry.mtime_ns)
+        self._emit("file_copied", entry.rel_path, 0, message="linked")
+        return True
+
+    def _release_waiting(self, rel_path: str, copied: Optional[str]):
+        """
+        Hand the files waiting on a first copy their content.
+
+        Args:
+            rel_path: Path of the first copy
+            copied: Its destination path, or None if it failed and the waiting files must be copied
+        """
+        with self._lock:
+            digest = self._waiting_on.pop(rel_path, None)
+            waiting = self._waiting.pop(digest, []) if digest is not None else []
+        for entry in waiting:
+            if copied is None or not self._link(entry, copied, digest):
+                with self._lock:
+                    self._pending += 1
+                self._queue.put(entry)
+
+    def _same_time(self, mtime_a: int, mtime_b: int) -> bool:
+        """
+        True if two files may share one inode without their timestamps fighting.
+
+        Linked files share a single mtime; unless runs are planned from the
+        manifest, a mismatch would make the next run copy the file again.
+        """
+        return self.options.trust_manifest or abs(mtime_a - mtime_b) <= FFT_TOLERANCE_NS
+
+    def _link_duplicates(self, planned: List[FileEntry], defer: bool) -> List[FileEntry]:
+        """
+        Link planned files whose content is already stored instead of copying them.
+
+        Only files whose size matches indexed content or another planned file are
+        hashed up front. With defer, later files with content first seen in this
+        run wait for its first copy and are linked when it completes.
+
+        Args:
+            planned: Files to copy
+            defer: Hold back in-run duplicates until their first copy is written
+
+        Returns:
+            Files that still need copying
+        """
+        start = time.monotonic()
+        min_bytes = max(1, self.options.single_instance_min_bytes)
+        size_counts = Counter(entry.size for entry in planned if entry.size >= min_bytes)
+        candidates = [
+            entry for entry in planned
+            if entry.size >= min_bytes and (size_counts[entry.size] > 1 or self._sis.has_size(entry.size))
+        ]
+
+        hashes: Dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=self.options.workers, thread_name_prefix="sis-hash") as pool:
+            futures = [
+                (entry, pool.submit(hash_file, self._src_path(entry.rel_path), self.options.chunk_size))
+                for entry in candidates
+            ]
+            for entry, future in futures:
+                try:
+                    hashes[entry.rel_path] = future.result()
+                except OSError as e:
+                    # Copied normally; the pipeline retries and reports the error
+                    logger.debug(f"Cannot hash {entry.rel_path}: {e}")
+
+        remaining = []
+        first_copies: Dict[str, FileEntry] = {}
+        for entry in planned:
+            digest = hashes.get(entry.rel_path)
+            if digest is None:
+                remaining.append(entry)
+                continue
+            existing = self._sis.lookup(digest, self.dest, FFT_TOLERANCE_NS)
+            if existing is not None and existing != entry.rel_path:
+                existing_path = self._dest_path(existing)
+                try:
+                    stored_mtime = os.stat(existing_path).st_mtime_ns
+                except OSError:
+                    stored_mtime = None
+                if (stored_mtime is not None and self._same_time(stored_mtime, entry.mtime_ns)
+                        and self._link(entry, existing_path, digest)):
+                    continue
+            first = first_copies.get(digest)
+            if defer and first is not None and self._same_time(first.mtime_ns, entry.mtime_ns):
+                self._waiting.setdefault(digest, []).append(entry)
+                self._waiting_on[first.rel_path] = digest
+                continue
+            first_copies.setdefault(digest, entry)
+            remaining.append(entry)
+
+        self._result.stats["sis_hashed_files"] = len(hashes)
+        self._result.stats["sis_hash_seconds"] = round(time.monotonic() - start, 6)
+        return remaining
+
+    def record_retry(self, entry: FileEntry, error_class: str, error: BaseException):
+        """Count a transient failure whose file was deferred for another attempt"""
+        with self._lock:
+            self._result.retries += 1
+        self._emit("file_retry", entry.rel_path, message=f"{error_class}: {error}")
+
+    def record_failure(self, entry: FileEntry, error: BaseException, attempts: int):
+        """Report a file that failed permanently"""
+        error_class, _ = classify_error(error)
+        with self._lock:
+            self._result.failures.append(FailedFile(entry.rel_path, error_class, str(error), attempts))
+            self._pending -= 1
+        logger.error(f"Failed to copy {entry.rel_path} ({error_class}): {error}")
+        self._emit("file_failed", entry.rel_path, message=f"{error_class}: {error}")
+
+    def _purge_extras(self):
+        """Delete destination files and folders that are not in the source (/MIR)"""
+        for dirpath, dirnames, filenames in os.walk(self.dest, topdown=False):
+            rel_dir = os.path.relpath(dirpath, self.dest).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir
+            if rel_dir.split("/", 1)[0] in PROTECTED_DEST_NAMES:
+                continue
+            if rel_dir and is_excluded_dir(rel_dir, os.path.basename(dirpath), self.options.exclude_folders):
+                continue
+            source_names = self._scanned.names_in(rel_dir)
+            for name in filenames:
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                if not rel_dir and name in PROTECTED_DEST_NAMES:
+                    continue
+                if _matches_any(name, self.options.exclude_files) or name.lower() in source_names:
+                    continue
+                try:
+                    os.remove(os.path.join(dirpath, name))
+                    self._result.files_deleted += 1
+                except OSError as e:
+                    logger.warning(f"Cannot delete extra file {rel_path}: {e}")
+            if rel_dir and not os.listdir(dirpath) and not os.path.isdir(self._src_path(rel_dir)):
+                try:
+                    os.rmdir(dirpath)
+                except OSError as e:
+                    logger.warning(f"Cannot delete extra folder {rel_dir}: {e}")
+
+    def _load_previous_manifest(self):
+        """
+        Open the last run's manifest.
+
+        Trusted plans prefer the memory-mapped columnar form of the newest run, which
+        opens without parsing; the tree manifest is the fallback and the source of
+        content hashes.
+        """
+        self._previous_manifest = None
+        self._previous_columnar = None
+        if not (self.options.manifest or self.options.trust_manifest):
+            return
+        meta_dir = os.path.join(self.dest, META_DIR_NAME)
+        runs = list_manifests(meta_dir)
+        if self.options.trust_manifest and self.options.columnar_manifest and runs:
+            self._previous_columnar = load_columnar(meta_dir, runs[-1])
+        if self._previous_columnar is None:
+            self._previous_manifest = load_latest_manifest(meta_dir)
+
+    def _open_listing(self) -> Optional[DestinationListing]:
+        """Load the cached destination listing, or drop it if this run will not keep it current"""
+        path = os.path.join(self.dest, META_DIR_NAME, LISTING_NAME)
+        if self.options.dest_listing:
+            return DestinationListing.load(path)
+        _remove_outdated(path, "destination listing")
+        return None
+
+    def _list_destination(self) -> Iterator[tuple]:
+        """Enumerate the destination: (rel_path, size, mtime_ns) of every file a /MIR purge would consider"""
+        for rel_dir, name, st in _walk(self.dest, self.options.exclude_folders, self.options.exclude_files, None):
+            if (rel_dir or name).split("/", 1)[0] in PROTECTED_DEST_NAMES or name.endswith(PARTIAL_SUFFIX):
+                continue
+            yield (f"{rel_dir}/{name}" if rel_dir else name), st.st_size, st.st_mtime_ns
+
+    def _revalidate_listing(self):
+        """
+        Make the destination listing safe to plan against.
+
+        A listing past its revalidation period, or one in which a random sample
+        finds files changed outside the engine, is replaced by a full enumeration.
+        """
+        listing = self._listing
+        start = time.monotonic()
+        changed: List[str] = []
+        if listing.age_seconds() <= self.options.dest_listing_revalidate_days * 86400:
+            tolerance = FFT_TOLERANCE_NS if self.options.fft else 0
+            changed = listing.check_sample(self.dest, self.options.dest_listing_sample, tolerance)
+            if not changed:
+                self._result.stats["dest_listing"] = {
+                    "enumerated": False, "sampled": min(self.options.dest_listing_sample, len(listing)),
+                    "seconds": round(time.monotonic() - start, 6)
+                }
+                return
+            logger.info(f"{len(changed)} sampled destination files changed outside the engine "
+                        f"(e.g. {changed[0]}), enumerating {self.dest}")
+        listing.replace(self._list_destination())
+        self._result.stats["dest_listing"] = {
+            "enumerated": True, "sample_changed": len(changed), "seconds": round(time.monotonic() - start, 6)
+        }
+
+    def _purge_removed(self, removed: List[str], removed_dirs: Iterable[str] = ()):
+        """
+        Delete the destination copies of files a manifest diff reported as removed (/MIR).
+
+        Args:
+            removed: Relative paths of removed files
+            removed_dirs: Relative paths of folders removed from the source, empty ones included
+        """
+        parents = set(removed_dirs)
+        for rel_path in removed:
+            name = rel_path.rpartition("/")[2]
+            if _matches_any(name, self.options.exclude_files) or self._scanned.contains(rel_path):
+                continue
+            try:
+                os.remove(self._dest_path(rel_path))
+                self._result.files_deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Cannot delete extra file {rel_path}: {e}")
+                parents.add(rel_path.rpartition("/")[0])
+                continue
+            if self._listing is not None:
+                self._listing.forget(rel_path)
+            parents.add(rel_path.rpartition("/")[0])
+
+        # Folders that left the source are removed deepest first, if they are now empty
+        source_dirs = {directory.rel_path.lower() for directory in self._source_dirs}
+        candidates = set()
+        for parent in parents:
+            while parent and parent.lower() not in source_dirs:
+                candidates.add(parent)
+                parent = parent.rpartition("/")[0]
+        for rel_dir in sorted(candidates, key=lambda d: d.count("/"), reverse=True):
+            try:
+                os.rmdir(self._dest_path(rel_dir))
+            except OSError:
+                pass
+
+    def _write_manifest(self):
+        """Record the run's manifest, and its columnar form, under the destination's metadata folder"""
+        meta_dir = os.path.join(self.dest, META_DIR_NAME)
+        previous = self._previous_manifest
+        columns = self._previous_columnar
+        if previous is None and columns is not None and columns.hash_prefix.any():
+            # Planned from columns alone; full hashes of unchanged files live in the tree manifest
+            previous = load_latest_manifest(meta_dir)
+
+        manifest = self._build_manifest(previous)
+        path = manifest_path(meta_dir, self._result.run_id)
+        try:
+            manifest.save(path)
+            self._result.stats["manifest_root_hash"] = manifest.root_hash
+        except OSError as e:
+            logger.warning(f"Cannot write manifest {path}: {e}")
+            return
+
+        if self.options.columnar_manifest and NUMPY_AVAILABLE:
+            try:
+                ColumnarManifest.from_manifest(manifest).save(columnar_path(meta_dir, self._result.run_id))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cannot write columnar manifest for {self._result.run_id}: {e}")
+
+        # Written whether or not the columnar manifest is enabled
+        if NUMPY_AVAILABLE:
+            # Imported here: the browse module reads archives, which build on this module
+            from .browse import SnapshotIndex, browse_path
+            try:
+                SnapshotIndex.from_manifest(manifest).save(browse_path(meta_dir, self._result.run_id))
+            except OSError as e:
+                logger.warning(f"Cannot write snapshot index for {self._result.run_id}: {e}")
+
+    def _record_catalog(self):
+        """Add the files this run wrote to the destination's catalog"""
+        try:
+            with BackupCatalog(catalog_path(os.path.join(self.dest, META_DIR_NAME))) as catalog:
+                catalog.record_run(self._result.run_id, self._written, "mirror", self.source)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Cannot update catalog for {self._result.run_id}: {e}")
+
+    def _admit(self, planned: List[FileEntry]) -> bool:
+        """
+        Check free space on the destination against the planned byte count.
+
+        The estimate is the full size of every planned file, which is conservative
+        for updates because the old copy is only replaced once the new one is complete.
+
+        Returns:
+            False if the run must not start
+        """
+        planned_bytes = sum(entry.size for entry in planned)
+        self._result.stats["planned_bytes"] = planned_bytes
+        if self.options.free_space_policy == "off" or not planned:
+            return True
+
+        enough, free, message = check_free_space(self.dest, planned_bytes, self.options.free_space_reserve_bytes)
+        self._result.stats["free_bytes"] = free
+        if enough:
+            return True
+        if self.options.free_space_policy == "warn":
+            logger.warning(message)
+            self._result.stats["free_space_warning"] = message
+            return True
+
+        logger.error(f"Refusing to start: {message}")
+        self._result.failures.append(FailedFile("", "no_space", message, 0))
+        return False
+
+    def run(self) -> RunResult:
+        """
+        Execute the copy.
+
+        Returns:
+            RunResult describing what was copied and which files failed permanently
+        """
+        planned = self.prepare()
+        if planned is None:
+            return self._result
+
+        self._pending = len(planned)
+        for entry in planned:
+            self._queue.put(entry)
+
+        pipeline = CopyPipeline(
+            self,
+            readers=min(self.options.workers, max(1, len(planned))),
+            writers=self.options.writers,
+            transforms=self.pipeline_transforms,
+            cpu_workers=self.options.cpu_workers,
+            cpu_executor=self.options.cpu_executor,
+            queue_depth=self.options.queue_depth,
+            chunk_size=self.options.chunk_size,
+            encryption_key=self.options.encryption_key,
+            buffer_count=self.options.buffer_count,
+            io_hints=self.options.io_hints
+        )
+        return self.finish(pipeline.run() if planned else {})
+
+    def use_scan(self, table: FileTable, directories: List[FileEntry]):
+        """Plan the next run from a scan made elsewhere instead of walking the source"""
+        self._prescan = (table, directories)
+
+    def prepare(self, defer_duplicates: bool = True) -> Optional[List[FileEntry]]:
+        """
+        Resume or plan a run, check free space and create the destination folders.
+
+        run() calls this before its pipeline; callers that feed the engine from
+        their own pipeline call prepare(), then unit_done() per file, then finish().
+
+        Args:
+            defer_duplicates: Let in-run duplicates wait for their first copy (single-instance
+                store); callers that do not drain the engine's queue pass False
+
+        Returns:
+            Files to copy, or None if the run cannot start (the result says why)
+        """
+        self._start = time.monotonic()
+        self._scanned = FileTable()
+        self._result = RunResult()
+        self._bytes_written = 0
+        self._removed = None
+        self._removed_dirs = []
+        self._reformat = False
+
+        success, error = ensure_directory_exists(self.dest)
+        if not success:
+            logger.error(error)
+            self._result.failures.append(FailedFile("", "permission", error, 1))
+            return None
+        self._listing = self._open_listing()
+        if not self.options.single_instance:
+            # Files this run rewrites would leave the index pointing at other content
+            _remove_outdated(os.path.join(self.dest, META_DIR_NAME, SIS_INDEX_NAME), "single-instance index")
+
+        state = None
+        if self.options.journal:
+            state = JobJournal.load(self._journal.path, self.source)
+
+        if state is not None:
+            self._resumed = True
+            self._result.run_id = state.run_id
+            planned = self._resume(state)
+            self._journal.reopen()
+            if self._listing is not None:
+                # Files the interrupted run wrote were never recorded
+                self._listing.invalidate()
+            logger.info(f"Resuming interrupted run {state.run_id} from its journal: "
+                        f"{len(planned)} of {self._result.files_total} files left")
+        else:
+            meta_dir = os.path.join(self.dest, META_DIR_NAME)
+            self._result.run_id = new_run_id(lambda run_id: os.path.exists(manifest_path(meta_dir, run_id)))
+            self._load_previous_manifest()
+            planned = self.plan()
+            self._reformat = self._format_changed()
+            if self._reformat:
+                # Files kept from earlier runs would be stored in the old format
+                planned = list(self._scanned)
+                self._result.files_skipped = 0
+                self._result.stats.pop("noop", None)
+
+        journaled = planned
+        if self.options.single_instance and planned:
+            sis_path = os.path.join(self.dest, META_DIR_NAME, SIS_INDEX_NAME)
+            # Indexed files in the old format must not be linked to
+            self._sis = SingleInstanceIndex(sis_path) if self._reformat else SingleInstanceIndex.load(sis_path)
+            planned = self._link_duplicates(planned, defer_duplicates)
+            journaled = planned + [entry for waiting in self._waiting.values() for entry in waiting]
+        self._emit("scan_complete", message=f"{len(planned)} of {self._result.files_total} files to copy")
+        logger.info(f"Native engine planned {len(planned)} of {self._result.files_total} files")
+
+        if not self._admit(planned):
+            self._journal.close()
+            self._result.duration_seconds = time.monotonic() - self._start
+            self._emit("run_complete", message="refused: not enough free space")
+            return None
+
+        if not self._resumed:
+            try:
+                save_mirror_format(os.path.join(self.dest, META_DIR_NAME), self._chunk_stages)
+            except OSError as e:
+                logger.error(f"Cannot record the destination format: {e}")
+                self._result.failures.append(FailedFile("", classify_error(e)[0], str(e), 1))
+                self._journal.close()
+                self._result.duration_seconds = time.monotonic() - self._start
+                self._emit("run_complete", message="refused: cannot record the destination format")
+                return None
+
+        if self.options.journal and not self._resumed:
+            self._journal.begin(self._result.run_id, self.source, self.options.durability)
+            self._journal.record_plan(journaled, self._source_dirs)
+
+        # Create every source directory up front so empty folders are mirrored too (/E)
+        for directory in self._source_dirs:
+            os.makedirs(self._dest_path(directory.rel_path), exist_ok=True)
+
+        return planned
+
+    def finish(self, pipeline_stats: Dict[str, Any]) -> RunResult:
+        """
+        Purge, apply metadata, write the manifest and close the run after its data phase.
+
+        Args:
+            pipeline_stats: Statistics returned by the pipeline that copied the files
+
+        Returns:
+            RunResult of the run
+        """
+        self._result.stats["pipeline"] = pipeline_stats
+        if pipeline_stats:
+            self._result.stats["read_throughput_mb_s"] = self._result.stats["pipeline"]["read"]["throughput_mb_s"]
+
+        # A resumed run only knows its planned files, so the purge waits for the next full run
+        if self.options.mirror and not self._cancel.is_set() and not self._resumed:
+            if self._removed is not None:
+                self._purge_removed(self._removed, self._removed_dirs)
+            elif self._listing is not None:
+                self._purge_removed([path for path in self._listing.paths() if not self._scanned.contains(path)])
+            else:
+                self._purge_extras()
+
+        # Metadata pass: runs after all writes and deletes so directory mtimes stay correct (/DCOPY:T)
+        for directory in self._source_dirs:
+            self._metadata.add(MetadataUpdate(
+                self._dest_path(directory.rel_path), directory.atime_ns, directory.mtime_ns,
+                directory.mode, is_dir=True, depth=directory.rel_path.count("/") + 1
+            ))
+        self._metadata.apply_all()
+
+        # A resumed run only knows part of the source; an unchanged source keeps the previous manifest
+        if (self.options.manifest and not self._resumed and not self._cancel.is_set()
+                and not self._result.stats.get("noop")):
+            self._write_manifest()
+
+        if self.options.catalog:
+            self._record_catalog()
+
+        if self._sis is not None:
+            try:
+                self._sis.save()
+            except OSError as e:
+                logger.warning(f"Cannot save single-instance index: {e}")
+
+        if self._listing is not None:
+            try:
+                self._listing.save()
+            except OSError as e:
+                logger.warning(f"Cannot save destination listing: {e}")
+            self._result.stats.setdefault("dest_listing", {})["files"] = len(self._listing)
+
+        self._durability.finish()
+
+        if self._cancel.is_set():
+            # Keep the journal so the next run resumes where this one stopped
+            self._journal.close()
+        else:
+            self._journal.discard()
+
+        result = self._result
+        result.duration_seconds = time.monotonic() - self._start
+        result.success = not result.failures and not self._cancel.is_set()
+        result.stats["resumed"] = self._resumed
+        result.stats["bytes_written"] = self._bytes_written
+        result.stats["retry_scheduled"] = self._retry_queue.total_scheduled
+        result.stats["durability"] = self.options.durability
+        result.stats["sync_seconds"] = round(self._durability.sync_seconds, 6)
+        result.stats["sync_calls"] = self._durability.sync_calls
+        result.stats["metadata_applied"] = self._metadata.applied
+        result.stats["metadata_failed"] = self._metadata.failed
+        result.stats["metadata_seconds"] = round(self._metadata.seconds, 6)
+        if self.options.single_instance:
+            result.stats["sis_files_linked"] = self._sis_linked
+            result.stats["sis_bytes_avoided"] = self._sis_bytes_avoided
+        result.stats["failures_by_class"] = {}
+        for failure in result.failures:
+            counts = result.stats["failures_by_class"]
+            counts[failure.error_class] = counts.get(failure.error_class, 0) + 1
+
+        self._emit("run_complete", nbytes=result.bytes_copied,
+                   message=f"{result.files_copied} copied, {len(result.failures)} failed")
+        return result
@@ -0,0 +1,415 @@
+"""
+Parity sidecars for the RoboBackup native copy engine
+Reed-Solomon erasure coding over GF(256), so damaged blocks of archives and large files can be rebuilt locally
+"""
+
+import json
+import math
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+from utils.logging_utils import get_logger
+from .manifest import load_latest_manifest
+from .columnar import np, _require_numpy
+from .archive import archive_path, list_archives
+from .scrub import load_scrub_report
+from .native import META_DIR_NAME
+
+logger = get_logger(__name__)
+
+PARITY_MAGIC = b"RBP1"
+PARITY_VERSION = 1
+PARITY_SUFFIX = ".rbpar"
+PARITY_DIR_NAME = "parity"
+
+# Stripes encoded per process-pool task
+_BATCH_STRIPES = 16
+
+_HEADER_LENGTH = struct.Struct(">I")
+
+
+# GF(256) arithmetic with the polynomial x^8 + x^4 + x^3 + x^2 + 1
+_EXP = [0] * 512
+_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+
+_MUL_TABLE = None
+
+
+def _gf_mul(a: int, b: int) -> int:
+    return _EXP[_LOG[a] + _LOG[b]] if a and b else 0
+
+
+def _gf_inv(a: int) -> int:
+    return _EXP[255 - _LOG[a]]
+
+
+def _mul_table():
+    """256x256 product table, so multiplying a block by a constant is one NumPy lookup"""
+    global _MUL_TABLE
+    if _MUL_TABLE is None:
+        _MUL_TABLE = np.array([[_gf_mul(a, b) for b in range(256)] for a in range(256)], dtype=np.uint8)
+    return _MUL_TABLE
+
+
+def _cauchy(data_blocks: int, parity_blocks: int) -> List[List[int]]:
+    """
+    Parity rows of a systematic Cauchy generator matrix. Together with the
+    identity rows of the data, any data_blocks of the rows are invertible, so
+    any parity_blocks lost blocks of a stripe can be rebuilt.
+    """
+    return [[_gf_inv((data_blocks + j) ^ i) for i in range(data_blocks)] for j in range(parity_blocks)]
+
+
+def _invert(matrix: List[List[int]]) -> List[List[int]]:
+    """Invert a square matrix over GF(256) by Gauss-Jordan elimination"""
+    n = len(matrix)
+    rows = [list(row) + [1 if i == j else 0 for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = _gf_inv(rows[col][col])
+        rows[col] = [_gf_mul(v, scale) for v in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [v ^ _gf_mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def _combine(coefficients: List[int], blocks) -> "np.ndarray":
+    """Sum of coefficient * block over GF(256); blocks has the block index as its second-to-last axis"""
+    table = _mul_table()
+    result = np.zeros(blocks.shape[:-2] + blocks.shape[-1:], dtype=np.uint8)
+    for index, coefficient in enumerate(coefficients):
+        if coefficient:
+            result ^= table[coefficient][blocks[..., index, :]]
+    return result
+
+
+@dataclass
+class ParityOptions:
+    """Shape and cost of parity sidecars"""
+    percent: int = 10  # parity overhead; 10 with 20-block stripes gives 2 parity blocks per stripe
+    block_size: int = 64 * 1024
+    stripe_blocks: int = 20  # data blocks per stripe
+    min_bytes: int = 64 * 1024 * 1024  # mirror files smaller than this get no sidecar; archives always do
+    workers: int = 2  # encoding processes
+
+    @property
+    def parity_blocks(self) -> int:
+        """Parity blocks per stripe, i.e. how many damaged blocks a stripe survives"""
+        return max(1, math.ceil(self.stripe_blocks * self.percent / 100))
+
+    def validate(self) -> tuple[bool, str]:
+        """Validate parity options"""
+        if not 1 <= self.percent <= 100:
+            return False, "Parity overhead must be between 1 and 100 percent"
+        if self.block_size < 512:
+            return False, "Parity block size must be at least 512 bytes"
+        if self.stripe_blocks < 1 or self.stripe_blocks + self.parity_blocks > 256:
+            return False, "A parity stripe can hold at most 256 data and parity blocks"
+        if self.min_bytes < 0:
+            return False, "Parity threshold cannot be negative"
+        if self.workers < 1:
+            return False, "Parity workers must be at least 1"
+        return True, ""
+
+    @classmethod
+    def from_engine_options(cls, options: Any) -> "ParityOptions":
+        """Build parity options from EngineOptions"""
+        return cls(percent=options.parity_percent, min_bytes=options.parity_min_bytes,
+                   workers=max(1, options.cpu_workers or options.workers))
+
+
+@dataclass
+class ParityRepair:
+    """Outcome of checking one file against its sidecar"""
+    path: str
+    damaged_blocks: int = 0
+    repaired_blocks: int = 0
+    unrecoverable_stripes: List[int] = field(default_factory=list)
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return not self.error and not self.unrecoverable_stripes
+
+
+def parity_path(dest: str, rel_path: str) -> str:
+    """Sidecar of a file under a destination, kept inside the metadata folder"""
+    return os.path.join(dest, META_DIR_NAME, PARITY_DIR_NAME, *rel_path.split("/")) + PARITY_SUFFIX
+
+
+def _read_block(f, offset: int, block_size: int) -> bytes:
+    """Read one block, zero-padded past the end of the file"""
+    f.seek(offset)
+    data = f.read(block_size)
+    return data + bytes(block_size - len(data))
+
+
+def _encode_stripes(path: str, first: int, count: int, k: int, m: int, block_size: int) -> Tuple[bytes, bytes]:
+    """
+    Process-pool task: parity blocks and block CRCs of count stripes.
+
+    Returns:
+        Tuple of (parity blocks in stripe order, big-endian CRC32 of each stripe's data then parity blocks)
+    """
+    stripe_bytes = k * block_size
+    with open(path, "rb") as f:
+        f.seek(first * stripe_bytes)
+        raw = f.read(count * stripe_bytes)
+    data = np.zeros(count * stripe_bytes, dtype=np.uint8)
+    data[:len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+    data = data.reshape(count, k, block_size)
+    parity = np.stack([_combine(row, data) for row in _cauchy(k, m)], axis=1)
+
+    crcs = []
+    for s in range(count):
+        crcs.extend(zlib.crc32(data[s, i].tobytes()) for i in range(k))
+        crcs.extend(zlib.crc32(parity[s, j].tobytes()) for j in range(m))
+    return parity.tobytes(), struct.pack(f">{len(crcs)}I", *crcs)
+
+
+def _read_header(f) -> Tuple[dict, int]:
+    """Header of a sidecar and the offset of its parity region"""
+    if f.read(len(PARITY_MAGIC)) != PARITY_MAGIC:
+        raise ValueError("Not a RoboBackup parity sidecar")
+    (length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("version") != PARITY_VERSION:
+        raise ValueError("Unsupported parity sidecar version")
+    return header, len(PARITY_MAGIC) + _HEADER_LENGTH.size + length
+
+
+def sidecar_current(path: str, sidecar: str) -> bool:
+    """True if a sidecar exists and was computed from the file as it is now (size and mtime)"""
+    try:
+        st = os.stat(path)
+        with open(sidecar, "rb") as f:
+            header, _ = _read_header(f)
+    except (OSError, ValueError):
+        return False
+    return header["size"] == st.st_size and header["mtime_ns"] == st.st_mtime_ns
+
+
+def write_sidecar(path: str, sidecar: str, options: ParityOptions, pool: Optional[ProcessPoolExecutor] = None) -> int:
+    """
+    Compute the parity sidecar of a file.
+
+    Args:
+        path: File to protect
+        sidecar: Sidecar to write (replaced atomically)
+        options: Parity options
+        pool: Process pool for encoding; stripes are encoded in this process if None
+
+    Returns:
+        Size of the sidecar in bytes
+    """
+    _require_numpy()
+    st = os.stat(path)
+    k, m, block_size = options.stripe_blocks, options.parity_blocks, options.block_size
+    stripes = max(1, -(-st.st_size // (k * block_size)))
+    header = json.dumps({
+        "version": PARITY_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+        "block_size": block_size, "data_blocks": k, "parity_blocks": m, "stripes": stripes,
+    }).encode("utf-8")
+
+    batches = [(first, min(_BATCH_STRIPES, stripes - first)) for first in range(0, stripes, _BATCH_STRIPES)]
+    if pool is not None and len(batches) > 1:
+        # map() keeps the batches in order, so parity is written sequentially
+        results = pool.map(_encode_stripes, *zip(*((path, first, count, k, m, block_size) for first, count in batches)))
+    else:
+        results = (_encode_stripes(path, first, count, k, m, block_size) for first, count in batches)
+
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    tmp = sidecar + ".tmp"
+    crcs = []
+    with open(tmp, "wb") as f:
+        f.write(PARITY_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+        for parity, batch_crcs in results:
+            f.write(parity)
+            crcs.append(batch_crcs)
+        f.write(b"".join(crcs))
+        f.flush()
+        os.fsync(f.fileno())
+        written = f.tell()
+    os.replace(tmp, sidecar)
+    return written
+
+
+def repair_file(path: str, sidecar: str, dry_run: bool = False) -> ParityRepair:
+    """
+    Check a file block by block against its sidecar and rebuild damaged blocks in place.
+
+    Blocks are located by their CRC32; a stripe can lose as many blocks (data
+    or parity) as it has parity blocks. The file's modification time is kept.
+
+    Args:
+        path: Protected file
+        sidecar: Its parity sidecar
+        dry_run: Only count damaged blocks
+
+    Returns:
+        ParityRepair; error is set if the sidecar does not match the file
+    """
+    _require_numpy()
+    outcome = ParityRepair(path)
+    try:
+        st = os.stat(path)
+        with open(sidecar, "rb") as side:
+            header, parity_start = _read_header(side)
+            k, m = header["data_blocks"], header["parity_blocks"]
+            block_size, stripes = header["block_size"], header["stripes"]
+            if header["size"] != st.st_size or header["mtime_ns"] != st.st_mtime_ns:
+                outcome.error = "File changed since its parity was computed"
+                return outcome
+            side.seek(parity_start + stripes * m * block_size)
+            table = side.read(stripes * (k + m) * 4)
+            if len(table) != stripes * (k + m) * 4:
+                outcome.error = "Parity sidecar is truncated"
+                return outcome
+            expected = struct.unpack(f">{stripes * (k + m)}I", table)
+            generator = [[1 if i == j else 0 for i in range(k)] for j in range(k)] + _cauchy(k, m)
+
+            with open(path, "rb" if dry_run else "r+b") as f:
+                for stripe in range(stripes):
+                    base = stripe * k * block_size
+                    blocks = [_read_block(f, base + i * block_size, block_size) for i in range(k)]
+                    side.seek(parity_start + stripe * m * block_size)
+                    blocks += [side.read(block_size) for _ in range(m)]
+                    crcs = expected[stripe * (k + m):(stripe + 1) * (k + m)]
+                    good = [i for i, block in enumerate(blocks) if zlib.crc32(block) == crcs[i]]
+                    damaged = [i for i in range(k) if i not in good]
+                    outcome.damaged_blocks += k + m - len(good)
+                    if not damaged:
+                        continue
+                    if len(good) < k:
+                        outcome.unrecoverable_stripes.append(stripe)
+                        continue
+                    if dry_run:
+                        continue
+
+                    rows = good[:k]
+                    inverse = _invert([generator[r] for r in rows])
+                    survivors = np.stack([np.frombuffer(blocks[r], dtype=np.uint8) for r in rows])
+                    for i in damaged:
+                        rebuilt = _combine(inverse[i], survivors)
+                        offset = base + i * block_size
+                        length = min(block_size, st.st_size - offset)
+                        f.seek(offset)
+                        f.write(rebuilt[:length].tobytes())
+                        outcome.repaired_blocks += 1
+                if outcome.repaired_blocks:
+                    f.flush()
+                    os.fsync(f.fileno())
+        if outcome.repaired_blocks:
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            logger.info(f"Repaired {outcome.repaired_blocks} blocks of {path}")
+    except (OSError, ValueError, KeyError) as e:
+        outcome.error = str(e)
+    return outcome
+
+
+def _protected_files(dest: str, options: ParityOptions) -> List[str]:
+    """Relative paths that get sidecars: every archive, and mirror files of at least min_bytes"""
+    rel_paths = [os.path.basename(archive_path(dest, run_id)) for run_id in list_archives(dest)]
+    manifest = load_latest_manifest(os.path.join(dest, META_DIR_NAME))
+    if manifest is not None:
+        rel_paths.extend(entry.path for entry in manifest if entry.size >= options.min_bytes)
+    return rel_paths
+
+
+def protect_destination(dest: str, options: ParityOptions) -> dict:
+    """
+    Bring the parity sidecars of a destination up to date.
+
+    Missing and stale sidecars are computed, encoding stripes in a process pool,
+    and sidecars of files that no longer exist are removed.
+
+    Args:
+        dest: Job destination folder
+        options: Parity options
+
+    Returns:
+        Statistics: files protected, sidecars written and removed, parity bytes
+    """
+    _require_numpy()
+    stats = {"files": 0, "written": 0, "removed": 0, "parity_bytes": 0}
+    wanted = set()
+    with ProcessPoolExecutor(max_workers=options.workers) as pool:
+        for rel_path in _protected_files(dest, options):
+            path = os.path.join(dest, *rel_path.split("/"))
+            sidecar = parity_path(dest, rel_path)
+            wanted.add(os.path.normcase(sidecar))
+            if not os.path.exists(path):
+                continue
+            stats["files"] += 1
+            if sidecar_current(path, sidecar):
+                continue
+            try:
+                stats["parity_bytes"] += write_sidecar(path, sidecar, options, pool)
+                stats["written"] += 1
+            except OSError as e:
+                logger.warning(f"Cannot write parity for {rel_path}: {e}")
+
+    root = os.path.join(dest, META_DIR_NAME, PARITY_DIR_NAME)
+    for folder, _, names in os.walk(root):
+        for name in names:
+            sidecar = os.path.join(folder, name)
+            if os.path.normcase(sidecar) not in wanted:
+                try:
+                    os.remove(sidecar)
+                    stats["removed"] += 1
+                except OSError as e:
+                    logger.debug(f"Cannot remove stale sidecar {sidecar}: {e}")
+    logger.info(f"Parity for {dest}: {stats['written']} sidecars written, {stats['removed']} removed")
+    return stats
+
+
+def repair_destination(dest: str, findings: Optional[List[dict]] = None, dry_run: bool = False) -> List[ParityRepair]:
+    """
+    Repair the objects a scrub reported as corrupt, from their parity sidecars.
+
+    Args:
+        dest: Job destination folder
+        findings: Scrub findings (dicts with kind, run_id, path, problem); the
+            destination's latest scrub report is used if None
+        dry_run: Only check which blocks are damaged
+
+    Returns:
+        One ParityRepair per damaged file that has a sidecar
+    """
+    if findings is None:
+        findings = (load_scrub_report(dest) or {}).get("findings", [])
+
+    rel_paths = []
+    for finding in findings:
+        if finding["problem"] != "corrupt":
+            continue
+        if finding["kind"] == "archive":
+            rel_path = os.path.basename(archive_path(dest, finding["run_id"]))
+        else:
+            rel_path = finding["path"]
+        if rel_path not in rel_paths:
+            rel_paths.append(rel_path)
+
+    repairs = []
+    for rel_path in rel_paths:
+        sidecar = parity_path(dest, rel_path)
+        if not os.path.exists(sidecar):
+            logger.warning(f"No parity sidecar for {rel_path}; it has to be copied again")
+            continue
+        repairs.append(repair_file(os.path.join(dest, *rel_path.split("/")), sidecar, dry_run))
+    return repairs
@@ -0,0 +1,282 @@
+"""
+Compact path storage for the RoboBackup native copy engine
+Directory trie with interned components and integer file IDs
+"""
+
+import os
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Directory ID of the tree root
+ROOT_DIR = 0
+
+
+class UnsafePathError(ValueError):
+    """A stored relative path that would resolve outside the folder it is restored into"""
+
+
+def safe_join(root: str, rel_path: str) -> str:
+    """
+    Join a '/'-separated relative path from a backup to the folder it is restored into.
+
+    Backslashes count as separators for the checks, so a path written on either
+    platform is judged the same way. '..' components, absolute paths and drive
+    letters are refused, and so is a path whose parent resolves, through
+    symlinks or junctions already in place, outside root.
+
+    Args:
+        root: Folder the path is relative to
+        rel_path: Relative path; '' is root itself
+
+    Returns:
+        Path below root
+
+    Raises:
+        UnsafePathError: If the path could leave root
+    """
+    if not rel_path:
+        return root
+    normalized = rel_path.replace("\\", "/")
+    parts = normalized.split("/")
+    if (os.path.isabs(normalized) or normalized.startswith("/")
+            or any(part == ".." or os.path.splitdrive(part)[0] for part in parts)):
+        raise UnsafePathError(f"Path leaves the restore folder: {rel_path}")
+
+    target = os.path.join(root, *rel_path.split("/"))
+    base = os.path.normcase(os.path.realpath(root))
+    resolved = os.path.normcase(os.path.join(os.path.realpath(os.path.dirname(target)), os.path.basename(target)))
+    try:
+        inside = os.path.commonpath([base, resolved]) == base
+    except ValueError:
+        # Different drives
+        inside = False
+    if not inside:
+        raise UnsafePathError(f"Path leaves the restore folder: {rel_path}")
+    return target
+
+
+class PathStore:
+    """
+    Compact store of '/'-separated relative file paths.
+
+    Directories form a trie: each is stored once as (parent ID, name), so a long
+    shared prefix such as Department/Projects/2024 costs nothing per file. A file
+    is a directory ID plus a name packed into one UTF-8 buffer, and is referred to
+    by its integer ID, assigned in insertion order. Paths are only rebuilt as
+    strings when asked for.
+    """
+
+    # Directories whose name -> file ID maps are kept for find()
+    LOOKUP_CACHE_DIRS = 64
+
+    def __init__(self):
+        """Initialize an empty path store"""
+        self._dir_parent = array("q", [-1])
+        self._dir_names: List[str] = [""]
+        self._dir_ids: Dict[Tuple[int, str], int] = {}
+        self._file_dir = array("q")
+        self._name_ends = array("q")
+        self._names = bytearray()
+        # Built on demand, then kept current as files and directories are added
+        self._dir_files: Optional[Dict[int, array]] = None
+        self._dir_children: Optional[Dict[int, List[int]]] = None
+        self._folded_dir_ids: Optional[Dict[Tuple[int, str], int]] = None
+        self._lookup_cache: "OrderedDict[Tuple[int, bool], Dict[str, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._file_dir)
+
+    @property
+    def dir_count(self) -> int:
+        """Number of directories, including the root"""
+        return len(self._dir_parent)
+
+    def intern_dir(self, rel_dir: str) -> int:
+        """
+        Return the ID of a directory, adding it and any missing ancestors.
+
+        Args:
+            rel_dir: '/'-separated directory path, '' for the root
+
+        Returns:
+            Directory ID
+        """
+        dir_id = ROOT_DIR
+        for name in rel_dir.split("/") if rel_dir else ():
+            child = self._dir_ids.get((dir_id, name))
+            if child is None:
+                child = len(self._dir_parent)
+                self._dir_parent.append(dir_id)
+                self._dir_names.append(name)
+                self._dir_ids[(dir_id, name)] = child
+                if self._dir_children is not None:
+                    self._dir_children.setdefault(dir_id, []).append(child)
+                if self._folded_dir_ids is not None:
+                    self._folded_dir_ids.setdefault((dir_id, name.lower()), child)
+            dir_id = child
+        return dir_id
+
+    def add_file(self, dir_id: int, name: str) -> int:
+        """
+        Add a file to a known directory.
+
+        Args:
+            dir_id: ID returned by intern_dir()
+            name: File name
+
+        Returns:
+            File ID
+        """
+        self._names += name.encode("utf-8")
+        self._name_ends.append(len(self._names))
+        self._file_dir.append(dir_id)
+        file_id = len(self._file_dir) - 1
+        if self._dir_files is not None:
+            self._dir_files.setdefault(dir_id, array("q")).append(file_id)
+        for casefold in (False, True):
+            names = self._lookup_cache.get((dir_id, casefold))
+            if names is not None:
+                names[name.lower() if casefold else name] = file_id
+        return file_id
+
+    def add(self, rel_path: str) -> int:
+        """Add a file by relative path and return its ID; duplicates are not detected"""
+        parent, _, name = rel_path.rpartition("/")
+        return self.add_file(self.intern_dir(parent), name)
+
+    def name(self, file_id: int) -> str:
+        """File name of a file ID"""
+        start = self._name_ends[file_id - 1] if file_id else 0
+        return self._names[start:self._name_ends[file_id]].decode("utf-8")
+
+    def dir_of(self, file_id: int) -> int:
+        """Directory ID of a file"""
+        return self._file_dir[file_id]
+
+    def dir_name(self, dir_id: int) -> str:
+        """Last component of a directory path"""
+        return self._dir_names[dir_id]
+
+    def dir_parent(self, dir_id: int) -> int:
+        """Parent directory ID, -1 for the root"""
+        return self._dir_parent[dir_id]
+
+    def dir_path(self, dir_id: int) -> str:
+        """Relative path of a directory"""
+        parts = []
+        while dir_id > ROOT_DIR:
+            parts.append(self._dir_names[dir_id])
+            dir_id = self._dir_parent[dir_id]
+        return "/".join(reversed(parts))
+
+    def path(self, file_id: int) -> str:
+        """Relative path of a file"""
+        directory = self.dir_path(self._file_dir[file_id])
+        name = self.name(file_id)
+        return f"{directory}/{name}" if directory else name
+
+    def __iter__(self) -> Iterator[str]:
+        """Every file path in ID order"""
+        dir_paths: Dict[int, str] = {}
+        for file_id, dir_id in enumerate(self._file_dir):
+            directory = dir_paths.get(dir_id)
+            if directory is None:
+                directory = dir_paths[dir_id] = self.dir_path(dir_id)
+            name = self.name(file_id)
+            yield f"{directory}/{name}" if directory else name
+
+    def find_dir(self, rel_dir: str, casefold: bool = False) -> Optional[int]:
+        """
+        Look up a directory without adding it.
+
+        Args:
+            rel_dir: '/'-separated directory path
+            casefold: Match names case-insensitively, as Windows file systems do
+
+        Returns:
+            Directory ID, or None if it is not in the store
+        """
+        index = self._dir_ids
+        if casefold:
+            if self._folded_dir_ids is None:
+                self._folded_dir_ids = {}
+                for (parent, name), dir_id in self._dir_ids.items():
+                    self._folded_dir_ids.setdefault((parent, name.lower()), dir_id)
+            index = self._folded_dir_ids
+            rel_dir = rel_dir.lower()
+        dir_id = ROOT_DIR
+        for name in rel_dir.split("/") if rel_dir else ():
+            dir_id = index.get((dir_id, name))
+            if dir_id is None:
+                return None
+        return dir_id
+
+    def files_in(self, dir_id: int) -> array:
+        """IDs of the files directly inside a directory"""
+        if self._dir_files is None:
+            index: Dict[int, array] = {}
+            for file_id, owner in enumerate(self._file_dir):
+                ids = index.get(owner)
+                if ids is None:
+                    ids = index[owner] = array("q")
+                ids.append(file_id)
+            self._dir_files = index
+        return self._dir_files.get(dir_id, array("q"))
+
+    def subdirs_of(self, dir_id: int) -> List[int]:
+        """IDs of the directories directly inside a directory"""
+        if self._dir_children is None:
+            children: Dict[int, List[int]] = {}
+            for child, parent in enumerate(self._dir_parent):
+                if parent >= 0:
+                    children.setdefault(parent, []).append(child)
+            self._dir_children = children
+        return self._dir_children.get(dir_id, [])
+
+    def names_in(self, dir_id: int, casefold: bool = False) -> Dict[str, int]:
+        """
+        Map the file names in a directory to their IDs.
+
+        Maps for the most recently used directories are cached, so lookups that
+        arrive directory by directory cost one pass over each directory.
+        """
+        key = (dir_id, casefold)
+        names = self._lookup_cache.get(key)
+        if names is not None:
+            self._lookup_cache.move_to_end(key)
+            return names
+        names = {}
+        for file_id in self.files_in(dir_id):
+            name = self.name(file_id)
+            names[name.lower() if casefold else name] = file_id
+        self._lookup_cache[key] = names
+        if len(self._lookup_cache) > self.LOOKUP_CACHE_DIRS:
+            self._lookup_cache.popitem(last=False)
+        return names
+
+    def find(self, rel_path: str, casefold: bool = False) -> Optional[int]:
+        """
+        Look up a file without adding it.
+
+        Args:
+            rel_path: '/'-separated file path
+            casefold: Match names case-insensitively
+
+        Returns:
+            File ID, or None if the path is not in the store
+        """
+        parent, _, name = rel_path.rpartition("/")
+        dir_id = self.find_dir(parent, casefold)
+        if dir_id is None:
+            return None
+        return self.names_in(dir_id, casefold).get(name.lower() if casefold else name)
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the file table, excluding derived indexes"""
+        return (
+            len(self._names)
+            + self._file_dir.itemsize * len(self._file_dir)
+            + self._name_ends.itemsize * len(self._name_ends)
+            + sum(len(name) + 64 for name in self._dir_names)
+        )
@@ -0,0 +1,454 @@
+"""
+Copy pipeline for the RoboBackup native copy engine
+Connects reader threads, CPU transform stages and writer threads with bounded queues
+"""
+
+import hashlib
+import queue
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from utils.logging_utils import get_logger, log_exception
+from .buffers import BufferPool
+from .iohints import advise_dontneed, advise_willneed
+
+logger = get_logger(__name__)
+
+# Stages a job can enable. "hash" is a running digest of each whole file, so it
+# runs in the reader thread that owns the file (hashlib releases the GIL);
+# "compress" and "encrypt" work chunk by chunk and run on the CPU pool.
+TRANSFORMS = ("hash", "compress", "encrypt")
+CHUNK_TRANSFORMS = ("compress", "encrypt")
+
+# Files written with chunk transforms start with this header, followed by one
+# length-prefixed frame per chunk
+STREAM_MAGIC = b"RBX1"
+_FRAME = struct.Struct(">I")
+
+COMPRESS_LEVEL = 6
+
+
+def transform_chunk(data: bytes, stages: Tuple[str, ...], key: Optional[bytes]) -> Tuple[bytes, float]:
+    """
+    Apply the chunk transforms in order. Runs in a worker process.
+
+    Args:
+        data: Chunk read from the source file
+        stages: Chunk transforms to apply, in order
+        key: Fernet key, required for "encrypt"
+
+    Returns:
+        Tuple of (transformed data, seconds spent)
+    """
+    start = time.perf_counter()
+    for stage in stages:
+        if stage == "compress":
+            data = zlib.compress(data, COMPRESS_LEVEL)
+        elif stage == "encrypt":
+            from cryptography.fernet import Fernet
+            data = Fernet(key).encrypt(data)
+    return data, time.perf_counter() - start
+
+
+def untransform_chunk(data: bytes, stages: Tuple[str, ...], key: Optional[bytes]) -> bytes:
+    """Reverse transform_chunk for one frame"""
+    for stage in reversed(stages):
+        if stage == "compress":
+            data = zlib.decompress(data)
+        elif stage == "encrypt":
+            from cryptography.fernet import Fernet
+            data = Fernet(key).decrypt(data)
+    return data
+
+
+def write_stream_header(fileobj: BinaryIO, stages: Tuple[str, ...]) -> int:
+    """Write the header that marks a file as a transformed stream; returns its length"""
+    names = ",".join(stages).encode("ascii")
+    header = STREAM_MAGIC + bytes([len(names)]) + names
+    fileobj.write(header)
+    return len(header)
+
+
+def iter_decoded_chunks(
+    fileobj: BinaryIO,
+    key: Optional[bytes] = None,
+    expected: Optional[Tuple[str, ...]] = None
+) -> Iterator[bytes]:
+    """
+    Read a file written with chunk transforms and yield the original data.
+
+    Args:
+        fileobj: File opened in binary mode, positioned at the start
+        key: Fernet key if the stream is encrypted
+        expected: Stages the file must have been written with, e.g. those recorded for its destination
+
+    Yields:
+        Decoded chunks in order
+
+    Raises:
+        ValueError: If the file is not a transformed stream, or was written with other stages
+    """
+    if fileobj.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise ValueError("Not a RoboBackup transformed stream")
+    length = fileobj.read(1)[0]
+    stages = tuple(s for s in fileobj.read(length).decode("ascii").split(",") if s)
+    if expected is not None and stages != tuple(expected):
+        raise ValueError(f"Stream written with {','.join(stages) or 'no'} transforms, "
+                         f"expected {','.join(expected) or 'none'}")
+    while True:
+        header = fileobj.read(_FRAME.size)
+        if not header:
+            return
+        (size,) = _FRAME.unpack(header)
+        yield untransform_chunk(fileobj.read(size), stages, key)
+
+
+class StageStats:
+    """Busy time and queue depth of one pipeline stage"""
+
+    def __init__(self, name: str, threads: int):
+        """
+        Initialize stage statistics
+
+        Args:
+            name: Stage name
+            threads: Number of threads (or processes) serving the stage
+        """
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def add_busy(self, seconds: float, items: int = 1, nbytes: int = 0):
+        """Record time spent doing useful work"""
+        with self._lock:
+            self.busy_seconds += seconds
+            self.items += items
+            self.bytes += nbytes
+
+    def sample_depth(self, depth: int):
+        """Record the depth of the queue feeding this stage"""
+        with self._lock:
+            self._depth_total += depth
+            self._depth_samples += 1
+            self.max_depth = max(self.max_depth, depth)
+
+    def to_dict(self, wall_seconds: float) -> Dict[str, Any]:
+        """Summarize the stage; utilization is busy time over available thread time"""
+        capacity = wall_seconds * max(1, self.threads)
+        return {
+            "threads": self.threads,
+            "items": self.items,
+            "bytes": self.bytes,
+            "throughput_mb_s": round(self.bytes / wall_seconds / (1024 * 1024), 2) if wall_seconds > 0 else 0.0,
+            "busy_seconds": round(self.busy_seconds, 6),
+            "utilization": round(self.busy_seconds / capacity, 4) if capacity > 0 else 0.0,
+            "avg_queue_depth": round(self._depth_total / self._depth_samples, 2) if self._depth_samples else 0.0,
+            "max_queue_depth": self.max_depth,
+        }
+
+
+@dataclass
+class CopyUnit:
+    """One file travelling through the pipeline"""
+    entry: Any
+    attempt: int
+    seq: int
+    output: Optional[BinaryIO] = None
+    bytes_read: int = 0
+    bytes_written: int = 0
+    digest: str = ""
+    error: Optional[BaseException] = None
+    state: Any = None  # free for the handler's own bookkeeping
+
+
+# Message kinds on the writer queues
+_CHUNK = "chunk"
+_END = "end"
+_ERROR = "error"
+_STOP = "stop"
+
+
+class CopyPipeline:
+    """
+    Staged read -> transform -> write pipeline.
+
+    Reader threads take files from the handler and read them in chunks. Chunks go
+    to the CPU pool when chunk transforms are enabled, and then to a writer thread.
+    All chunks of a file go to the same writer, through a bounded FIFO queue, so
+    they are written in order and a slow writer blocks the readers feeding it
+    instead of letting memory grow.
+
+    The handler supplies the file-level behaviour:
+        next_unit() -> Optional[CopyUnit]   None once there is no more work
+        backlog() -> int      files waiting to be read
+        open_source(unit) -> BinaryIO   must support readinto(); unbuffered is best
+        open_output(unit) -> BinaryIO
+        finish_output(unit)   flush, close and rename into place
+        abort_output(unit)    discard a partially written output
+        unit_done(unit, error)
+    """
+
+    def __init__(
+        self,
+        handler: Any,
+        readers: int = 4,
+        writers: int = 2,
+        transforms: Optional[List[str]] = None,
+        cpu_workers: int = 0,
+        cpu_executor: str = "process",
+        queue_depth: int = 16,
+        chunk_size: int = 1024 * 1024,
+        encryption_key: Optional[bytes] = None,
+        buffer_count: int = 32,
+        io_hints: bool = False,
+        readahead_chunks: int = 4
+    ):
+        """
+        Initialize copy pipeline
+
+        Args:
+            handler: Object implementing the handler methods listed above
+            readers: Number of reader threads
+            writers: Number of writer threads
+            transforms: Enabled transforms from TRANSFORMS, in order
+            cpu_workers: Size of the CPU pool (0 uses the executor's default)
+            cpu_executor: "process" or "thread"
+            queue_depth: Capacity of each writer queue, in chunks
+            chunk_size: Bytes per read, rounded up to the page size
+            encryption_key: Fernet key for the "encrypt" transform
+            buffer_count: Number of pooled read buffers; copy memory is buffer_count * chunk_size
+            io_hints: Issue page-cache hints (WILLNEED ahead of reads, DONTNEED behind reads and writes)
+            readahead_chunks: Size of the WILLNEED window, in chunks
+        """
+        self.handler = handler
+        self.readers = max(1, readers)
+        self.writers = max(1, writers)
+        transforms = list(transforms or [])
+        self.hash_files = "hash" in transforms
+        self.chunk_stages = tuple(t for t in transforms if t in CHUNK_TRANSFORMS)
+        self.cpu_workers = cpu_workers or None
+        self.cpu_executor = cpu_executor
+        self.queue_depth = max(1, queue_depth)
+        self.encryption_key = encryption_key
+        self.buffers = BufferPool(max(1, buffer_count), chunk_size)
+        self.chunk_size = self.buffers.size
+        self.io_hints = io_hints
+        self.readahead_bytes = max(1, readahead_chunks) * self.chunk_size
+
+        self._writer_queues: List[queue.Queue] = [queue.Queue(maxsize=self.queue_depth) for _ in range(self.writers)]
+        self._pool = None
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.stats = {
+            "read": StageStats("read", self.readers),
+            "hash": StageStats("hash", self.readers),
+            "transform": StageStats("transform", 0),
+            "write": StageStats("write", self.writers),
+        }
+
+    @property
+    def transforms_output(self) -> bool:
+        """True if written files are transformed streams rather than plain copies"""
+        return bool(self.chunk_stages)
+
+    def _reader(self):
+        """Read files chunk by chunk and hand the chunks to the file's writer"""
+        read_stats = self.stats["read"]
+        hash_stats = self.stats["hash"]
+        while True:
+            read_stats.sample_depth(self.handler.backlog())
+            unit = self.handler.next_unit()
+            if unit is None:
+                return
+            writer_queue = self._writer_queues[unit.seq % self.writers]
+            hasher = hashlib.sha256() if self.hash_files else None
+            try:
+                with self.handler.open_source(unit) as fsrc:
+                    while True:
+                        offset = unit.bytes_read
+                        if self.io_hints and offset % self.readahead_bytes == 0:
+                            advise_willneed(fsrc.fileno(), offset, self.readahead_bytes)
+                        buf = self.buffers.acquire()
+                        start = time.perf_counter()
+                        try:
+                            n = fsrc.readinto(buf)
+                        except BaseException:
+                            self.buffers.release(buf)
+                            raise
+                        read_stats.add_busy(time.perf_counter() - start, nbytes=n or 0)
+                        if not n:
+                            self.buffers.release(buf)
+                            break
+                        unit.bytes_read += n
+                        if self.io_hints:
+                            # The data now lives in our buffer; the cached pages are no longer needed
+                            advise_dontneed(fsrc.fileno(), offset, n)
+                        if hasher is not None:
+                            start = time.perf_counter()
+                            hasher.update(buf[:n])
+                            hash_stats.add_busy(time.perf_counter() - start)
+                        if self._pool is not None:
+                            # Worker processes need their own copy; the buffer is free again right away
+                            data = bytes(buf[:n])
+                            self.buffers.release(buf)
+                            with self._in_flight_lock:
+                                self._in_flight += 1
+                                self.stats["transform"].sample_depth(self._in_flight)
+                            payload = self._pool.submit(transform_chunk, data, self.chunk_stages, self.encryption_key)
+                        else:
+                            payload = (buf, n)
+                        writer_queue.put((_CHUNK, unit, payload))
+                if hasher is not None:
+                    unit.digest = hasher.hexdigest()
+                writer_queue.put((_END, unit, None))
+            except Exception as e:
+                writer_queue.put((_ERROR, unit, e))
+
+    def _write_payload(self, unit: CopyUnit, payload: Any):
+        """Wait for a chunk's transform if needed and write it"""
+        if isinstance(payload, tuple):
+            buf, n = payload
+            try:
+                if unit.output is None:
+                    self._open(unit)
+                start = time.perf_counter()
+                unit.output.write(buf[:n])
+                unit.bytes_written += n
+                self.stats["write"].add_busy(time.perf_counter() - start, nbytes=n)
+            finally:
+                self.buffers.release(buf)
+            self._drop_written(unit)
+            return
+        if isinstance(payload, Future):
+            try:
+                payload, cpu_seconds = payload.result()
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight -= 1
+            self.stats["transform"].add_busy(cpu_seconds)
+        if unit.output is None:
+            self._open(unit)
+        # Only chunk transforms produce non-buffer payloads, and their output is framed
+        start = time.perf_counter()
+        written = _FRAME.size + len(payload)
+        unit.output.write(_FRAME.pack(len(payload)))
+        unit.output.write(payload)
+        unit.bytes_written += written
+        self.stats["write"].add_busy(time.perf_counter() - start, nbytes=written)
+        self._drop_written(unit)
+
+    def _drop_written(self, unit: CopyUnit):
+        """
+        Drop cached pages of output written a readahead window ago.
+
+        Dirty pages can only be dropped after writeback, so the hint trails the
+        write position instead of covering the chunk just written.
+        """
+        if not self.io_hints:
+            return
+        end = unit.bytes_written - self.readahead_bytes
+        if end > 0:
+            advise_dontneed(unit.output.fileno(), max(0, end - self.readahead_bytes), self.readahead_bytes)
+
+    def _open(self, unit: CopyUnit):
+        """Open a unit's output and write the stream header if chunks are transformed"""
+        unit.output = self.handler.open_output(unit)
+        if self.chunk_stages:
+            unit.bytes_written += write_stream_header(unit.output, self.chunk_stages)
+
+    def _writer(self, index: int):
+        """Write chunks in arrival order and finish or abort each file"""
+        writer_queue = self._writer_queues[index]
+        while True:
+            self.stats["write"].sample_depth(writer_queue.qsize())
+            kind, unit, payload = writer_queue.get()
+            if kind == _STOP:
+                return
+            if unit.error is not None:
+                # Already failed; drop its remaining chunks and report once at the end marker
+                if kind == _CHUNK and isinstance(payload, tuple):
+                    self.buffers.release(payload[0])
+                elif kind != _CHUNK:
+                    self._done(unit, unit.error)
+                continue
+            try:
+                if kind == _ERROR:
+                    raise payload
+                if kind == _CHUNK:
+                    self._write_payload(unit, payload)
+                else:
+                    if unit.output is None:
+                        self._open(unit)
+                    if self.io_hints:
+                        unit.output.flush()
+                        advise_dontneed(unit.output.fileno(), 0, 0)
+                    self.handler.finish_output(unit)
+                    self._done(unit, None)
+            except Exception as e:
+                unit.error = e
+                try:
+                    self.handler.abort_output(unit)
+                except Exception:
+                    log_exception(logger, "Failed to abort partial output")
+                if kind != _CHUNK:
+                    self._done(unit, e)
+
+    def _done(self, unit: CopyUnit, error: Optional[BaseException]):
+        """Report a finished unit to the handler"""
+        try:
+            self.handler.unit_done(unit, error)
+        except Exception:
+            log_exception(logger, "Pipeline completion handler raised an exception")
+
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Run until the handler has no more units.
+
+        Returns:
+            Per-stage statistics: threads, items, busy_seconds, utilization and queue depth
+        """
+        start = time.monotonic()
+        if self.chunk_stages:
+            if self.cpu_executor == "thread":
+                self._pool = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix="pipeline-cpu")
+            else:
+                self._pool = ProcessPoolExecutor(max_workers=self.cpu_workers)
+            self.stats["transform"].threads = self._pool._max_workers
+
+        writers = [
+            threading.Thread(target=self._writer, args=(i,), name=f"pipeline-write-{i}", daemon=True)
+            for i in range(self.writers)
+        ]
+        readers = [
+            threading.Thread(target=self._reader, name=f"pipeline-read-{i}", daemon=True)
+            for i in range(self.readers)
+        ]
+        try:
+            for thread in writers + readers:
+                thread.start()
+            for thread in readers:
+                thread.join()
+        finally:
+            for writer_queue in self._writer_queues:
+                writer_queue.put((_STOP, None, None))
+            for thread in writers:
+                thread.join()
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+        wall = time.monotonic() - start
+        summary = {name: stage.to_dict(wall) for name, stage in self.stats.items()}
+        summary["buffers"] = self.buffers.stats()
+        self.buffers.close()
+        return summary
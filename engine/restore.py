@@ -0,0 +1,521 @@
+"""
+Restore engine for RoboBackup
+Parallel restore from a mirror or archive destination, with requested paths served first
+"""
+
+import heapq
+import itertools
+import os
+import stat
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from utils.logging_utils import get_logger, log_exception
+from .retry import RetryQueue, classify_error
+from .pipeline import iter_decoded_chunks
+from .archive import ARCHIVE_SUFFIX, ArchiveReader, list_archives, open_archive
+from .catalog import run_locations
+from .paths import UnsafePathError, safe_join
+from .native import (
+    META_DIR_NAME,
+    PARTIAL_SUFFIX,
+    PROTECTED_DEST_NAMES,
+    EngineEvent,
+    EngineOptions,
+    FailedFile,
+    RunResult,
+    _walk,
+    load_mirror_format
+)
+
+logger = get_logger(__name__)
+
+# Queue priorities: explicitly requested files, then everything else
+PRIORITY_REQUESTED = 0
+PRIORITY_BULK = 1
+
+
+@dataclass
+class RestoreItem:
+    """One file to restore"""
+    rel_path: str
+    size: int
+    mtime_ns: int
+    mode: int = 0  # permission bits to apply; 0 = leave the default
+
+
+def _selected(rel_path: str, selection: Optional[List[str]]) -> bool:
+    """True if a path is one of the selected files or lies under a selected folder"""
+    if selection is None:
+        return True
+    return any(rel_path == s or rel_path.startswith(s + "/") for s in selection)
+
+
+def _selected_any(selection: str, items) -> bool:
+    """True if a requested path matched at least one file"""
+    if selection in items:
+        return True
+    prefix = selection + "/"
+    return any(path.startswith(prefix) for path in items)
+
+
+def _normalize(paths: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """Convert user-supplied paths to '/'-separated relative paths; '' or '.' means everything"""
+    if paths is None:
+        return None
+    normalized = [p.replace("\\", "/").strip("/") for p in paths]
+    return None if any(p in ("", ".") for p in normalized) else normalized
+
+
+class MirrorRestoreSource:
+    """
+    Restore from a mirror destination: a plain copy of the tree.
+
+    Whether files are decoded follows the chunk transforms recorded for the
+    destination; a file not written with them fails to restore. Destinations
+    without a record (e.g. written by robocopy) are copied as is. Item sizes are
+    stored sizes, so they are only comparable with restored files (compare_size)
+    when nothing was transformed.
+    """
+
+    kind = "mirror"
+
+    def __init__(self, root: str, encryption_key: Optional[bytes] = None):
+        """
+        Initialize mirror restore source
+
+        Args:
+            root: Destination folder of the backup job
+            encryption_key: Fernet key for files written with the encrypt transform
+
+        Raises:
+            ValueError: If the destination's format record is unreadable
+        """
+        self.root = root
+        self.encryption_key = encryption_key
+        self.stages = load_mirror_format(os.path.join(root, META_DIR_NAME)) or ()
+        self.compare_size = not self.stages
+
+    def lookup(self, rel_path: str) -> Optional[RestoreItem]:
+        """The file at rel_path, or None if it is not a file of the backup"""
+        try:
+            st = os.stat(safe_join(self.root, rel_path))
+        except (OSError, ValueError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return RestoreItem(rel_path, st.st_size, st.st_mtime_ns, st.st_mode)
+
+    def items(self, selection: Optional[List[str]]) -> Iterator[RestoreItem]:
+        """Files of the backup inside the selection"""
+        # Engine state and unfinished copies are never restored
+        for prefix in selection if selection is not None else [""]:
+            try:
+                abs_path = safe_join(self.root, prefix)
+            except UnsafePathError:
+                continue
+            if prefix and os.path.isfile(abs_path):
+                item = self.lookup(prefix)
+                if item is not None:
+                    yield item
+                continue
+            if not os.path.isdir(abs_path):
+                continue
+            for rel_dir, name, st in _walk(abs_path, list(PROTECTED_DEST_NAMES), ["*" + PARTIAL_SUFFIX], None):
+                rel_path = "/".join(p for p in (prefix, rel_dir, name) if p)
+                yield RestoreItem(rel_path, st.st_size, st.st_mtime_ns, st.st_mode)
+
+    def directories(self, selection: Optional[List[str]]) -> Iterator[Tuple[str, int]]:
+        """(rel_path, mtime_ns) of every folder of the backup inside the selection, empty ones included"""
+        for prefix in selection if selection is not None else [""]:
+            try:
+                abs_path = safe_join(self.root, prefix)
+            except UnsafePathError:
+                continue
+            if not os.path.isdir(abs_path):
+                continue
+            if prefix:
+                yield prefix, os.stat(abs_path).st_mtime_ns
+            found = []
+            # Excluding every file name lists folders without a stat per file
+            for _ in _walk(abs_path, list(PROTECTED_DEST_NAMES), ["*"], found):
+                pass
+            for directory in found:
+                yield "/".join(p for p in (prefix, directory.rel_path) if p), directory.mtime_ns
+
+    def restore(self, item: RestoreItem, target: str, chunk_size: int) -> int:
+        """Write one file to target; returns the bytes written"""
+        src = os.path.join(self.root, *item.rel_path.split("/"))
+        written = 0
+        with open(src, "rb") as fsrc, open(target, "wb") as fdst:
+            if self.stages:
+                for chunk in iter_decoded_chunks(fsrc, self.encryption_key, self.stages):
+                    written += fdst.write(chunk)
+            else:
+                buf = bytearray(chunk_size)
+                view = memoryview(buf)
+                while True:
+                    n = fsrc.readinto(buf)
+                    if not n:
+                        break
+                    written += fdst.write(view[:n])
+        return written
+
+    def close(self):
+        pass
+
+
+class ArchiveRestoreSource:
+    """Restore from one seekable archive, i.e. one run of an archive destination"""
+
+    kind = "archive"
+    compare_size = True
+
+    def __init__(self, archive: Union[str, ArchiveReader]):
+        """
+        Initialize archive restore source
+
+        Args:
+            archive: Archive file, or an open reader (e.g. of an archive on another storage tier)
+        """
+        self.reader = archive if isinstance(archive, ArchiveReader) else ArchiveReader(archive)
+
+    def lookup(self, rel_path: str) -> Optional[RestoreItem]:
+        """The member at rel_path, or None"""
+        member = self.reader.members.get(rel_path)
+        return RestoreItem(member.path, member.size, member.mtime_ns, member.mode) if member else None
+
+    def items(self, selection: Optional[List[str]]) -> Iterator[RestoreItem]:
+        """Members inside the selection"""
+        for member in self.reader.members.values():
+            if _selected(member.path, selection):
+                yield RestoreItem(member.path, member.size, member.mtime_ns, member.mode)
+
+    def directories(self, selection: Optional[List[str]]) -> Iterator[Tuple[str, int]]:
+        """(rel_path, mtime_ns) of the archived folders inside the selection, empty ones included"""
+        for rel_dir, mtime_ns, _ in self.reader.directories:
+            if _selected(rel_dir, selection):
+                yield rel_dir, mtime_ns
+
+    def restore(self, item: RestoreItem, target: str, chunk_size: int) -> int:
+        """Write one member to target, verifying its checksum; returns the bytes written"""
+        written = 0
+        with open(target, "wb") as fdst:
+            for chunk in self.reader.iter_member(self.reader.members[item.rel_path], chunk_size):
+                written += fdst.write(chunk)
+        return written
+
+    def close(self):
+        self.reader.close()
+
+
+def open_restore_source(
+    dest: str,
+    run_id: Optional[str] = None,
+    encryption_key: Optional[bytes] = None,
+    access_key: str = "",
+    secret_key: str = ""
+):
+    """
+    Pick the restore source for a backup destination.
+
+    Archive runs moved to another storage tier are read from there, as the
+    destination's catalog records.
+
+    Args:
+        dest: Job destination folder, or an archive file
+        run_id: Archive run to restore; the latest archive is used if None
+        encryption_key: Fernet key for encrypted mirror files
+        access_key: Access key ID for runs on an object store tier
+        secret_key: Secret access key for runs on an object store tier
+
+    Returns:
+        MirrorRestoreSource or ArchiveRestoreSource
+
+    Raises:
+        ValueError: If run_id names no archive, or an archive or the mirror's format record is unreadable
+    """
+    if os.path.isfile(dest) and dest.endswith(ARCHIVE_SUFFIX):
+        return ArchiveRestoreSource(dest)
+    runs = sorted(set(list_archives(dest)) | set(run_locations(os.path.join(dest, META_DIR_NAME))))
+    if run_id is not None:
+        if run_id not in runs:
+            raise ValueError(f"No archive for run {run_id} in {dest}")
+        return ArchiveRestoreSource(open_archive(dest, run_id, access_key, secret_key))
+    if runs:
+        return ArchiveRestoreSource(open_archive(dest, runs[-1], access_key, secret_key))
+    return MirrorRestoreSource(dest, encryption_key)
+
+
+class RestoreEngine:
+    """
+    Restores files from a backup with a pool of worker threads.
+
+    Work is kept in a priority queue: files named explicitly in the request go
+    first, then the contents of requested folders (or the whole backup). More
+    paths can be promoted with prioritize() while the restore runs, so a user
+    waiting on one document does not wait for the bulk of the restore.
+    """
+
+    def __init__(
+        self,
+        source,
+        target: str,
+        paths: Optional[Iterable[str]] = None,
+        priority: Optional[Iterable[str]] = None,
+        options: Optional[EngineOptions] = None,
+        progress_callback: Optional[Callable[[EngineEvent], None]] = None,
+        skip_unchanged: bool = True
+    ):
+        """
+        Initialize restore engine
+
+        Args:
+            source: MirrorRestoreSource or ArchiveRestoreSource
+            target: Folder to restore into
+            paths: Files or folders to restore, relative to the backup root; None restores everything
+            priority: Files or folders to restore before the rest; files named in paths always go first
+            options: Engine options; workers, chunk size and retry settings are used
+            progress_callback: Optional callable receiving EngineEvent objects
+            skip_unchanged: Leave target files that already match in modification time, and in size
+                where the source's sizes are those of the restored files
+        """
+        self.source = source
+        self.target = target
+        self.selection = _normalize(paths)
+        self.priority = [p.replace("\\", "/").strip("/") for p in priority or ()]
+        self.options = options or EngineOptions()
+        self.progress_callback = progress_callback
+        self.skip_unchanged = skip_unchanged
+        self._result = RunResult(run_id=datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self._heap: List[Tuple[int, int, RestoreItem]] = []
+        self._seq = itertools.count()
+        self._items = {}
+        self._dirs: List[Tuple[str, int]] = []  # (rel_path, mtime_ns) of folders to restore
+        self._claimed: Set[str] = set()
+        self._cond = threading.Condition()
+        self._active = 0
+        self._listing = True
+        self._priority_files = 0
+        self._retry_queue = RetryQueue(
+            self.options.retry_base_delay, self.options.retry_max_delay, self.options.retry_jitter
+        )
+        self._cancel = threading.Event()
+
+    def _emit(self, kind: str, path: str = "", nbytes: int = 0, message: str = ""):
+        """Send a progress event to the callback, if any"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(EngineEvent(kind, path, nbytes, message))
+        except Exception:
+            log_exception(logger, "Progress callback raised an exception")
+
+    def cancel(self):
+        """Stop handing out work; files already being written are finished"""
+        self._cancel.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def prioritize(self, paths: Iterable[str]):
+        """
+        Move files to the front of the queue while the restore runs.
+
+        Args:
+            paths: Files or folders already part of the restore
+        """
+        selection = _normalize(paths)
+        with self._cond:
+            for rel_path, item in self._items.items():
+                if rel_path not in self._claimed and _selected(rel_path, selection):
+                    heapq.heappush(self._heap, (PRIORITY_REQUESTED, next(self._seq), item))
+            self._cond.notify_all()
+
+    def _add(self, item: RestoreItem, priority: int):
+        """Queue a file for the workers"""
+        with self._cond:
+            self._items[item.rel_path] = item
+            if priority == PRIORITY_REQUESTED:
+                self._priority_files += 1
+            heapq.heappush(self._heap, (priority, next(self._seq), item))
+            self._cond.notify()
+
+    def _next(self) -> Optional[Tuple[RestoreItem, int]]:
+        """Block until there is work; None once everything is done"""
+        with self._cond:
+            while not self._cancel.is_set():
+                while self._heap:
+                    _, _, item = heapq.heappop(self._heap)
+                    if item.rel_path not in self._claimed:
+                        self._claimed.add(item.rel_path)
+                        self._active += 1
+                        return item, 0
+                retry = self._retry_queue.pop_due()
+                if retry is not None:
+                    self._active += 1
+                    return retry
+                if not self._listing and not self._active and not len(self._retry_queue):
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait(min(self._retry_queue.time_until_next() or 0.5, 0.5))
+            return None
+
+    def _done(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _unchanged(self, item: RestoreItem, target: str) -> bool:
+        try:
+            st = os.stat(target)
+        except OSError:
+            return False
+        if self.source.compare_size and st.st_size != item.size:
+            return False
+        return st.st_mtime_ns == item.mtime_ns
+
+    def _restore(self, item: RestoreItem, attempt: int):
+        """Restore one file, recording the outcome"""
+        result = self._result
+        try:
+            target = safe_join(self.target, item.rel_path)
+        except UnsafePathError as e:
+            with self._cond:
+                result.failures.append(FailedFile(item.rel_path, "invalid_path", str(e), attempt + 1))
+            logger.error(f"Refusing to restore {item.rel_path}: {e}")
+            self._emit("file_failed", item.rel_path, message=f"invalid_path: {e}")
+            return
+        if self.skip_unchanged and self._unchanged(item, target):
+            with self._cond:
+                result.files_skipped += 1
+            return
+        partial = target + PARTIAL_SUFFIX
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            nbytes = self.source.restore(item, partial, self.options.chunk_size)
+            os.replace(partial, target)
+            # Times before permissions, so a read-only mode cannot block the utime call
+            os.utime(target, ns=(item.mtime_ns, item.mtime_ns))
+            if item.mode:
+                os.chmod(target, stat.S_IMODE(item.mode))
+        except (OSError, ValueError) as e:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            if isinstance(e, ValueError):
+                error_class, transient = "corrupt", False
+            else:
+                error_class, transient = classify_error(e)
+            if transient and attempt < self.options.retry_attempts:
+                self._retry_queue.schedule(item, attempt + 1)
+                with self._cond:
+                    result.retries += 1
+                self._emit("file_retry", item.rel_path, message=f"{error_class}: {e}")
+                return
+            with self._cond:
+                result.failures.append(FailedFile(item.rel_path, error_class, str(e), attempt + 1))
+            logger.error(f"Failed to restore {item.rel_path} ({error_class}): {e}")
+            self._emit("file_failed", item.rel_path, message=f"{error_class}: {e}")
+            return
+        with self._cond:
+            result.files_copied += 1
+            result.bytes_copied += nbytes
+        self._emit("file_copied", item.rel_path, nbytes)
+
+    def _restore_directories(self):
+        """Create the selected folders, empty ones included, and restore their times deepest first"""
+        for rel_dir, mtime_ns in sorted(self._dirs, key=lambda d: -d[0].count("/")):
+            try:
+                target = safe_join(self.target, rel_dir)
+            except UnsafePathError as e:
+                logger.error(f"Refusing to restore folder {rel_dir}: {e}")
+                continue
+            try:
+                os.makedirs(target, exist_ok=True)
+                os.utime(target, ns=(mtime_ns, mtime_ns))
+            except OSError as e:
+                logger.warning(f"Cannot restore folder {rel_dir}: {e}")
+
+    def _worker(self):
+        while True:
+            work = self._next()
+            if work is None:
+                return
+            try:
+                self._restore(*work)
+            except Exception as e:
+                log_exception(logger, f"Unexpected error restoring {work[0].rel_path}")
+                with self._cond:
+                    self._result.failures.append(FailedFile(work[0].rel_path, "unknown", str(e), work[1] + 1))
+            finally:
+                self._done()
+
+    def run(self) -> RunResult:
+        """
+        Restore the selection.
+
+        Returns:
+            RunResult; files_copied counts restored files
+        """
+        result = self._result
+        start = time.monotonic()
+        priority = self.priority or None
+        workers = [
+            threading.Thread(target=self._worker, name=f"restore-{i}", daemon=True)
+            for i in range(max(1, self.options.workers))
+        ]
+        try:
+            os.makedirs(self.target, exist_ok=True)
+            for worker in workers:
+                worker.start()
+
+            # Explicitly named files start restoring before the rest is listed
+            for rel_path in self.selection or ():
+                item = self.source.lookup(rel_path)
+                if item is not None:
+                    self._add(item, PRIORITY_REQUESTED)
+            for item in self.source.items(self.selection):
+                if item.rel_path in self._items:
+                    continue
+                urgent = priority is not None and _selected(item.rel_path, priority)
+                self._add(item, PRIORITY_REQUESTED if urgent else PRIORITY_BULK)
+            result.files_total = len(self._items)
+            self._dirs = list(self.source.directories(self.selection))
+            self._emit("scan_complete", message=f"{result.files_total} files to restore")
+        except Exception as e:
+            log_exception(logger, "Restore failed")
+            result.failures.append(FailedFile("", classify_error(e)[0], str(e), 1))
+            self.cancel()
+        finally:
+            with self._cond:
+                self._listing = False
+                self._cond.notify_all()
+        try:
+            for worker in workers:
+                if worker.ident is not None:
+                    worker.join()
+        finally:
+            self.source.close()
+        if not self._cancel.is_set():
+            # After the files, since writing into a folder changes its modification time
+            self._restore_directories()
+
+        folders = {rel_dir for rel_dir, _ in self._dirs}
+        missing = [
+            path for path in (self.selection or ())
+            if path not in folders and not _selected_any(path, self._items)
+        ]
+        for path in missing:
+            result.failures.append(FailedFile(path, "not_found", "Not in backup", 1))
+        result.duration_seconds = time.monotonic() - start
+        result.stats["source"] = self.source.kind
+        result.stats["priority_files"] = self._priority_files
+        result.stats["cancelled"] = self._cancel.is_set()
+        result.success = not result.failures and not self._cancel.is_set()
+        self._emit("run_complete", nbytes=result.bytes_copied,
+                   message=f"{result.files_copied} restored, {len(result.failures)} failed")
+        return result
+
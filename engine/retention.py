@@ -0,0 +1,355 @@
+"""
+Retention for the RoboBackup native copy engine
+Grandfather-father-son selection of runs to keep, and parallel pruning of the rest
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from utils.logging_utils import get_logger, log_exception
+from .manifest import MANIFEST_SUFFIX, manifest_dir
+from .columnar import COLUMNAR_SUFFIX
+from .browse import BROWSE_SUFFIX, list_snapshots
+from .archive import archive_path
+from .catalog import BackupCatalog, catalog_path, run_locations
+from .parity import parity_path
+from .storage import describe, open_backend
+from .native import META_DIR_NAME
+
+logger = get_logger(__name__)
+
+RUN_ID_FORMAT = "%Y%m%d_%H%M%S"
+
+# Bucket of each GFS level: runs with the same key compete for one slot
+_BUCKETS = (
+    ("hourly", lambda t: t.strftime("%Y-%m-%d %H")),
+    ("daily", lambda t: t.strftime("%Y-%m-%d")),
+    ("weekly", lambda t: "%04d-W%02d" % t.isocalendar()[:2]),
+    ("monthly", lambda t: t.strftime("%Y-%m")),
+    ("yearly", lambda t: t.strftime("%Y")),
+)
+
+
+@dataclass
+class RetentionPolicy:
+    """How many versions of each age class to keep; 0 disables a level"""
+    keep_last: int = 1  # most recent runs, kept whatever the other levels say
+    hourly: int = 0
+    daily: int = 0
+    weekly: int = 0
+    monthly: int = 0
+    yearly: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        """True if any GFS level is set; with none set nothing is pruned"""
+        return any((self.hourly, self.daily, self.weekly, self.monthly, self.yearly))
+
+    def validate(self) -> tuple[bool, str]:
+        """Validate retention policy"""
+        if min(self.keep_last, self.hourly, self.daily, self.weekly, self.monthly, self.yearly) < 0:
+            return False, "Retention counts cannot be negative"
+        if self.enabled and self.keep_last < 1:
+            return False, "Retention must keep at least the latest run"
+        return True, ""
+
+    @classmethod
+    def from_job_config(cls, job: Any) -> "RetentionPolicy":
+        """Build a retention policy from a BackupJobConfig"""
+        return cls(
+            keep_last=job.engine_keep_last,
+            hourly=job.engine_keep_hourly,
+            daily=job.engine_keep_daily,
+            weekly=job.engine_keep_weekly,
+            monthly=job.engine_keep_monthly,
+            yearly=job.engine_keep_yearly,
+        )
+
+
+@dataclass
+class RetentionPlan:
+    """Runs to keep and prune at one destination"""
+    dest: str
+    keep: Dict[str, List[str]] = field(default_factory=dict)  # run ID -> reasons
+    prune: List[str] = field(default_factory=list)
+    reclaim_bytes: int = 0
+    files: Dict[str, List[str]] = field(default_factory=dict)  # run ID -> paths deleted with it
+    remote: Dict[str, Tuple[str, List[str]]] = field(default_factory=dict)  # run ID -> (tier location, object keys)
+
+    def report(self) -> str:
+        """Human-readable summary, e.g. for a dry run"""
+        lines = [f"Retention plan for {self.dest}"]
+        for run_id in sorted(set(self.keep) | set(self.prune), reverse=True):
+            if run_id in self.keep:
+                lines.append(f"  keep   {run_id}  ({', '.join(self.keep[run_id])})")
+            elif run_id in self.remote:
+                lines.append(f"  prune  {run_id}  (at {describe(self.remote[run_id][0])})")
+            else:
+                lines.append(f"  prune  {run_id}")
+        lines.append(f"{len(self.keep)} kept, {len(self.prune)} pruned, "
+                     f"{self.reclaim_bytes / (1024 * 1024):.1f} MB to reclaim")
+        return "\n".join(lines)
+
+
+def parse_run_time(run_id: str) -> Optional[datetime]:
+    """Start time encoded in a run ID, or None if it is not a timestamp; a _NN counter suffix is ignored"""
+    stamp, _, counter = run_id.rpartition("_") if run_id.count("_") > 1 else (run_id, "", "")
+    if counter and not counter.isdigit():
+        return None
+    try:
+        return datetime.strptime(stamp, RUN_ID_FORMAT)
+    except ValueError:
+        return None
+
+
+def select_runs(run_ids: List[str], policy: RetentionPolicy) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Apply a GFS policy to a list of runs.
+
+    At each level the newest run of every bucket (hour, day, ISO week, month,
+    year) is kept, newest buckets first, until the level's count is used up.
+    Runs whose IDs are not timestamps are always kept.
+
+    Args:
+        run_ids: Run IDs in any order
+        policy: Retention policy
+
+    Returns:
+        Tuple of (run ID -> reasons for keeping it, run IDs to prune)
+    """
+    keep: Dict[str, List[str]] = {}
+    dated = []
+    for run_id in run_ids:
+        started = parse_run_time(run_id)
+        if started is None:
+            keep.setdefault(run_id, []).append("unrecognised run ID")
+        else:
+            dated.append((started, run_id))
+    dated.sort(reverse=True)
+
+    for started, run_id in dated[:policy.keep_last]:
+        keep.setdefault(run_id, []).append("last")
+    for level, bucket_of in _BUCKETS:
+        count = getattr(policy, level)
+        seen = set()
+        for started, run_id in dated:
+            if len(seen) >= count:
+                break
+            bucket = bucket_of(started)
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.setdefault(run_id, []).append(level)
+
+    prune = [run_id for _, run_id in dated if run_id not in keep]
+    return keep, prune
+
+
+def run_files(dest: str, run_id: str) -> List[str]:
+    """Files and folders that belong to one run at a destination"""
+    folder = manifest_dir(os.path.join(dest, META_DIR_NAME))
+    candidates = [
+        archive_path(dest, run_id),
+        parity_path(dest, os.path.basename(archive_path(dest, run_id))),
+        os.path.join(folder, run_id + MANIFEST_SUFFIX),
+        os.path.join(folder, run_id + COLUMNAR_SUFFIX),
+        os.path.join(folder, run_id + BROWSE_SUFFIX),
+    ]
+    return [path for path in candidates if os.path.lexists(path)]
+
+
+def run_remote_objects(dest: str, run_id: str, location: str) -> Tuple[str, List[str]]:
+    """
+    Objects of a run that was moved to another storage tier.
+
+    Returns:
+        Tuple of (location, object keys), the archive first
+    """
+    # Imported here: the tiering module builds on this one
+    from .tiering import run_objects
+    return location, [key for _, key in reversed(run_objects(dest, run_id))]
+
+
+def reclaimable_bytes(paths: List[str]) -> int:
+    """
+    Bytes freed by deleting paths, counting a hard-linked file only if every
+    one of its links is among them.
+    """
+    links: Dict[Tuple[int, int], List] = {}
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            found = (os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            found = [path]
+        for file_path in found:
+            try:
+                st = os.lstat(file_path)
+            except OSError:
+                continue
+            # st_ino is 0 where the platform cannot report it; treat such files as unshared
+            key = (st.st_dev, st.st_ino) if st.st_ino else (id(file_path), 0)
+            entry = links.setdefault(key, [0, st.st_nlink, st.st_size])
+            entry[0] += 1
+    return sum(size for seen, nlink, size in links.values() if seen >= nlink)
+
+
+def _active_run(dest: str) -> Optional[str]:
+    """Run ID recorded in an unfinished job journal, which must never be pruned"""
+    path = os.path.join(dest, META_DIR_NAME, "journal.jnl")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        return record[2]
+    except (OSError, ValueError, IndexError, TypeError):
+        return None
+
+
+def plan_retention(dest: str, policy: RetentionPolicy) -> RetentionPlan:
+    """
+    Decide which runs of a destination to keep.
+
+    Runs moved to another storage tier count like any other run; pruning one
+    deletes its objects on that tier.
+
+    Args:
+        dest: Job destination folder
+        policy: Retention policy
+
+    Returns:
+        RetentionPlan with reasons for every kept run and the space pruning frees
+    """
+    plan = RetentionPlan(dest)
+    runs = list_snapshots(dest)
+    if not policy.enabled:
+        plan.keep = {run_id: ["no retention policy"] for run_id in runs}
+        return plan
+
+    plan.keep, plan.prune = select_runs(runs, policy)
+    active = _active_run(dest)
+    if active in plan.prune:
+        plan.prune.remove(active)
+        plan.keep[active] = ["in progress"]
+
+    locations = run_locations(os.path.join(dest, META_DIR_NAME))
+    for run_id in plan.prune:
+        plan.files[run_id] = run_files(dest, run_id)
+        if run_id in locations:
+            plan.remote[run_id] = run_remote_objects(dest, run_id, locations[run_id])
+    plan.reclaim_bytes = reclaimable_bytes([path for paths in plan.files.values() for path in paths])
+    return plan
+
+
+def _delete(path: str):
+    """Delete a file or folder"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def apply_retention(
+    plan: RetentionPlan,
+    workers: int = 4,
+    access_key: str = "",
+    secret_key: str = ""
+) -> Dict[str, Any]:
+    """
+    Delete the runs a plan prunes, in parallel, and forget them in the catalog.
+
+    A run's archive is deleted before its manifests, so a run is never left with
+    metadata describing data that is half gone. Runs on another storage tier
+    lose their objects there first.
+
+    Args:
+        plan: Plan from plan_retention()
+        workers: Deletion threads
+        access_key: Access key ID for tiers on object stores; AWS_ACCESS_KEY_ID if empty
+        secret_key: Secret access key for tiers on object stores; AWS_SECRET_ACCESS_KEY if empty
+
+    Returns:
+        Statistics: runs pruned, bytes reclaimed, failures by path
+    """
+    start = time.monotonic()
+    # Measure before deleting; a run that fails part-way is not counted
+    sizes = {run_id: reclaimable_bytes(plan.files.get(run_id, [])) for run_id in plan.prune}
+    failures: Dict[str, str] = {}
+    pruned: List[str] = []
+
+    def prune_run(run_id: str):
+        if run_id in plan.remote:
+            location, keys = plan.remote[run_id]
+            target = describe(location)
+            try:
+                with open_backend(location, access_key, secret_key) as backend:
+                    for key in keys:
+                        target = f"{describe(location).rstrip('/')}/{key}"
+                        backend.delete(key)
+            except OSError as e:
+                failures[target] = str(e)
+                logger.error(f"Cannot delete {target}: {e}")
+                return
+        for path in plan.files.get(run_id, []):
+            try:
+                _delete(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                failures[path] = str(e)
+                logger.error(f"Cannot delete {path}: {e}")
+                return
+        pruned.append(run_id)
+
+    if plan.prune:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prune") as pool:
+            list(pool.map(prune_run, plan.prune))
+
+    meta_dir = os.path.join(plan.dest, META_DIR_NAME)
+    if pruned and os.path.exists(catalog_path(meta_dir)):
+        try:
+            with BackupCatalog(catalog_path(meta_dir)) as catalog:
+                for run_id in pruned:
+                    catalog.remove_run(run_id)
+        except sqlite3.Error as e:
+            log_exception(logger, f"Cannot update catalog after pruning: {e}")
+
+    reclaimed = plan.reclaim_bytes if not failures else sum(sizes[run_id] for run_id in pruned)
+    logger.info(f"Pruned {len(pruned)} runs from {plan.dest}, {len(failures)} failures")
+    return {
+        "runs_pruned": sorted(pruned),
+        "bytes_reclaimed": reclaimed,
+        "failures": failures,
+        "seconds": round(time.monotonic() - start, 3),
+    }
+
+
+def prune_destination(
+    dest: str,
+    policy: RetentionPolicy,
+    dry_run: bool = False,
+    workers: int = 4,
+    access_key: str = "",
+    secret_key: str = ""
+) -> Tuple[RetentionPlan, Dict[str, Any]]:
+    """
+    Plan retention for a destination and, unless dry_run, apply it.
+
+    Args:
+        dest: Job destination folder
+        policy: Retention policy
+        dry_run: Only plan; delete nothing
+        workers: Deletion threads
+        access_key: Access key ID for tiers on object stores
+        secret_key: Secret access key for tiers on object stores
+
+    Returns:
+        Tuple of (plan, statistics from apply_retention(), empty for a dry run)
+    """
+    plan = plan_retention(dest, policy)
+    if dry_run or not plan.prune:
+        return plan, {}
+    return plan, apply_retention(plan, workers, access_key, secret_key)
@@ -0,0 +1,165 @@
+"""
+Retry utilities for the RoboBackup native copy engine
+Provides error classification and a deferred retry queue with exponential backoff
+"""
+
+import errno
+import heapq
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Windows error codes (OSError.winerror) grouped by how the engine should react
+_WIN_LOCKED = {32, 33}                          # sharing / lock violation
+_WIN_NETWORK = {53, 59, 64, 67, 121, 1231}      # path not found on network, netname deleted, timeout
+_WIN_NO_SPACE = {39, 112}                       # handle disk full, disk full
+_WIN_NOT_FOUND = {2, 3}                         # file / path not found
+
+
+def _errnos(*names: str) -> set:
+    """Resolve errno names that exist on this platform"""
+    return {getattr(errno, name) for name in names if hasattr(errno, name)}
+
+
+_ERRNO_LOCKED = _errnos("EBUSY", "EAGAIN", "ETXTBSY")
+_ERRNO_NETWORK = _errnos(
+    "ETIMEDOUT", "ECONNRESET", "ECONNABORTED", "EHOSTUNREACH",
+    "ENETUNREACH", "ENETDOWN", "ESTALE"
+)
+_ERRNO_NO_SPACE = _errnos("ENOSPC", "EDQUOT")
+
+# Error classes that are worth retrying later
+TRANSIENT_ERROR_CLASSES = {"locked", "network", "io"}
+
+
+def classify_error(exc: BaseException) -> Tuple[str, bool]:
+    """
+    Classify an exception raised while copying a file.
+
+    Args:
+        exc: The exception raised by the copy operation
+
+    Returns:
+        Tuple of (error_class, transient) where error_class is one of
+        "locked", "network", "io", "permission", "not_found", "no_space" or "unknown"
+    """
+    winerror = getattr(exc, "winerror", None)
+    err = getattr(exc, "errno", None)
+
+    if winerror in _WIN_LOCKED or err in _ERRNO_LOCKED:
+        error_class = "locked"
+    elif winerror in _WIN_NETWORK or err in _ERRNO_NETWORK or isinstance(exc, (TimeoutError, ConnectionError)):
+        error_class = "network"
+    elif winerror in _WIN_NO_SPACE or err in _ERRNO_NO_SPACE:
+        error_class = "no_space"
+    elif winerror in _WIN_NOT_FOUND or isinstance(exc, FileNotFoundError):
+        error_class = "not_found"
+    elif isinstance(exc, PermissionError):
+        error_class = "permission"
+    elif isinstance(exc, OSError):
+        error_class = "io"
+    else:
+        error_class = "unknown"
+
+    return error_class, error_class in TRANSIENT_ERROR_CLASSES
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float, jitter: float = 0.5) -> float:
+    """
+    Compute an exponential backoff delay with jitter.
+
+    Args:
+        attempt: Retry attempt number (1 for the first retry)
+        base_delay: Delay in seconds before the first retry
+        max_delay: Upper bound for the delay in seconds
+        jitter: Fraction of the delay that is randomised (0 disables jitter)
+
+    Returns:
+        Delay in seconds
+    """
+    delay = min(max_delay, base_delay * (2 ** max(0, attempt - 1)))
+    if jitter > 0:
+        spread = delay * min(jitter, 1.0)
+        delay = delay - spread + random.uniform(0, spread)
+    return max(0.0, delay)
+
+
+@dataclass(order=True)
+class _RetryEntry:
+    due: float
+    seq: int
+    item: Any = field(compare=False)
+    attempt: int = field(compare=False, default=1)
+
+
+class RetryQueue:
+    """
+    Thread-safe queue of deferred work items ordered by the time they become due.
+
+    Items are parked here after a transient failure instead of sleeping inline,
+    so the worker that hit the failure can go back to the main queue immediately.
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0, jitter: float = 0.5):
+        """
+        Initialize retry queue
+
+        Args:
+            base_delay: Delay in seconds before the first retry
+            max_delay: Upper bound for a single backoff delay
+            jitter: Fraction of each delay that is randomised
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._heap: List[_RetryEntry] = []
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.total_scheduled = 0
+
+    def schedule(self, item: Any, attempt: int) -> float:
+        """
+        Park an item until its backoff delay has elapsed.
+
+        Args:
+            item: Work item to retry
+            attempt: Retry attempt number (1 for the first retry)
+
+        Returns:
+            The delay in seconds applied to this item
+        """
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay, self.jitter)
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._heap, _RetryEntry(time.monotonic() + delay, self._seq, item, attempt))
+            self.total_scheduled += 1
+        return delay
+
+    def pop_due(self) -> Optional[Tuple[Any, int]]:
+        """
+        Remove and return the next item whose delay has elapsed.
+
+        Returns:
+            Tuple of (item, attempt), or None if nothing is due yet
+        """
+        with self._lock:
+            if self._heap and self._heap[0].due <= time.monotonic():
+                entry = heapq.heappop(self._heap)
+                return entry.item, entry.attempt
+        return None
+
+    def time_until_next(self) -> Optional[float]:
+        """Seconds until the next item becomes due, or None if the queue is empty"""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0].due - time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._heap)
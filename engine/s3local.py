@@ -0,0 +1,217 @@
+"""
+In-process S3 stand-in for the RoboBackup native copy engine
+A small S3-compatible server holding objects in memory, for trying object-store jobs without a real service
+"""
+
+import hashlib
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+_XMLNS = 'xmlns="http://s3.amazonaws.com/doc/2006-03-01/"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Path-style S3 subset: objects, ranges, ListObjectsV2 and multipart uploads"""
+
+    protocol_version = "HTTP/1.1"
+    server: "LocalS3Server"
+
+    def log_message(self, format, *args):
+        logger.debug("s3local: " + format % args)
+
+    def _route(self) -> Tuple[str, str, Dict[str, str]]:
+        parts = urlsplit(self.path)
+        bucket, _, key = unquote(parts.path).lstrip("/").partition("/")
+        query = {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    def _send(self, status: int, body: bytes = b"", headers: Dict[str, str] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status: int, code: str):
+        self._send(status, f"<Error><Code>{code}</Code></Error>".encode("utf-8"),
+                   {"Content-Type": "application/xml"})
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _authorized(self) -> bool:
+        if self.server.require_auth and not self.headers.get("Authorization", "").startswith("AWS4-HMAC-SHA256"):
+            self._error(403, "AccessDenied")
+            return False
+        return True
+
+    def do_PUT(self):
+        bucket, key, query = self._route()
+        body = self._body()
+        if not self._authorized():
+            return
+        with self.server.lock:
+            if not key:
+                self.server.buckets.setdefault(bucket, {})
+                return self._send(200)
+            if bucket not in self.server.buckets:
+                return self._error(404, "NoSuchBucket")
+            if "uploadId" in query:
+                upload = self.server.uploads.get(query["uploadId"])
+                if upload is None:
+                    return self._error(404, "NoSuchUpload")
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                upload[int(query["partNumber"])] = (body, etag)
+                return self._send(200, headers={"ETag": etag})
+            self.server.buckets[bucket][key] = (body, datetime.now(timezone.utc))
+        self._send(200, headers={"ETag": '"' + hashlib.md5(body).hexdigest() + '"'})
+
+    def do_POST(self):
+        bucket, key, query = self._route()
+        body = self._body()
+        if not self._authorized():
+            return
+        with self.server.lock:
+            if bucket not in self.server.buckets:
+                return self._error(404, "NoSuchBucket")
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                self.server.uploads[upload_id] = {}
+                xml = (f"<InitiateMultipartUploadResult {_XMLNS}><Bucket>{escape(bucket)}</Bucket>"
+                       f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+                return self._send(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+            upload = self.server.uploads.pop(query.get("uploadId", ""), None)
+            if upload is None:
+                return self._error(404, "NoSuchUpload")
+            numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+            if numbers != sorted(upload) or any(len(upload[n][0]) < self.server.min_part_size for n in numbers[:-1]):
+                return self._error(400, "InvalidPart")
+            data = b"".join(upload[n][0] for n in numbers)
+            self.server.buckets[bucket][key] = (data, datetime.now(timezone.utc))
+        xml = f"<CompleteMultipartUploadResult {_XMLNS}><Key>{escape(key)}</Key></CompleteMultipartUploadResult>"
+        self._send(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def do_GET(self):
+        bucket, key, query = self._route()
+        if not self._authorized():
+            return
+        with self.server.lock:
+            objects = self.server.buckets.get(bucket)
+            if objects is None:
+                return self._error(404, "NoSuchBucket")
+            if not key:
+                return self._list(objects, query)
+            if key not in objects:
+                return self._error(404, "NoSuchKey")
+            data, modified = objects[key]
+        headers = {"Last-Modified": format_datetime(modified, usegmt=True)}
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            headers["Content-Range"] = f"bytes {start}-{min(end, len(data) - 1)}/{len(data)}"
+            return self._send(206, data[start:end + 1], headers)
+        self._send(200, data, headers)
+
+    def _list(self, objects: dict, query: Dict[str, str]):
+        prefix = query.get("prefix", "")
+        limit = int(query.get("max-keys", 1000))
+        after = query.get("continuation-token", "")
+        keys = sorted(k for k in objects if k.startswith(prefix) and k > after)
+        page, truncated = keys[:limit], len(keys) > limit
+        items = "".join(
+            f"<Contents><Key>{escape(k)}</Key><Size>{len(objects[k][0])}</Size>"
+            f"<LastModified>{objects[k][1].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified></Contents>"
+            for k in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        xml = (f"<ListBucketResult {_XMLNS}><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+               f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{items}</ListBucketResult>")
+        self._send(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def do_HEAD(self):
+        bucket, key, _ = self._route()
+        if not self._authorized():
+            return
+        with self.server.lock:
+            entry = self.server.buckets.get(bucket, {}).get(key)
+        if entry is None:
+            return self._send(404)
+        data, modified = entry
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Last-Modified", format_datetime(modified, usegmt=True))
+        self.end_headers()
+
+    def do_DELETE(self):
+        bucket, key, query = self._route()
+        if not self._authorized():
+            return
+        with self.server.lock:
+            if "uploadId" in query:
+                self.server.uploads.pop(query["uploadId"], None)
+            else:
+                self.server.buckets.get(bucket, {}).pop(key, None)
+        self._send(204)
+
+
+class LocalS3Server(ThreadingHTTPServer):
+    """
+    S3 stand-in on a local port, serving path-style requests from memory.
+
+    Signatures are not verified, only required to be present. Use it as a
+    context manager; endpoint is the URL to give S3Backend or an s3:// destination.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, buckets=("backups",), port: int = 0, require_auth: bool = True, min_part_size: int = 5 * 1024 * 1024):
+        """
+        Initialize the server on 127.0.0.1
+
+        Args:
+            buckets: Buckets to create
+            port: TCP port, 0 for any free port
+            require_auth: Reject requests without a Signature Version 4 header
+            min_part_size: Smallest multipart part accepted (except the last), as S3 enforces
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, Dict[str, Tuple[bytes, datetime]]] = {name: {} for name in buckets}
+        self.uploads: Dict[str, Dict[int, Tuple[bytes, str]]] = {}
+        self.require_auth = require_auth
+        self.min_part_size = min_part_size
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "LocalS3Server":
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="s3local", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,340 @@
+"""
+Integrity scrubbing for the RoboBackup native copy engine
+Re-reads stored data under an I/O throttle and checks it against the recorded hashes
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from typing import Any, Callable, Iterator, List, Optional
+from utils.logging_utils import get_logger
+from .manifest import load_latest_manifest
+from .columnar import path_id
+from .archive import ArchiveReader, archive_path, list_archives
+from .pipeline import iter_decoded_chunks
+from .native import META_DIR_NAME, load_mirror_format
+
+logger = get_logger(__name__)
+
+SCRUB_MODES = ("full", "sample")
+SCRUB_REPORT_NAME = "scrub.json"
+
+
+@dataclass
+class ScrubOptions:
+    """How much to verify per scrub and how fast"""
+    mode: str = "sample"  # full, sample
+    days: int = 7  # a sample covers all data once every this many days
+    max_mb_per_second: float = 0.0  # 0 = unthrottled
+    workers: int = 2
+    chunk_size: int = 1024 * 1024
+    encryption_key: Optional[bytes] = None
+
+    def validate(self) -> tuple[bool, str]:
+        """Validate scrub options"""
+        if self.mode not in SCRUB_MODES:
+            return False, f"Invalid scrub mode. Must be one of: {', '.join(SCRUB_MODES)}"
+        if self.days < 1:
+            return False, "Scrub rotation must be at least 1 day"
+        if self.max_mb_per_second < 0:
+            return False, "Scrub throttle cannot be negative"
+        if self.workers < 1:
+            return False, "Scrub workers must be at least 1"
+        return True, ""
+
+    @classmethod
+    def from_job_config(cls, job: Any, encryption_key: Optional[bytes] = None) -> "ScrubOptions":
+        """Build scrub options from a BackupJobConfig"""
+        return cls(
+            mode=job.engine_scrub_mode,
+            days=job.engine_scrub_days,
+            max_mb_per_second=job.engine_scrub_mb_per_second,
+            workers=job.engine_workers,
+            chunk_size=job.engine_chunk_size_kb * 1024,
+            encryption_key=encryption_key,
+        )
+
+
+class IOThrottle:
+    """Token bucket shared by all scrub threads; consume() sleeps until the bytes are allowed"""
+
+    def __init__(self, bytes_per_second: float, burst_seconds: float = 1.0):
+        """
+        Initialize throttle
+
+        Args:
+            bytes_per_second: Sustained rate; 0 disables throttling
+            burst_seconds: Seconds of traffic that may be consumed at once after idling
+        """
+        self.rate = bytes_per_second
+        self.capacity = bytes_per_second * burst_seconds
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, count: int):
+        """Account for count bytes, waiting if the rate is exceeded"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+@dataclass
+class ScrubObject:
+    """One stored object with a recorded hash"""
+    kind: str  # mirror, archive
+    run_id: str
+    path: str  # relative to the backup root
+    size: int
+    mtime_ns: int = 0
+    digest: str = ""
+    error: str = ""  # set when the object could not even be listed, e.g. a damaged archive index
+
+
+@dataclass
+class ScrubFinding:
+    """A stored object that failed verification"""
+    kind: str
+    run_id: str
+    path: str
+    problem: str  # corrupt, missing, unreadable
+    message: str
+
+
+@dataclass
+class ScrubReport:
+    """Outcome of one scrub"""
+    dest: str
+    mode: str
+    rotation_day: int = 0
+    objects_total: int = 0
+    objects_checked: int = 0
+    objects_changed: int = 0  # rewritten since the hash was recorded, not verifiable
+    bytes_read: int = 0
+    findings: List[ScrubFinding] = field(default_factory=list)
+    started: str = ""
+    duration_seconds: float = 0.0
+
+    @property
+    def clean(self) -> bool:
+        return not self.findings
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["duration_seconds"] = round(self.duration_seconds, 3)
+        return data
+
+
+def in_rotation(obj: ScrubObject, days: int, day: int) -> bool:
+    """True if obj is verified on the given day of a rotation of days days"""
+    return path_id(f"{obj.run_id}/{obj.path}") % days == day % days
+
+
+def scrub_report_path(meta_dir: str) -> str:
+    """File holding the latest scrub report of a destination"""
+    return os.path.join(meta_dir, SCRUB_REPORT_NAME)
+
+
+def iter_objects(dest: str) -> Iterator[ScrubObject]:
+    """
+    Stored objects of a destination that have a recorded hash: every member of
+    every archive, and every hashed file of the latest mirror manifest.
+    """
+    for run_id in list_archives(dest):
+        try:
+            with ArchiveReader(archive_path(dest, run_id)) as reader:
+                members = list(reader.members.values())
+        except (OSError, ValueError) as e:
+            # The archive index is an object too; without it no member can be checked
+            yield ScrubObject("archive", run_id, "", 0, error=str(e))
+            continue
+        for member in members:
+            yield ScrubObject("archive", run_id, member.path, member.size, member.mtime_ns, member.sha256)
+
+    manifest = load_latest_manifest(os.path.join(dest, META_DIR_NAME))
+    if manifest is not None:
+        for entry in manifest:
+            if entry.hash:
+                yield ScrubObject("mirror", manifest.run_id, entry.path, entry.size, entry.mtime_ns, entry.hash)
+
+
+class Scrubber:
+    """Verifies the objects of one destination against their recorded hashes"""
+
+    def __init__(
+        self,
+        dest: str,
+        options: Optional[ScrubOptions] = None,
+        progress_callback: Optional[Callable[[ScrubObject, Optional[ScrubFinding]], None]] = None
+    ):
+        """
+        Initialize scrubber
+
+        Args:
+            dest: Job destination folder
+            options: Scrub options (defaults are used if None)
+            progress_callback: Optional callable receiving each checked object and its finding, if any
+        """
+        self.dest = dest
+        self.options = options or ScrubOptions()
+        self.progress_callback = progress_callback
+        self.throttle = IOThrottle(self.options.max_mb_per_second * 1024 * 1024)
+        self._readers: dict = {}
+        self._lock = threading.Lock()
+        self._report: Optional[ScrubReport] = None
+        self._stages: Optional[tuple] = None  # chunk transforms of the mirror files, read once per run
+
+    def _reader(self, run_id: str) -> ArchiveReader:
+        with self._lock:
+            reader = self._readers.get(run_id)
+            if reader is None:
+                reader = self._readers[run_id] = ArchiveReader(archive_path(self.dest, run_id))
+            return reader
+
+    def _read_archive(self, obj: ScrubObject) -> int:
+        """Stream one archive member; the reader verifies its checksum"""
+        reader = self._reader(obj.run_id)
+        member = reader.members[obj.path]
+        # Throttle on bytes read from disk, which differ from the decompressed bytes yielded
+        ratio = member.length / member.size if member.size else 1.0
+        for chunk in reader.iter_member(member, self.options.chunk_size):
+            self.throttle.consume(int(len(chunk) * ratio))
+        return member.length
+
+    def _read_mirror(self, obj: ScrubObject) -> Optional[int]:
+        """Hash one mirror file; returns None if it changed since it was recorded"""
+        path = os.path.join(self.dest, *obj.path.split("/"))
+        st = os.stat(path)
+        if st.st_mtime_ns != obj.mtime_ns:
+            return None
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            if self._stages:
+                chunks = iter_decoded_chunks(f, self.options.encryption_key, self._stages)
+            else:
+                if st.st_size != obj.size:
+                    raise ValueError(f"Size {st.st_size} differs from recorded {obj.size}")
+                chunks = iter(lambda: f.read(self.options.chunk_size), b"")
+            for chunk in chunks:
+                self.throttle.consume(len(chunk))
+                digest.update(chunk)
+        if digest.hexdigest() != obj.digest:
+            raise ValueError("Checksum mismatch")
+        return st.st_size
+
+    def _check(self, obj: ScrubObject):
+        """Verify one object and record the outcome"""
+        finding = None
+        read = 0
+        try:
+            if obj.error:
+                raise ValueError(obj.error)
+            if obj.kind == "archive":
+                read = self._read_archive(obj)
+            else:
+                read = self._read_mirror(obj)
+        except FileNotFoundError as e:
+            finding = ScrubFinding(obj.kind, obj.run_id, obj.path, "missing", str(e))
+        except OSError as e:
+            finding = ScrubFinding(obj.kind, obj.run_id, obj.path, "unreadable", str(e))
+        except Exception as e:
+            # Checksum mismatches, and whatever decompression or decryption makes of damaged bytes
+            finding = ScrubFinding(obj.kind, obj.run_id, obj.path, "corrupt", str(e))
+
+        with self._lock:
+            report = self._report
+            if read is None:
+                report.objects_changed += 1
+            else:
+                report.objects_checked += 1
+                report.bytes_read += read
+            if finding is not None:
+                report.findings.append(finding)
+                logger.error(f"Scrub: {finding.problem} {obj.kind} object {obj.run_id}/{obj.path}: {finding.message}")
+        if self.progress_callback:
+            self.progress_callback(obj, finding)
+
+    def run(self, day: Optional[int] = None) -> ScrubReport:
+        """
+        Verify all objects (full mode) or today's share of them (sample mode).
+
+        Args:
+            day: Rotation day to use instead of today's, e.g. to repeat a sample
+
+        Returns:
+            ScrubReport, which is also saved in the destination's metadata folder
+
+        Raises:
+            ValueError: If the destination's format record is unreadable
+        """
+        start = time.monotonic()
+        # Mirror files are decoded only if the destination records transforms for them
+        self._stages = load_mirror_format(os.path.join(self.dest, META_DIR_NAME)) or ()
+        day = date.today().toordinal() if day is None else day
+        report = self._report = ScrubReport(self.dest, self.options.mode, day % self.options.days)
+        report.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+        def selected() -> Iterator[ScrubObject]:
+            for obj in iter_objects(self.dest):
+                report.objects_total += 1
+                if self.options.mode == "full" or in_rotation(obj, self.options.days, day):
+                    yield obj
+
+        # Bounded submission keeps memory flat however many objects the destination holds
+        window = threading.BoundedSemaphore(self.options.workers * 4)
+
+        def check(obj: ScrubObject):
+            try:
+                self._check(obj)
+            finally:
+                window.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.options.workers, thread_name_prefix="scrub") as pool:
+                for obj in selected():
+                    window.acquire()
+                    pool.submit(check, obj)
+        finally:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+        report.findings.sort(key=lambda f: (f.kind, f.run_id, f.path))
+        report.duration_seconds = time.monotonic() - start
+        self._save(report)
+        logger.info(f"Scrub of {self.dest}: {report.objects_checked} objects, {report.bytes_read} bytes, "
+                    f"{len(report.findings)} problems")
+        return report
+
+    def _save(self, report: ScrubReport):
+        """Keep the report next to the backup so repair tools can find the damaged objects"""
+        path = scrub_report_path(os.path.join(self.dest, META_DIR_NAME))
+        tmp = path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(report.to_dict(), f, indent=2)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Cannot save scrub report {path}: {e}")
+
+
+def load_scrub_report(dest: str) -> Optional[dict]:
+    """The latest saved scrub report of a destination, or None"""
+    try:
+        with open(scrub_report_path(os.path.join(dest, META_DIR_NAME)), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,555 @@
+"""
+Shared source runs for the RoboBackup native copy engine
+Jobs with overlapping sources are scanned and read once, each file fanned out to every job that needs it
+"""
+
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+from utils.logging_utils import get_logger, log_exception
+from .retry import RetryQueue, classify_error
+from .pipeline import CopyPipeline, CopyUnit
+from .iohints import open_for_sequential_read
+from .native import (
+    EngineEvent, EngineOptions, FailedFile, FileEntry, FileTable, NativeCopyEngine, RunResult,
+    _matches_any, is_excluded_dir, scan_table
+)
+from .retention import RetentionPolicy
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class SharedJob:
+    """One job taking part in overlap detection"""
+    name: str
+    source: str
+    dest: str
+    options: EngineOptions = field(default_factory=EngineOptions)
+    retention: Optional[RetentionPolicy] = None  # applied after a successful run
+
+
+def _norm(path: str) -> str:
+    """Resolved (symlinks and junctions followed), case-normalized path without a trailing separator"""
+    return os.path.normcase(os.path.realpath(path)).rstrip("\\/") or os.sep
+
+
+def _contains(outer: str, inner: str) -> bool:
+    """True if inner is outer or lies below it (both normalized)"""
+    return inner == outer or inner.startswith(outer.rstrip("\\/") + os.sep)
+
+
+def _job_callback(
+    progress_callback: Optional[Callable[[str, EngineEvent], None]], name: str
+) -> Optional[Callable[[EngineEvent], None]]:
+    """Adapt a (job name, event) callback to a single engine"""
+    if progress_callback is None:
+        return None
+    return lambda event: progress_callback(name, event)
+
+
+def _shared_key(options: EngineOptions) -> tuple:
+    """
+    Options that must match for jobs to share a run.
+
+    A shared run writes one output stream to every job and reads with a single
+    pipeline and retry policy, so jobs must agree on both.
+    """
+    return (
+        tuple(options.transforms), options.encryption_key,
+        options.workers, options.writers, options.chunk_size, options.buffer_count, options.queue_depth,
+        options.cpu_workers, options.cpu_executor, options.io_hints,
+        options.retry_attempts, options.retry_base_delay, options.retry_max_delay, options.retry_jitter,
+    )
+
+
+def find_overlaps(jobs: List[SharedJob]) -> List[List[SharedJob]]:
+    """
+    Group jobs whose source trees overlap.
+
+    A job joins a group when its resolved source is the group's root or lies
+    inside it, e.g. D:\\Data and D:\\Data\\Finance; a source reached through a
+    link is placed where the link points. Jobs that transform their output
+    differently never share a group, since they cannot share written chunks,
+    nor do jobs with different read settings (workers, chunk size, retry
+    policy, I/O hints), since the group is read with one pipeline.
+
+    Args:
+        jobs: Jobs that are due together
+
+    Returns:
+        Groups of jobs, outermost source first; a job without overlap is a group of one
+    """
+    groups: List[List[SharedJob]] = []
+    roots: List[Tuple[str, tuple]] = []
+    for job in sorted(jobs, key=lambda j: len(_norm(j.source))):
+        source, key = _norm(job.source), _shared_key(job.options)
+        for index, (root, root_key) in enumerate(roots):
+            if root_key == key and _contains(root, source):
+                groups[index].append(job)
+                break
+        else:
+            roots.append((source, key))
+            groups.append([job])
+    return groups
+
+
+def _shared_excludes(jobs: List[SharedJob]) -> Tuple[List[str], List[str]]:
+    """
+    Exclusions safe to apply to the shared scan: patterns every job has.
+
+    Folder patterns are only shared when they match by name, since relative
+    path patterns mean different things under different roots.
+    """
+    folder_sets = [
+        {p for p in job.options.exclude_folders if "/" not in p and "\\" not in p} for job in jobs
+    ]
+    file_sets = [set(job.options.exclude_files) for job in jobs]
+    return sorted(set.intersection(*folder_sets)), sorted(set.intersection(*file_sets))
+
+
+def slice_scan(
+    table: FileTable,
+    directories: List[FileEntry],
+    prefix: str,
+    exclude_folders: List[str],
+    exclude_files: List[str]
+) -> Tuple[FileTable, List[FileEntry]]:
+    """
+    Cut the part of a scan below prefix out as if it had been scanned on its own.
+
+    Args:
+        table: Scan of the outer root
+        directories: Directory entries of that scan
+        prefix: '/'-separated path of the inner root relative to the outer root ('' for the root)
+        exclude_folders: Inner job's folder exclusions (/XD)
+        exclude_files: Inner job's file exclusions (/XF)
+
+    Returns:
+        (FileTable, directory entries) with paths relative to the inner root
+    """
+    prefix_key = os.path.normcase(prefix)
+    rel_dirs: Dict[str, str] = {}  # outer directory path -> path relative to the inner root
+    sub_dirs: List[FileEntry] = []
+    if not prefix:
+        rel_dirs[""] = ""
+    # Directories come parent first, so a parent's verdict is known before its children
+    for directory in directories:
+        outer = directory.rel_path
+        parent, _, name = outer.rpartition("/")
+        if os.path.normcase(outer) == prefix_key:
+            rel_dirs[outer] = ""
+            continue
+        parent_rel = rel_dirs.get(parent)
+        if parent_rel is None:
+            continue
+        rel = f"{parent_rel}/{name}" if parent_rel else name
+        if is_excluded_dir(rel, name, exclude_folders):
+            continue
+        rel_dirs[outer] = rel
+        sub_dirs.append(FileEntry(rel, 0, directory.mtime_ns, directory.mode, directory.atime_ns))
+
+    sub = FileTable()
+    store = table.paths
+    for outer, rel in rel_dirs.items():
+        dir_id = store.find_dir(outer)
+        if dir_id is None:
+            continue
+        sub_dir_id = sub.paths.intern_dir(rel)
+        for file_id in store.files_in(dir_id):
+            name = store.name(file_id)
+            if not _matches_any(name, exclude_files):
+                sub.append(sub_dir_id, name, *table.fields(file_id))
+    return sub, sub_dirs
+
+
+class _TeeOutput:
+    """
+    Writes every chunk to the partial outputs of several targets.
+
+    An output that fails is reported to on_error and dropped, so the other
+    targets keep going; only when none is left does the error propagate.
+    """
+
+    def __init__(self, outputs: List[Tuple[int, BinaryIO]], on_error: Callable[[int, OSError], None]):
+        """
+        Initialize tee output
+
+        Args:
+            outputs: (target index, open output) pairs
+            on_error: Called with the target index and error of an output that failed
+        """
+        self._outputs = outputs
+        self._on_error = on_error
+
+    def _each(self, action: Callable[[BinaryIO], Any]):
+        """Apply an action to every output, dropping the ones that fail"""
+        error = None
+        for index, output in list(self._outputs):
+            try:
+                action(output)
+            except OSError as e:
+                error = e
+                self._outputs.remove((index, output))
+                self._on_error(index, e)
+        if not self._outputs and error is not None:
+            raise error
+
+    def write(self, data) -> int:
+        """Write a chunk to every output"""
+        self._each(lambda output: output.write(data))
+        return len(data)
+
+    def flush(self):
+        """Flush every output"""
+        self._each(lambda output: output.flush())
+
+    def fileno(self) -> int:
+        """Descriptor of the first output, used for page-cache hints"""
+        return self._outputs[0][1].fileno()
+
+    def close(self):
+        """Close every output"""
+        for _, output in self._outputs:
+            output.close()
+
+
+@dataclass
+class _Route:
+    """A file read once from the shared root and the targets it is copied to"""
+    entry: FileEntry  # path relative to the shared root
+    targets: List[Tuple[NativeCopyEngine, FileEntry]]  # target engine, entry relative to its source
+
+
+class SharedSourceRun:
+    """
+    Runs a group of overlapping jobs with one scan and one read per file.
+
+    The outermost source is scanned once; each job's engine plans against its
+    slice of that scan. A single pipeline then reads every file that at least
+    one job needs, and its writer fans the chunks out to each job's partial
+    output. Each engine still journals, retries, purges, applies metadata and
+    writes its manifest as in a standalone run.
+    """
+
+    def __init__(
+        self,
+        jobs: List[SharedJob],
+        progress_callback: Optional[Callable[[str, EngineEvent], None]] = None
+    ):
+        """
+        Initialize shared source run
+
+        Args:
+            jobs: One group returned by find_overlaps(), outermost source first
+            progress_callback: Optional callable receiving (job name, EngineEvent)
+
+        Raises:
+            ValueError: If there are no jobs, or their shared-read options differ
+        """
+        if not jobs:
+            raise ValueError("A shared run needs at least one job")
+        if len({_shared_key(job.options) for job in jobs}) > 1:
+            raise ValueError("Jobs of a shared run must have the same transforms and read settings")
+        self.jobs = jobs
+        self.root = jobs[0].source
+        self.options = jobs[0].options
+        self.engines: Dict[str, NativeCopyEngine] = {}
+        for job in jobs:
+            self.engines[job.name] = NativeCopyEngine(
+                job.source, job.dest, job.options, _job_callback(progress_callback, job.name)
+            )
+
+        self._queue: "queue.Queue[_Route]" = queue.Queue()
+        self._retry_queue = RetryQueue(
+            self.options.retry_base_delay, self.options.retry_max_delay, self.options.retry_jitter
+        )
+        self._retry_attempts = self.options.retry_attempts
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._pending = 0
+        self._seq = 0
+        self._routes: Dict[int, _Route] = {}
+        self._subunits: Dict[int, List[Tuple[NativeCopyEngine, CopyUnit]]] = {}
+        self._prepared: List[str] = []
+        self._standalone: List[str] = []  # jobs whose root is missing from the shared scan
+        self.stats: Dict[str, Any] = {}
+
+    def cancel(self):
+        """Stop all jobs after their current files"""
+        self._cancel.set()
+        for engine in self.engines.values():
+            engine.cancel()
+
+    def _transforms(self) -> List[str]:
+        """Pipeline transforms of the group; files are hashed if any job needs hashes"""
+        transforms = list(self.options.transforms)
+        if "hash" not in transforms and any("hash" in e.pipeline_transforms for e in self.engines.values()):
+            transforms.insert(0, "hash")
+        return transforms
+
+    def _prefix(self, job: SharedJob) -> str:
+        """Path of a job's source relative to the shared root"""
+        rel = os.path.relpath(os.path.realpath(job.source), os.path.realpath(self.root))
+        return "" if rel == "." else rel.replace(os.sep, "/")
+
+    def _plan(self) -> List[_Route]:
+        """Scan once, let every engine plan its slice and merge the plans by source file"""
+        exclude_folders, exclude_files = _shared_excludes(self.jobs)
+        directories: List[FileEntry] = []
+        table = scan_table(self.root, exclude_folders, exclude_files, directories)
+        self.stats["scanned_files"] = len(table)
+
+        scanned_dirs = {os.path.normcase(directory.rel_path) for directory in directories}
+        routes: Dict[str, _Route] = {}
+        scan_entries = 0
+        for job in self.jobs:
+            engine = self.engines[job.name]
+            prefix = self._prefix(job)
+            if prefix and os.path.normcase(prefix) not in scanned_dirs:
+                # Excluded from the shared scan or not a plain folder: an empty slice would purge its destination
+                logger.warning(f"Source of {job.name} is not part of the scan of {self.root}; running it on its own")
+                self._standalone.append(job.name)
+                continue
+            sub, sub_dirs = slice_scan(
+                table, directories, prefix, job.options.exclude_folders, job.options.exclude_files
+            )
+            scan_entries += len(sub)
+            engine.use_scan(sub, sub_dirs)
+            planned = engine.prepare(defer_duplicates=False)
+            if planned is None:
+                continue
+            self._prepared.append(job.name)
+            for entry in planned:
+                outer = f"{prefix}/{entry.rel_path}" if prefix else entry.rel_path
+                route = routes.get(outer)
+                if route is None:
+                    route = routes[outer] = _Route(FileEntry(outer, entry.size, entry.mtime_ns, entry.mode), [])
+                route.targets.append((engine, entry))
+        self.stats["scan_entries_saved"] = max(0, scan_entries - len(table))
+        return list(routes.values())
+
+    def run(self) -> Dict[str, RunResult]:
+        """
+        Execute every job of the group.
+
+        Returns:
+            RunResult per job name; each result's stats carry the shared run's I/O savings
+        """
+        routes = self._plan()
+        self._pending = len(routes)
+        for route in routes:
+            self._queue.put(route)
+
+        pipeline_stats: Dict[str, Any] = {}
+        if routes:
+            pipeline = CopyPipeline(
+                self,
+                readers=min(self.options.workers, len(routes)),
+                writers=self.options.writers,
+                transforms=self._transforms(),
+                cpu_workers=self.options.cpu_workers,
+                cpu_executor=self.options.cpu_executor,
+                queue_depth=self.options.queue_depth,
+                chunk_size=self.options.chunk_size,
+                encryption_key=self.options.encryption_key,
+                buffer_count=self.options.buffer_count,
+                io_hints=self.options.io_hints
+            )
+            pipeline_stats = pipeline.run()
+
+        self.stats.setdefault("read_bytes_saved", 0)
+        self.stats.setdefault("files_shared", 0)
+        self.stats["jobs"] = [job.name for job in self.jobs]
+        logger.info(f"Shared run of {len(self.jobs)} jobs from {self.root}: "
+                    f"{self.stats['scan_entries_saved']} scan entries and "
+                    f"{self.stats['read_bytes_saved']} read bytes saved")
+
+        results = {}
+        for job in self.jobs:
+            engine = self.engines[job.name]
+            if job.name in self._prepared:
+                result = engine.finish(pipeline_stats)
+            elif job.name in self._standalone:
+                result = engine.run()
+            else:
+                result = engine.result
+            result.stats["shared_run"] = dict(self.stats)
+            results[job.name] = result
+        return results
+
+    # Pipeline handler
+
+    def backlog(self) -> int:
+        """Files waiting in the main and retry queues"""
+        return self._queue.qsize() + len(self._retry_queue)
+
+    def next_unit(self) -> Optional[CopyUnit]:
+        """Hand the next source file to a reader, waiting for retries that are not due yet"""
+        while not self._cancel.is_set():
+            item = self._retry_queue.pop_due()
+            if item is None:
+                try:
+                    item = self._queue.get_nowait(), 0
+                except queue.Empty:
+                    item = None
+            if item is not None:
+                route, attempt = item
+                with self._lock:
+                    self._seq += 1
+                    unit = CopyUnit(route.entry, attempt, self._seq)
+                    self._routes[unit.seq] = route
+                    self._subunits[unit.seq] = [
+                        (engine, engine.start_unit(entry, attempt)) for engine, entry in route.targets
+                    ]
+                return unit
+            with self._lock:
+                if self._pending <= 0:
+                    return None
+            wait = self._retry_queue.time_until_next()
+            self._cancel.wait(min(wait if wait is not None else 0.05, 0.25))
+        return None
+
+    def open_source(self, unit: CopyUnit) -> BinaryIO:
+        """Open the file under the shared root"""
+        path = os.path.join(self.root, *unit.entry.rel_path.split("/"))
+        if self.options.io_hints:
+            return open_for_sequential_read(path)
+        return open(path, "rb", buffering=0)
+
+    def _target_failed(self, unit: CopyUnit, index: int, error: OSError):
+        """
+        Drop one target of a file after an error at its destination.
+
+        Its partial output is discarded and the error kept in unit.state, so
+        unit_done() reports it to that job alone.
+        """
+        engine, sub = self._subunits[unit.seq][index]
+        unit.state[index] = error
+        engine.abort_output(sub)
+
+    def open_output(self, unit: CopyUnit) -> BinaryIO:
+        """Open the partial output of every target and write to all of them"""
+        unit.state = {}  # target index -> error at that target's destination
+        outputs = []
+        error = None
+        try:
+            for index, (engine, sub) in enumerate(self._subunits[unit.seq]):
+                try:
+                    sub.output = engine.open_output(sub)
+                except OSError as e:
+                    error = e
+                    unit.state[index] = e
+                    continue
+                outputs.append((index, sub.output))
+        except BaseException:
+            for _, output in outputs:
+                output.close()
+            raise
+        if not outputs:
+            raise error
+        return _TeeOutput(outputs, lambda index, e: self._target_failed(unit, index, e))
+
+    def finish_output(self, unit: CopyUnit):
+        """Rename every target's output into place; a target that fails does not stop the others"""
+        error = None
+        finished = 0
+        for index, (engine, sub) in enumerate(self._subunits[unit.seq]):
+            if index in unit.state:
+                continue
+            sub.bytes_written = unit.bytes_written
+            try:
+                engine.finish_output(sub)
+                finished += 1
+            except OSError as e:
+                error = e
+                self._target_failed(unit, index, e)
+        if not finished and error is not None:
+            raise error
+
+    def abort_output(self, unit: CopyUnit):
+        """Discard every target's partial output"""
+        for engine, sub in self._subunits.get(unit.seq, []):
+            engine.abort_output(sub)
+
+    def _target_done(self, route: _Route, unit: CopyUnit, engine: NativeCopyEngine, sub: CopyUnit, error: OSError):
+        """Retry or fail one target whose destination failed while the others completed"""
+        error_class, transient = classify_error(error)
+        if transient and unit.attempt < self._retry_attempts:
+            self._retry_queue.schedule(_Route(route.entry, [(engine, sub.entry)]), unit.attempt + 1)
+            with self._lock:
+                self._pending += 1
+            engine.record_retry(sub.entry, error_class, error)
+        else:
+            engine.record_failure(sub.entry, error, unit.attempt + 1)
+
+    def unit_done(self, unit: CopyUnit, error: Optional[BaseException]):
+        """Report a finished file to every target, deferring transient failures"""
+        with self._lock:
+            route = self._routes.pop(unit.seq)
+            subunits = self._subunits.pop(unit.seq)
+
+        if error is not None:
+            error_class, transient = classify_error(error)
+            if transient and unit.attempt < self._retry_attempts:
+                delay = self._retry_queue.schedule(route, unit.attempt + 1)
+                logger.debug(f"Deferring {route.entry.rel_path} ({error_class}) for {delay:.1f}s: {error}")
+                for engine, sub in subunits:
+                    engine.record_retry(sub.entry, error_class, error)
+                return
+            for engine, sub in subunits:
+                engine.record_failure(sub.entry, error, unit.attempt + 1)
+        else:
+            failed = unit.state or {}
+            for index, (engine, sub) in enumerate(subunits):
+                if index in failed:
+                    self._target_done(route, unit, engine, sub, failed[index])
+                    continue
+                sub.bytes_read = unit.bytes_read
+                sub.bytes_written = unit.bytes_written
+                sub.digest = unit.digest
+                engine.unit_done(sub, None)
+            subunits = [target for index, target in enumerate(subunits) if index not in failed]
+            with self._lock:
+                if len(subunits) > 1:
+                    self.stats["files_shared"] = self.stats.get("files_shared", 0) + 1
+                    self.stats["read_bytes_saved"] = (
+                        self.stats.get("read_bytes_saved", 0) + unit.bytes_read * (len(subunits) - 1)
+                    )
+        with self._lock:
+            self._pending -= 1
+
+
+def run_shared_jobs(
+    jobs: List[SharedJob],
+    progress_callback: Optional[Callable[[str, EngineEvent], None]] = None
+) -> Dict[str, RunResult]:
+    """
+    Run jobs that are due together, sharing scans and reads where sources overlap.
+
+    Args:
+        jobs: Jobs to run
+        progress_callback: Optional callable receiving (job name, EngineEvent)
+
+    Returns:
+        RunResult per job name
+    """
+    results: Dict[str, RunResult] = {}
+    for group in find_overlaps(jobs):
+        try:
+            if len(group) == 1:
+                job = group[0]
+                engine = NativeCopyEngine(job.source, job.dest, job.options, _job_callback(progress_callback, job.name))
+                results[job.name] = engine.run()
+            else:
+                logger.info(f"Jobs {', '.join(j.name for j in group)} overlap below {group[0].source}")
+                results.update(SharedSourceRun(group, progress_callback).run())
+        except Exception as e:
+            log_exception(logger, f"Run of {', '.join(j.name for j in group)} failed")
+            for job in group:
+                result = results.setdefault(job.name, RunResult())
+                if not result.success and not result.failures:
+                    result.failures.append(FailedFile("", "unknown", str(e), 0))
+    return results
@@ -0,0 +1,177 @@
+"""
+Single-instance store for the RoboBackup native copy engine
+Index of content hashes to destination files, so identical files are linked instead of copied
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+SIS_VERSION = 2
+SIS_INDEX_NAME = "sis.json.gz"
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content, matching the pipeline's hash transform"""
+    digest = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+class SingleInstanceIndex:
+    """
+    Map of content hash to one destination file holding that content.
+
+    Entries are hints: a lookup checks that the file still exists with the
+    recorded size and modification time before it is linked, and rewriting a
+    path drops the hash it used to hold.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize single-instance index
+
+        Args:
+            path: Index file, normally inside the destination's metadata folder
+        """
+        self.path = path
+        self._by_hash: Dict[str, Tuple[str, int, int, int]] = {}  # hash -> (rel_path, source size, stored size, mtime_ns)
+        self._by_path: Dict[str, str] = {}  # rel_path -> hash
+        self._sizes: Dict[int, int] = {}  # source size -> number of entries
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_hash)
+
+    def has_size(self, size: int) -> bool:
+        """True if some indexed content has this size; a cheap filter before hashing"""
+        return size in self._sizes
+
+    def _drop(self, digest: str):
+        """Remove one hash; the caller holds the lock"""
+        rel_path, size, _, _ = self._by_hash.pop(digest)
+        self._by_path.pop(rel_path, None)
+        self._sizes[size] -= 1
+        if not self._sizes[size]:
+            del self._sizes[size]
+
+    def add(self, digest: str, rel_path: str, size: int, stored_size: int, mtime_ns: int):
+        """
+        Record that a destination file holds some content.
+
+        Args:
+            digest: Content hash of the source file
+            rel_path: Destination path relative to the destination root
+            size: Source size in bytes
+            stored_size: Size of the destination file (differs from size for transformed outputs)
+            mtime_ns: Modification time the destination file is given
+        """
+        with self._lock:
+            previous = self._by_path.get(rel_path)
+            if previous is not None and previous in self._by_hash:
+                self._drop(previous)
+            if digest in self._by_hash:
+                return
+            self._by_hash[digest] = (rel_path, size, stored_size, mtime_ns)
+            self._by_path[rel_path] = digest
+            self._sizes[size] = self._sizes.get(size, 0) + 1
+
+    def forget(self, rel_path: str):
+        """Drop the entry stored at a path, if any"""
+        with self._lock:
+            digest = self._by_path.get(rel_path)
+            if digest is not None and digest in self._by_hash:
+                self._drop(digest)
+
+    def digests(self) -> List[str]:
+        """Snapshot of the indexed content hashes"""
+        with self._lock:
+            return list(self._by_hash)
+
+    def prune(self, is_live: Callable[[str], bool]) -> int:
+        """
+        Drop entries whose content no snapshot references any more.
+
+        Args:
+            is_live: Callable returning False only for digests that are certainly dead
+
+        Returns:
+            Number of entries dropped
+        """
+        with self._lock:
+            dead = [digest for digest in self._by_hash if not is_live(digest)]
+            for digest in dead:
+                self._drop(digest)
+        return len(dead)
+
+    def lookup(self, digest: str, dest_root: str, tolerance_ns: int = 0) -> Optional[str]:
+        """
+        Find a destination file with the given content.
+
+        A file whose size or modification time no longer matches the entry was
+        rewritten without the index knowing, so its entry is dropped.
+
+        Args:
+            digest: Content hash
+            dest_root: Destination root the stored paths are relative to
+            tolerance_ns: Allowed difference from the recorded modification time
+
+        Returns:
+            Relative path of a file that can be linked, or None
+        """
+        with self._lock:
+            entry = self._by_hash.get(digest)
+        if entry is None:
+            return None
+        rel_path, _, stored_size, mtime_ns = entry
+        try:
+            st = os.stat(os.path.join(dest_root, *rel_path.split("/")))
+            if st.st_size == stored_size and abs(st.st_mtime_ns - mtime_ns) <= tolerance_ns:
+                return rel_path
+        except OSError:
+            pass
+        with self._lock:
+            if digest in self._by_hash:
+                self._drop(digest)
+        return None
+
+    def save(self):
+        """Write the index atomically as gzip-compressed JSON"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with self._lock:
+            rows = [[digest, *entry] for digest, entry in self._by_hash.items()]
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"version": SIS_VERSION, "entries": rows}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def load(cls, path: str) -> "SingleInstanceIndex":
+        """Read an index written by save(); a missing or unreadable file gives an empty index"""
+        index = cls(path)
+        if not os.path.exists(path):
+            return index
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != SIS_VERSION:
+                raise ValueError("unsupported version")
+            for digest, rel_path, size, stored_size, mtime_ns in data["entries"]:
+                index.add(digest, rel_path, size, stored_size, mtime_ns)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable single-instance index {path}: {e}")
+            return cls(path)
+        return index
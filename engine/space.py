@@ -0,0 +1,106 @@
+"""
+Destination space utilities for the RoboBackup native copy engine
+Provides free-space admission control and file preallocation
+"""
+
+import errno
+import os
+import shutil
+import sys
+from typing import Tuple
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Errors that mean "this filesystem cannot preallocate", not "out of space"
+_FALLOCATE_UNSUPPORTED = {
+    getattr(errno, name) for name in ("EOPNOTSUPP", "ENOTSUP", "EINVAL", "ENOSYS") if hasattr(errno, name)
+}
+
+
+def _existing_ancestor(path: str) -> str:
+    """Return path or its nearest existing parent, so disk usage can be queried before it is created"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def get_free_space(path: str) -> int:
+    """
+    Get the number of bytes available to the current user on the volume holding path.
+
+    Args:
+        path: Destination path (does not need to exist yet)
+
+    Returns:
+        Free bytes
+    """
+    return shutil.disk_usage(_existing_ancestor(path)).free
+
+
+def check_free_space(path: str, planned_bytes: int, reserve_bytes: int = 0) -> Tuple[bool, int, str]:
+    """
+    Check that the destination volume can hold the planned bytes plus a reserve.
+
+    Args:
+        path: Destination path
+        planned_bytes: Bytes the run intends to write
+        reserve_bytes: Bytes that must remain free after the run
+
+    Returns:
+        Tuple of (enough_space, free_bytes, message)
+    """
+    try:
+        free = get_free_space(path)
+    except OSError as e:
+        logger.warning(f"Cannot query free space for {path}: {e}")
+        return True, -1, f"Free space unknown: {e}"
+
+    required = planned_bytes + reserve_bytes
+    if free < required:
+        return False, free, (
+            f"Destination has {free / (1024**3):.2f} GB free but the run needs "
+            f"{required / (1024**3):.2f} GB ({planned_bytes} bytes planned, {reserve_bytes} reserved)"
+        )
+    return True, free, ""
+
+
+def preallocate(fd: int, size: int) -> bool:
+    """
+    Reserve space for a file before writing it so the extents are contiguous
+    and an out-of-space condition surfaces here instead of mid-stream.
+
+    Uses os.posix_fallocate where available. On Windows, extending the file
+    with ftruncate makes NTFS allocate the clusters up front.
+
+    Args:
+        fd: File descriptor opened for writing
+        size: Final size of the file in bytes
+
+    Returns:
+        True if space was reserved, False if the platform or filesystem cannot preallocate
+
+    Raises:
+        OSError: If the volume does not have enough space
+    """
+    if size <= 0:
+        return False
+
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return True
+        except OSError as e:
+            if e.errno in _FALLOCATE_UNSUPPORTED:
+                return False
+            raise
+
+    if sys.platform == "win32":
+        os.ftruncate(fd, size)
+        return True
+
+    return False
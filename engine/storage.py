@@ -0,0 +1,577 @@
+"""
+Storage backends for the RoboBackup native copy engine
+One interface over local folders and S3-compatible object stores: put, get, range-read, list and delete
+"""
+
+import hashlib
+import hmac
+import http.client
+import io
+import os
+import queue
+import shutil
+import ssl
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+from utils.logging_utils import get_logger
+from .retry import backoff_delay
+
+logger = get_logger(__name__)
+
+OBJECT_URL_SCHEMES = ("s3",)
+
+# S3 limits: parts of at least 5 MiB (except the last), at most 10000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+_S3_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+class StorageError(OSError):
+    """A backend operation failed; status is the HTTP status for object stores"""
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class ObjectInfo:
+    """One stored object"""
+    key: str
+    size: int
+    mtime_ns: int = 0
+
+
+class StorageBackend:
+    """
+    Where backup data is stored. Keys are '/'-separated paths relative to the
+    backend's root; an object is written completely or not at all.
+    """
+
+    name = "backend"
+
+    def put(self, key: str, fileobj: BinaryIO, size: Optional[int] = None):
+        """Store the rest of fileobj under key, replacing any existing object"""
+        raise NotImplementedError
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        """Read length bytes of an object starting at offset (fewer at its end)"""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        """Size and modification time of an object, or None if it does not exist"""
+        raise NotImplementedError
+
+    def list(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        """Objects whose key starts with prefix, in key order"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """Delete an object; deleting a missing object is not an error"""
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        """Read a whole object"""
+        info = self.stat(key)
+        if info is None:
+            raise StorageError(f"No such object: {key}", 404)
+        return self.get_range(key, 0, info.size)
+
+    def put_bytes(self, key: str, data: bytes):
+        """Store bytes under key"""
+        self.put(key, io.BytesIO(data), len(data))
+
+    def put_file(self, key: str, path: str):
+        """Upload a local file"""
+        with open(path, "rb") as f:
+            self.put(key, f, os.fstat(f.fileno()).st_size)
+
+    def open(self, key: str, buffer_size: int = 256 * 1024) -> BinaryIO:
+        """Open an object as a seekable read-only file; every buffer fill is one range read"""
+        info = self.stat(key)
+        if info is None:
+            raise StorageError(f"No such object: {key}", 404)
+        return io.BufferedReader(_ObjectReader(self, key, info.size), buffer_size)
+
+    def get_file(self, key: str, path: str, chunk_size: int = 8 * 1024 * 1024):
+        """Download an object to a local file, written under a temporary name first"""
+        info = self.stat(key)
+        if info is None:
+            raise StorageError(f"No such object: {key}", 404)
+        tmp = path + ".rbtmp"
+        with open(tmp, "wb") as f:
+            for offset in range(0, info.size, chunk_size):
+                f.write(self.get_range(key, offset, min(chunk_size, info.size - offset)))
+        os.replace(tmp, path)
+
+    def close(self):
+        """Release connections"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _ObjectReader(io.RawIOBase):
+    """Raw file over a backend's range reads, for StorageBackend.open()"""
+
+    def __init__(self, backend: StorageBackend, key: str, size: int):
+        super().__init__()
+        self._backend = backend
+        self._key = key
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        length = min(len(buffer), self._size - self._pos)
+        if length <= 0:
+            return 0
+        data = self._backend.get_range(self._key, self._pos, length)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class LocalBackend(StorageBackend):
+    """Objects are files below a root folder (local disk or a mapped share)"""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        """
+        Initialize local backend
+
+        Args:
+            root: Folder holding the objects; created on first write
+        """
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        parts = [p for p in key.split("/") if p]
+        if not parts or any(p in (".", "..") for p in parts):
+            raise StorageError(f"Invalid key: {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def put(self, key: str, fileobj: BinaryIO, size: Optional[int] = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".rbtmp"
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def put_file(self, key: str, path: str):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + ".rbtmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+
+    def open(self, key: str, buffer_size: int = 256 * 1024) -> BinaryIO:
+        try:
+            return open(self._path(key), "rb", buffering=buffer_size)
+        except FileNotFoundError:
+            raise StorageError(f"No such object: {key}", 404)
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        try:
+            with open(self._path(key), "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        except FileNotFoundError:
+            raise StorageError(f"No such object: {key}", 404)
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(key, st.st_size, st.st_mtime_ns)
+
+    def list(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        found = []
+        for folder, dirs, names in os.walk(self.root):
+            rel_dir = os.path.relpath(folder, self.root).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir + "/"
+            # Only descend where keys can still match the prefix
+            dirs[:] = [d for d in dirs if (rel_dir + d + "/").startswith(prefix) or prefix.startswith(rel_dir + d + "/")]
+            for name in names:
+                key = rel_dir + name
+                if key.startswith(prefix) and not name.endswith(".rbtmp"):
+                    st = os.stat(os.path.join(folder, name))
+                    found.append(ObjectInfo(key, st.st_size, st.st_mtime_ns))
+        return iter(sorted(found, key=lambda info: info.key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP connections to one host, shared by all threads"""
+
+    def __init__(self, scheme: str, host: str, port: Optional[int], size: int, timeout: float):
+        self.scheme, self.host, self.port = scheme, host, port
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=size)
+        self._context = ssl.create_default_context() if scheme == "https" else None
+
+    def get(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            if self._context is not None:
+                return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self._context)
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def put(self, conn: http.client.HTTPConnection):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _sign(key: bytes, text: str) -> bytes:
+    return hmac.new(key, text.encode("utf-8"), hashlib.sha256).digest()
+
+
+class S3Backend(StorageBackend):
+    """
+    S3-compatible object store (AWS S3, MinIO, Wasabi, Ceph RGW, ...).
+
+    Requests are signed with AWS Signature Version 4 and sent over a pool of
+    keep-alive connections. Objects larger than one part are uploaded as
+    multipart uploads with several parts in flight, so a single large archive
+    can use the whole link.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint: Optional[str] = None,
+        region: str = "us-east-1",
+        access_key: str = "",
+        secret_key: str = "",
+        part_size: int = 16 * 1024 * 1024,
+        connections: int = 8,
+        retries: int = 3,
+        timeout: float = 60.0
+    ):
+        """
+        Initialize S3 backend
+
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix every object is stored under
+            endpoint: Service URL, e.g. http://nas:9000; AWS if None
+            region: Signing region
+            access_key: Access key ID
+            secret_key: Secret access key
+            part_size: Multipart part size in bytes (at least 5 MiB)
+            connections: Pooled connections, which is also the number of parts uploaded at once
+            retries: Attempts after a connection error or a 5xx response
+            timeout: Socket timeout in seconds
+        """
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.part_size = max(MIN_PART_SIZE, part_size)
+        self.connections = max(1, connections)
+        self.retries = retries
+        if endpoint:
+            parts = urlsplit(endpoint)
+            self.scheme, self.host = parts.scheme or "https", parts.netloc
+            self._base = f"/{bucket}"  # path-style addressing, which every S3-compatible server supports
+        else:
+            self.scheme, self.host = "https", f"{bucket}.s3.{region}.amazonaws.com"
+            self._base = ""
+        host, _, port = self.host.partition(":")
+        self._pool = _ConnectionPool(self.scheme, host, int(port) if port else None, self.connections, timeout)
+
+    def close(self):
+        self._pool.close()
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _headers(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str], body: bytes) -> Dict[str, str]:
+        """Add the Signature Version 4 headers to a request; path is the URI path as sent, already percent-encoded"""
+        now = datetime.now(timezone.utc)
+        stamp, day = now.strftime("%Y%m%dT%H%M%SZ"), now.strftime("%Y%m%d")
+        headers = dict(headers, host=self.host)
+        headers["x-amz-date"] = stamp
+        headers["x-amz-content-sha256"] = _sha256(body)
+        if not self.access_key:
+            return headers
+
+        canonical_query = "&".join(
+            f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items())
+        )
+        names = sorted(k.lower() for k in headers)
+        lowered = {k.lower(): str(v).strip() for k, v in headers.items()}
+        canonical = "\n".join([
+            method, path, canonical_query,
+            "".join(f"{n}:{lowered[n]}\n" for n in names), ";".join(names), headers["x-amz-content-sha256"],
+        ])
+        scope = f"{day}/{self.region}/s3/aws4_request"
+        to_sign = "\n".join(["AWS4-HMAC-SHA256", stamp, scope, _sha256(canonical.encode("utf-8"))])
+        key = _sign(_sign(_sign(_sign(("AWS4" + self.secret_key).encode("utf-8"), day), self.region), "s3"), "aws4_request")
+        signature = hmac.new(key, to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={';'.join(names)}, Signature={signature}")
+        return headers
+
+    def _request(
+        self,
+        method: str,
+        key: Optional[str] = None,
+        query: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        body: bytes = b"",
+        ok: Tuple[int, ...] = (200,)
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Send one request over a pooled connection, retrying transient failures.
+
+        Returns:
+            Tuple of (status, lower-cased response headers, response body)
+
+        Raises:
+            StorageError: If the response status is not in ok after all attempts
+        """
+        query = query or {}
+        path = self._base + ("/" + quote(self._key(key), safe="/-_.~") if key is not None else "/")
+        path = path if path.startswith("/") else "/" + path
+        target = path + ("?" + "&".join(
+            f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" if v != "" else quote(k, safe='-_.~')
+            for k, v in sorted(query.items())
+        ) if query else "")
+        for attempt in range(self.retries + 1):
+            conn = self._pool.get()
+            try:
+                signed = self._headers(method, path, query, headers or {}, body)
+                conn.request(method, target, body=body or None, headers=signed)
+                response = conn.getresponse()
+                data = response.read()
+                status = response.status
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if attempt >= self.retries:
+                    raise StorageError(f"{method} {target} failed: {e}")
+                time.sleep(backoff_delay(attempt + 1, 0.5, 10.0))
+                continue
+            self._pool.put(conn)
+            if status in ok:
+                return status, response_headers, data
+            if status >= 500 and attempt < self.retries:
+                time.sleep(backoff_delay(attempt + 1, 0.5, 10.0))
+                continue
+            raise StorageError(f"{method} {target} returned {status}: {data[:200]!r}", status)
+        raise StorageError(f"{method} {target} failed")
+
+    def put(self, key: str, fileobj: BinaryIO, size: Optional[int] = None):
+        first = fileobj.read(self.part_size)
+        if len(first) < self.part_size:
+            self._request("PUT", key, body=first)
+            return
+        self._multipart(key, fileobj, first, size)
+
+    def _multipart(self, key: str, fileobj: BinaryIO, first: bytes, size: Optional[int]):
+        """Upload parts in parallel; parts are read in order and at most connections + 1 are held in memory"""
+        part_size = self.part_size
+        if size is not None and size > part_size * MAX_PARTS:
+            raise StorageError(f"{key} needs more than {MAX_PARTS} parts of {part_size} bytes")
+        _, _, body = self._request("POST", key, {"uploads": ""})
+        tree = ET.fromstring(body)
+        upload_id = tree.findtext(f"{_S3_NS}UploadId") or tree.findtext("UploadId")
+        etags: Dict[int, str] = {}
+        slots = threading.BoundedSemaphore(self.connections + 1)
+
+        def upload(number: int, data: bytes):
+            try:
+                _, headers, _ = self._request("PUT", key, {"partNumber": str(number), "uploadId": upload_id}, body=data)
+                etags[number] = headers.get("etag", "")
+            finally:
+                slots.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="s3-part") as pool:
+                futures = []
+                number, data = 1, first
+                while data:
+                    slots.acquire()
+                    futures.append(pool.submit(upload, number, data))
+                    number += 1
+                    data = fileobj.read(part_size)
+                for future in futures:
+                    future.result()
+            parts = "".join(
+                f"<Part><PartNumber>{n}</PartNumber><ETag>{etags[n]}</ETag></Part>" for n in sorted(etags)
+            )
+            body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+            _, _, response = self._request("POST", key, {"uploadId": upload_id}, body=body)
+            # S3 can report a failed completion with status 200 and an Error document
+            if b"<Error>" in response:
+                raise StorageError(f"Completing upload of {key} failed: {response[:200]!r}")
+        except BaseException:
+            try:
+                self._request("DELETE", key, {"uploadId": upload_id}, ok=(200, 204, 404))
+            except StorageError as e:
+                logger.warning(f"Cannot abort multipart upload of {key}: {e}")
+            raise
+
+    def get_range(self, key: str, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        _, _, data = self._request(
+            "GET", key, headers={"Range": f"bytes={offset}-{offset + length - 1}"}, ok=(200, 206)
+        )
+        return data
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            _, headers, _ = self._request("HEAD", key)
+        except StorageError as e:
+            if e.status == 404:
+                return None
+            raise
+        mtime = 0
+        if "last-modified" in headers:
+            mtime = int(parsedate_to_datetime(headers["last-modified"]).timestamp() * 1e9)
+        return ObjectInfo(key, int(headers.get("content-length", 0)), mtime)
+
+    def list(self, prefix: str = "") -> Iterator[ObjectInfo]:
+        root = self._key("")
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": root + prefix}
+            if token:
+                query["continuation-token"] = token
+            _, _, body = self._request("GET", None, query)
+            tree = ET.fromstring(body)
+            ns = _S3_NS if tree.tag.startswith(_S3_NS) else ""
+            for item in tree.iter(f"{ns}Contents"):
+                key = item.findtext(f"{ns}Key")[len(root):]
+                modified = item.findtext(f"{ns}LastModified") or ""
+                mtime = 0
+                if modified:
+                    mtime = int(datetime.fromisoformat(modified.replace("Z", "+00:00")).timestamp() * 1e9)
+                yield ObjectInfo(key, int(item.findtext(f"{ns}Size") or 0), mtime)
+            if tree.findtext(f"{ns}IsTruncated") != "true":
+                return
+            token = tree.findtext(f"{ns}NextContinuationToken")
+
+    def delete(self, key: str):
+        self._request("DELETE", key, ok=(200, 204, 404))
+
+
+def is_object_url(location: str) -> bool:
+    """True if a destination names an object store rather than a folder"""
+    return location.split("://", 1)[0].lower() in OBJECT_URL_SCHEMES if "://" in location else False
+
+
+def open_backend(location: str, access_key: str = "", secret_key: str = "", connections: int = 8) -> StorageBackend:
+    """
+    Open the backend a destination names.
+
+    Args:
+        location: Folder path, or s3://bucket/prefix with optional endpoint=, region= and part_mb= query parameters
+        access_key: Access key ID for object stores; AWS_ACCESS_KEY_ID if empty
+        secret_key: Secret access key for object stores; AWS_SECRET_ACCESS_KEY if empty
+        connections: Pooled connections (and parallel parts) for object stores
+
+    Returns:
+        LocalBackend or S3Backend
+    """
+    if not is_object_url(location):
+        return LocalBackend(location)
+    access_key = access_key or os.environ.get("AWS_ACCESS_KEY_ID", "")
+    secret_key = secret_key or os.environ.get("AWS_SECRET_ACCESS_KEY", "")
+    parts = urlsplit(location)
+    params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+    return S3Backend(
+        parts.netloc,
+        parts.path.strip("/"),
+        endpoint=params.get("endpoint"),
+        region=params.get("region", "us-east-1"),
+        access_key=access_key,
+        secret_key=secret_key,
+        part_size=int(params.get("part_mb", 16)) * 1024 * 1024,
+        connections=connections,
+    )
+
+
+def describe(location: str) -> str:
+    """Destination for logs, without query parameters"""
+    return location.split("?", 1)[0]
+
+
+def upload_files(backend: StorageBackend, files: List[Tuple[str, str]], workers: int = 4) -> int:
+    """
+    Upload local files in parallel.
+
+    Args:
+        backend: Target backend
+        files: (local path, key) pairs
+        workers: Files uploaded at once
+
+    Returns:
+        Bytes uploaded
+    """
+    def upload(item: Tuple[str, str]) -> int:
+        path, key = item
+        backend.put_file(key, path)
+        return os.path.getsize(path)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="upload") as pool:
+        return sum(pool.map(upload, files))
@@ -0,0 +1,279 @@
+"""
+Tar stream output for the RoboBackup native copy engine
+Writes a source tree as a POSIX (pax) tar stream in one sequential pass, to a file or stdout
+"""
+
+import json
+import os
+import stat
+import sys
+import tarfile
+import time
+from datetime import datetime
+from typing import BinaryIO, Callable, List, Optional, TextIO, Union
+from utils.logging_utils import get_logger, log_exception
+from .retry import RetryQueue, classify_error
+from .iohints import open_for_sequential_read
+from .native import EngineEvent, EngineOptions, FailedFile, FileEntry, RunResult, _walk
+
+logger = get_logger(__name__)
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+RECORD_SIZE = tarfile.RECORDSIZE
+
+TAR_INDEX_VERSION = 1
+
+# Index sidecar, one JSON array per line:
+#   ["robobackup-tar-index", version]   header
+#   [path, type, header_offset, data_offset, size, mtime_ns]   one member, type "f" or "d"
+
+
+class TarStreamWriter:
+    """
+    Minimal sequential tar writer with constant memory use.
+
+    Members are written as pax headers followed by their data, read through one
+    reusable buffer. A file that shrinks while it is read is padded with zeros
+    so the stream stays valid, and reported as failed.
+    """
+
+    def __init__(self, output: BinaryIO, index: Optional[TextIO] = None, chunk_size: int = 1024 * 1024):
+        """
+        Initialize tar stream writer
+
+        Args:
+            output: Binary stream receiving the archive
+            index: Optional text stream receiving the member index
+            chunk_size: Read buffer size
+        """
+        self.output = output
+        self.index = index
+        self.offset = 0
+        self._buffer = bytearray(max(BLOCK_SIZE, chunk_size))
+        self._view = memoryview(self._buffer)
+        if self.index is not None:
+            self.index.write(json.dumps(["robobackup-tar-index", TAR_INDEX_VERSION]) + "\n")
+
+    def _write(self, data):
+        self.output.write(data)
+        self.offset += len(data)
+
+    def _header(self, rel_path: str, kind: bytes, size: int, mode: int, mtime_ns: int) -> int:
+        """Write a member header and return the offset where it starts"""
+        info = tarfile.TarInfo(rel_path)
+        info.type = kind
+        info.size = size
+        info.mode = stat.S_IMODE(mode)
+        info.mtime = mtime_ns / 1e9
+        header_offset = self.offset
+        self._write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+        return header_offset
+
+    def _record(self, rel_path: str, kind: str, header_offset: int, size: int, mtime_ns: int):
+        if self.index is not None:
+            data_offset = self.offset - size - (-size % BLOCK_SIZE) if kind == "f" else self.offset
+            self.index.write(json.dumps(
+                [rel_path, kind, header_offset, data_offset, size, mtime_ns], separators=(",", ":")
+            ) + "\n")
+
+    def add_directory(self, entry: FileEntry):
+        """Write a directory member from its scan entry"""
+        header_offset = self._header(entry.rel_path + "/", tarfile.DIRTYPE, 0, entry.mode, entry.mtime_ns)
+        self._record(entry.rel_path, "d", header_offset, 0, entry.mtime_ns)
+
+    def add_file(self, rel_path: str, fileobj: BinaryIO, st: os.stat_result) -> int:
+        """
+        Write a regular file member from an open file.
+
+        Args:
+            rel_path: Member name
+            fileobj: File opened for reading, supporting readinto()
+            st: stat of the open file; its size is the size written to the header
+
+        Returns:
+            Number of bytes of real data written; less than st.st_size if the file shrank
+        """
+        size = st.st_size
+        header_offset = self._header(rel_path, tarfile.REGTYPE, size, st.st_mode, st.st_mtime_ns)
+        remaining = size
+        error = None
+        while remaining:
+            want = min(remaining, len(self._buffer))
+            try:
+                n = fileobj.readinto(self._view[:want])
+            except OSError as e:
+                error, n = e, 0
+            if not n:
+                break
+            self._write(self._view[:n])
+            remaining -= n
+        written = size - remaining
+        if remaining:
+            # Keep the stream valid: the header promised `size` bytes
+            zeros = bytes(min(remaining, len(self._buffer)))
+            while remaining:
+                chunk = zeros[:remaining]
+                self._write(chunk)
+                remaining -= len(chunk)
+        padding = -size % BLOCK_SIZE
+        if padding:
+            self._write(bytes(padding))
+        self._record(rel_path, "f", header_offset, size, st.st_mtime_ns)
+        if error is not None:
+            raise error
+        return written
+
+    def close(self):
+        """Write the end-of-archive marker and pad to a full record"""
+        self._write(bytes(2 * BLOCK_SIZE))
+        padding = -self.offset % RECORD_SIZE
+        if padding:
+            self._write(bytes(padding))
+        self.output.flush()
+
+
+class _Shrunk(OSError):
+    """A file got shorter between stat and read"""
+
+
+def write_tar_stream(
+    source: str,
+    output: Union[str, BinaryIO],
+    options: Optional[EngineOptions] = None,
+    index_path: Optional[str] = None,
+    progress_callback: Optional[Callable[[EngineEvent], None]] = None
+) -> RunResult:
+    """
+    Stream a source tree as a tar archive in one sequential pass.
+
+    Files that are locked or otherwise fail with a transient error are retried
+    after the main pass, with the same backoff as the copy engine, and appended
+    at the end of the stream.
+
+    Args:
+        source: Directory to archive
+        output: Archive path, '-' for stdout, or an open binary stream
+        options: Engine options; exclusions, chunk size, page-cache hints and retries are used
+        index_path: Optional path of a member index sidecar
+        progress_callback: Optional callable receiving EngineEvent objects
+
+    Returns:
+        RunResult; stats carry the archive size and index path
+    """
+    options = options or EngineOptions()
+    result = RunResult(run_id=datetime.now().strftime('%Y%m%d_%H%M%S'))
+    start = time.monotonic()
+
+    def emit(kind: str, path: str = "", nbytes: int = 0, message: str = ""):
+        if progress_callback is None:
+            return
+        try:
+            progress_callback(EngineEvent(kind, path, nbytes, message))
+        except Exception:
+            log_exception(logger, "Progress callback raised an exception")
+
+    if not os.path.isdir(source):
+        result.failures.append(FailedFile("", "not_found", f"Source folder does not exist: {source}", 1))
+        emit("run_complete", message="Source folder does not exist")
+        return result
+
+    close_output = False
+    if output == "-":
+        stream = sys.stdout.buffer
+    elif isinstance(output, str):
+        stream = open(output, "wb")
+        close_output = True
+    else:
+        stream = output
+    index = open(index_path, "w", encoding="utf-8") if index_path else None
+
+    retry_queue = RetryQueue(options.retry_base_delay, options.retry_max_delay, options.retry_jitter)
+    writer = TarStreamWriter(stream, index, options.chunk_size)
+
+    def add(entry: FileEntry, attempt: int):
+        abs_path = os.path.join(source, *entry.rel_path.split("/"))
+        try:
+            fsrc = open_for_sequential_read(abs_path) if options.io_hints else open(abs_path, "rb", buffering=0)
+        except OSError as e:
+            error_class, transient = classify_error(e)
+            if transient and attempt < options.retry_attempts:
+                retry_queue.schedule(entry, attempt + 1)
+                result.retries += 1
+                emit("file_retry", entry.rel_path, message=f"{error_class}: {e}")
+                return
+            result.failures.append(FailedFile(entry.rel_path, error_class, str(e), attempt + 1))
+            emit("file_failed", entry.rel_path, message=f"{error_class}: {e}")
+            return
+        # Once the header is out the member cannot be retried; a read error leaves zeros
+        with fsrc:
+            st = os.fstat(fsrc.fileno())
+            try:
+                written = writer.add_file(entry.rel_path, fsrc, st)
+                if written < st.st_size:
+                    raise _Shrunk(f"File shrank while archiving ({written} of {st.st_size} bytes)")
+            except OSError as e:
+                error_class, _ = classify_error(e)
+                result.failures.append(FailedFile(entry.rel_path, error_class, str(e), attempt + 1))
+                logger.error(f"Archived {entry.rel_path} incompletely ({error_class}): {e}")
+                emit("file_failed", entry.rel_path, message=f"{error_class}: {e}")
+                return
+        result.files_copied += 1
+        result.bytes_copied += st.st_size
+        emit("file_copied", entry.rel_path, st.st_size)
+
+    try:
+        directories: List[FileEntry] = []
+        emitted_dirs = 0
+        for rel_dir, name, st in _walk(source, options.exclude_folders, options.exclude_files, directories):
+            # Directory members precede the files inside them
+            while emitted_dirs < len(directories):
+                writer.add_directory(directories[emitted_dirs])
+                emitted_dirs += 1
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            result.files_total += 1
+            add(FileEntry(rel_path, st.st_size, st.st_mtime_ns, st.st_mode), 0)
+        for directory in directories[emitted_dirs:]:
+            writer.add_directory(directory)
+        emit("scan_complete", message=f"{result.files_total} files streamed")
+
+        while len(retry_queue):
+            item = retry_queue.pop_due()
+            if item is None:
+                time.sleep(min(retry_queue.time_until_next() or 0.05, 1.0))
+                continue
+            add(*item)
+
+        writer.close()
+    except Exception as e:
+        log_exception(logger, "Tar stream failed")
+        result.failures.append(FailedFile("", classify_error(e)[0], str(e), 1))
+    finally:
+        if index is not None:
+            index.close()
+        if close_output:
+            stream.close()
+
+    result.duration_seconds = time.monotonic() - start
+    result.success = not result.failures
+    result.stats["archive_bytes"] = writer.offset
+    result.stats["index"] = index_path or ""
+    emit("run_complete", nbytes=result.bytes_copied,
+         message=f"{result.files_copied} archived, {len(result.failures)} failed")
+    return result
+
+
+def load_tar_index(path: str) -> List[list]:
+    """
+    Read a member index written alongside a tar stream.
+
+    Returns:
+        [path, type, header_offset, data_offset, size, mtime_ns] per member
+
+    Raises:
+        ValueError: If the file is not a supported index
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "null")
+        if header != ["robobackup-tar-index", TAR_INDEX_VERSION]:
+            raise ValueError(f"Not a tar index: {path}")
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,323 @@
+"""
+Storage tiering for the RoboBackup native copy engine
+Moves aged archive runs from a destination folder to a slower, denser storage backend
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from utils.logging_utils import get_logger, log_exception
+from .archive import archive_path, list_archives
+from .catalog import BackupCatalog, catalog_path
+from .parity import parity_path
+from .sis import hash_file
+from .retention import _active_run, parse_run_time
+from .storage import StorageBackend, StorageError, describe, open_backend
+from .native import META_DIR_NAME
+
+logger = get_logger(__name__)
+
+TIERING_STATE_NAME = "tiering.json"
+
+# Size of the reads that stream an object back from the target to verify it
+VERIFY_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+@dataclass
+class TieringOptions:
+    """Where aged runs move to and which runs count as aged"""
+    target: str = ""  # folder or s3:// URL of the slower tier
+    older_than_days: float = 30.0
+    keep_recent: int = 1  # newest archives that stay whatever their age
+    workers: int = 4  # runs moved at once
+    connections: int = 8  # pooled connections (and parallel upload parts) per object store
+    access_key: str = ""
+    secret_key: str = ""
+
+    def validate(self) -> tuple[bool, str]:
+        """Validate tiering options"""
+        if not self.target:
+            return False, "Tiering needs a target folder or object store URL"
+        if self.older_than_days < 0:
+            return False, "Tiering age cannot be negative"
+        if self.keep_recent < 1:
+            return False, "Tiering must keep at least the latest run on the destination"
+        if self.workers < 1 or self.connections < 1:
+            return False, "Tiering workers and connections must be at least 1"
+        return True, ""
+
+    @classmethod
+    def from_job_config(cls, job: Any, access_key: str = "", secret_key: str = "") -> "TieringOptions":
+        """Build tiering options from a BackupJobConfig"""
+        return cls(
+            target=job.engine_tier_target,
+            older_than_days=job.engine_tier_after_days,
+            workers=job.engine_workers,
+            access_key=access_key,
+            secret_key=secret_key,
+        )
+
+
+@dataclass
+class TieringReport:
+    """Outcome of one tiering pass"""
+    dest: str
+    target: str
+    dry_run: bool = False
+    runs_planned: List[str] = field(default_factory=list)
+    runs_moved: List[str] = field(default_factory=list)
+    runs_resumed: List[str] = field(default_factory=list)  # left unfinished by an earlier pass
+    bytes_uploaded: int = 0
+    bytes_freed: int = 0
+    failures: Dict[str, str] = field(default_factory=dict)  # run ID -> error
+    duration_seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["duration_seconds"] = round(self.duration_seconds, 3)
+        return data
+
+
+class TieringState:
+    """
+    Runs a tiering pass has started moving, saved after every step so an
+    interrupted pass is finished by the next one.
+
+    A run is "copying" until all its objects are verified on the target, then
+    "copied" until its local files are gone; finished runs leave the state.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize tiering state
+
+        Args:
+            path: State file, normally inside the destination's metadata folder
+        """
+        self.path = path
+        self.runs: Dict[str, Dict[str, str]] = {}  # run ID -> {"phase": ..., "target": ...}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "TieringState":
+        """Read a saved state; a missing or unreadable file gives an empty one"""
+        state = cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state.runs = dict(json.load(f)["runs"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable tiering state {path}: {e}")
+        return state
+
+    def set(self, run_id: str, phase: str, target: str):
+        """Record a run's phase"""
+        with self._lock:
+            self.runs[run_id] = {"phase": phase, "target": target}
+            self._save()
+
+    def clear(self, run_id: str):
+        """Forget a finished run"""
+        with self._lock:
+            self.runs.pop(run_id, None)
+            self._save()
+
+    def _save(self):
+        """Write the state atomically; the caller holds the lock"""
+        if not self.runs:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"runs": self.runs}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def tiering_state_path(meta_dir: str) -> str:
+    """File recording the runs a tiering pass has not finished moving"""
+    return os.path.join(meta_dir, TIERING_STATE_NAME)
+
+
+def run_objects(dest: str, run_id: str) -> List[Tuple[str, str]]:
+    """
+    Files of an archive run that move to another tier.
+
+    Returns:
+        (local path, key) pairs; keys keep the layout relative to the destination,
+        so a folder tier can itself be read as a destination
+    """
+    archive = archive_path(dest, run_id)
+    sidecar = parity_path(dest, os.path.basename(archive))
+    return [(path, os.path.relpath(path, dest).replace(os.sep, "/")) for path in (sidecar, archive)]
+
+
+def plan_tiering(dest: str, options: TieringOptions, now: Optional[datetime] = None) -> List[str]:
+    """
+    Archive runs of a destination old enough to move.
+
+    The newest keep_recent archives, runs whose IDs are not timestamps and the
+    run of an unfinished job never move.
+
+    Args:
+        dest: Job destination folder
+        options: Tiering options
+        now: Reference time (defaults to the current time)
+
+    Returns:
+        Run IDs, oldest first
+    """
+    cutoff = (now or datetime.now()) - timedelta(days=options.older_than_days)
+    runs = list_archives(dest)
+    active = _active_run(dest)
+    aged = []
+    for run_id in runs[:-options.keep_recent]:
+        started = parse_run_time(run_id)
+        if run_id != active and started is not None and started <= cutoff:
+            aged.append(run_id)
+    return aged
+
+
+def _uploaded(backend: StorageBackend, key: str, path: str, digest: str) -> bool:
+    """
+    True if the target holds a complete copy of a local file.
+
+    The object is read back in full and its SHA-256 compared with the local
+    file's, so no local copy is deleted on the strength of a size alone.
+
+    Args:
+        backend: Target storage
+        key: Object key
+        path: Local file
+        digest: SHA-256 of the local file
+    """
+    info = backend.stat(key)
+    if info is None or info.size != os.path.getsize(path):
+        return False
+    remote = hashlib.sha256()
+    with backend.open(key, VERIFY_CHUNK_BYTES) as f:
+        for chunk in iter(lambda: f.read(VERIFY_CHUNK_BYTES), b""):
+            remote.update(chunk)
+    return remote.hexdigest() == digest
+
+
+def _move_run(
+    dest: str,
+    run_id: str,
+    backend: StorageBackend,
+    options: TieringOptions,
+    state: TieringState,
+    report: TieringReport,
+    lock: threading.Lock
+):
+    """
+    Copy one run to the target, verify it, point the catalog at it, then delete the local files.
+
+    Objects already complete on the target (from an interrupted pass) are not sent again.
+    """
+    state.set(run_id, "copying", options.target)
+    uploaded = freed = 0
+    objects = run_objects(dest, run_id)
+    for path, key in objects:
+        if not os.path.exists(path):
+            # Deleted by an interrupted pass after it was copied, or a sidecar that was never made
+            if path == archive_path(dest, run_id) and backend.stat(key) is None:
+                raise StorageError(f"{key} is neither at the destination nor on the target")
+            continue
+        digest = hash_file(path)
+        if not _uploaded(backend, key, path, digest):
+            backend.put_file(key, path)
+            if not _uploaded(backend, key, path, digest):
+                raise StorageError(f"{key} does not match the local copy after upload")
+            uploaded += os.path.getsize(path)
+
+    # Restores must find the run before its local copy disappears
+    with BackupCatalog(catalog_path(os.path.join(dest, META_DIR_NAME))) as catalog:
+        catalog.set_location(run_id, options.target)
+    state.set(run_id, "copied", options.target)
+
+    # The archive goes last: while it exists the run is still complete locally
+    for path, _ in objects:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+    state.clear(run_id)
+    with lock:
+        report.bytes_uploaded += uploaded
+        report.bytes_freed += freed
+        report.runs_moved.append(run_id)
+    logger.info(f"Moved run {run_id} to {describe(options.target)} ({uploaded} bytes uploaded)")
+
+
+def migrate_runs(dest: str, options: TieringOptions, dry_run: bool = False) -> TieringReport:
+    """
+    Move a destination's aged archive runs to a slower storage tier.
+
+    Runs move in parallel, each archive streamed to the target (as a parallel
+    multipart upload on object stores) and verified before its local copy is
+    deleted. The catalog records where each moved run now lives, so restores
+    and browsing read it from the target. Runs an interrupted pass left behind
+    are finished first.
+
+    Args:
+        dest: Job destination folder
+        options: Tiering options
+        dry_run: Report what would move without moving anything
+
+    Returns:
+        TieringReport
+    """
+    start = time.monotonic()
+    report = TieringReport(dest, describe(options.target), dry_run)
+    state = TieringState.load(tiering_state_path(os.path.join(dest, META_DIR_NAME)))
+    report.runs_resumed = sorted(run_id for run_id, entry in state.runs.items() if entry.get("target") == options.target)
+    for run_id, entry in state.runs.items():
+        if entry.get("target") != options.target:
+            logger.warning(f"Run {run_id} was being moved to {describe(entry.get('target', ''))}; "
+                           f"finish it with that target")
+    report.runs_planned = sorted(set(plan_tiering(dest, options)) | set(report.runs_resumed))
+    if dry_run or not report.runs_planned:
+        report.bytes_freed = sum(
+            os.path.getsize(path) for run_id in report.runs_planned
+            for path, _ in run_objects(dest, run_id) if os.path.exists(path)
+        )
+        report.duration_seconds = time.monotonic() - start
+        return report
+
+    lock = threading.Lock()
+
+    def move(run_id: str):
+        try:
+            _move_run(dest, run_id, backend, options, state, report, lock)
+        except (OSError, sqlite3.Error) as e:
+            log_exception(logger, f"Cannot move run {run_id} to {describe(options.target)}")
+            with lock:
+                report.failures[run_id] = str(e)
+
+    with open_backend(options.target, options.access_key, options.secret_key, options.connections) as backend:
+        with ThreadPoolExecutor(max_workers=options.workers, thread_name_prefix="tier") as pool:
+            list(pool.map(move, report.runs_planned))
+
+    report.runs_moved.sort()
+    report.duration_seconds = time.monotonic() - start
+    logger.info(f"Tiering of {dest}: {len(report.runs_moved)} runs moved to {report.target}, "
+                f"{report.bytes_freed} bytes freed, {len(report.failures)} failures")
+    return report
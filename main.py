@@ -6,6 +6,7 @@ Professional Windows Backup Solution
 
 import sys
 import os
+import multiprocessing
 from utils.logging_utils import setup_logging, get_logger, log_exception, log_system_info
 
 
@@ -71,6 +72,307 @@ def is_admin():
         return False
 
 
+def run_tar_command(args):
+    """
+    Stream a folder as a tar archive to a file or stdout.
+
+    Args:
+        args: Command line arguments after 'tar'
+
+    Returns:
+        Process exit code
+    """
+    import argparse
+    from engine.native import EngineOptions
+    from engine.tarstream import write_tar_stream
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe tar", description="Write a folder as a tar stream")
+    parser.add_argument("source", help="Folder to archive")
+    parser.add_argument("output", help="Archive file, or - for stdout")
+    parser.add_argument("--index", help="Write a member index sidecar to this file")
+    parser.add_argument("--exclude-dir", action="append", default=[], help="Folder name or pattern to skip")
+    parser.add_argument("--exclude-file", action="append", default=[], help="File name pattern to skip")
+    options = parser.parse_args(args)
+
+    # Console logs go to stdout, which carries the archive when output is '-'
+    logger = setup_logging(log_level="INFO", log_dir="logs", enable_console=options.output != "-")
+    logger.info(f"Streaming {options.source} to {options.output}")
+
+    result = write_tar_stream(
+        options.source,
+        options.output,
+        EngineOptions(exclude_folders=options.exclude_dir, exclude_files=options.exclude_file),
+        index_path=options.index
+    )
+    for failure in result.failures:
+        print(f"Failed: {failure.path} ({failure.error_class}): {failure.message}", file=sys.stderr)
+    print(
+        f"{result.files_copied} files, {result.bytes_copied} bytes archived, {len(result.failures)} failed",
+        file=sys.stderr
+    )
+    return 0 if result.success else 1
+
+
+def run_restore_command(args):
+    """
+    Restore files from a backup destination.
+
+    Args:
+        args: Command line arguments after 'restore'
+
+    Returns:
+        Process exit code
+    """
+    import argparse
+    from backup_core import run_restore
+    from engine.native import EngineOptions
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe restore", description="Restore files from a backup")
+    parser.add_argument("dest", help="Backup destination folder or archive file")
+    parser.add_argument("target", help="Folder to restore into")
+    parser.add_argument("paths", nargs="*", help="Files or folders to restore (default: everything)")
+    parser.add_argument("--first", action="append", default=[], help="File or folder to restore before the rest")
+    parser.add_argument("--run", help="Archive run ID to restore (default: latest)")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel restore workers")
+    options = parser.parse_args(args)
+
+    setup_logging(log_level="INFO", log_dir="logs", enable_console=True)
+    success, result = run_restore(
+        options.dest,
+        options.target,
+        "logs",
+        paths=options.paths or None,
+        priority=options.first,
+        run_id=options.run,
+        options=EngineOptions(workers=max(1, options.workers))
+    )
+    print(f"{result.files_copied} files restored, {result.files_skipped} unchanged, {len(result.failures)} failed")
+    return 0 if success else 1
+
+
+def run_catalog_command(args):
+    """
+    Search a destination's backup catalog for files by name.
+
+    Args:
+        args: Command line arguments after 'catalog'
+
+    Returns:
+        Process exit code
+    """
+    import argparse
+    from datetime import datetime
+    from engine.catalog import BackupCatalog, catalog_path
+    from engine.native import META_DIR_NAME
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe catalog", description="Search the backup catalog")
+    parser.add_argument("dest", help="Backup destination folder")
+    parser.add_argument("text", nargs="?", help="Substring of the file name (omit to list runs)")
+    parser.add_argument("--run", help="Only search this run ID")
+    parser.add_argument("--limit", type=int, default=100, help="Maximum number of matches")
+    options = parser.parse_args(args)
+
+    path = catalog_path(os.path.join(options.dest, META_DIR_NAME))
+    if not os.path.exists(path):
+        print(f"No catalog found in {options.dest}", file=sys.stderr)
+        return 1
+    with BackupCatalog(path) as catalog:
+        if not options.text:
+            for run in catalog.runs():
+                print(f"{run.run_id}  {run.kind:<7}  {run.files:>9} files  {run.bytes:>15,} bytes  {run.source}")
+            return 0
+        for hit in catalog.search(options.text, options.run, options.limit):
+            modified = datetime.fromtimestamp(hit.mtime_ns / 1e9).strftime('%Y-%m-%d %H:%M')
+            print(f"{hit.run_id}  {modified}  {hit.size:>15,}  {hit.path}")
+    return 0
+
+
+def run_prune_command(args):
+    """
+    Apply a grandfather-father-son retention policy to a backup destination.
+
+    Args:
+        args: Command line arguments after 'prune'
+
+    Returns:
+        Process exit code
+    """
+    import argparse
+    from engine.retention import RetentionPolicy, prune_destination
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe prune", description="Delete old backup runs")
+    parser.add_argument("dest", help="Backup destination folder")
+    parser.add_argument("--keep-last", type=int, default=1, help="Most recent runs to keep")
+    for level in ("hourly", "daily", "weekly", "monthly", "yearly"):
+        parser.add_argument(f"--{level}", type=int, default=0, help=f"{level.capitalize()} runs to keep")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would be pruned without deleting")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel deletions")
+    options = parser.parse_args(args)
+
+    policy = RetentionPolicy(options.keep_last, options.hourly, options.daily, options.weekly,
+                             options.monthly, options.yearly)
+    is_valid, error = policy.validate()
+    if not is_valid:
+        print(error, file=sys.stderr)
+        return 2
+    if not policy.enabled:
+        print("No retention level given; nothing to prune", file=sys.stderr)
+        return 2
+
+    plan, stats = prune_destination(options.dest, policy, options.dry_run, options.workers)
+    print(plan.report())
+    for path, error in stats.get("failures", {}).items():
+        print(f"Cannot delete {path}: {error}", file=sys.stderr)
+    return 1 if stats.get("failures") else 0
+
+
+def run_gc_command(args):
+    """
+    Remove data no remaining run of a backup destination references.
+
+    Args:
+        args: Command line arguments after 'gc'
+
+    Returns:
+        Process exit code
+    """
+    import argparse
+    import json
+    from engine.gc import collect_garbage
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe gc", description="Collect backup garbage")
+    parser.add_argument("dest", help="Backup destination folder")
+    parser.add_argument("--dry-run", action="store_true", help="Report without deleting")
+    parser.add_argument("--max-memory-mb", type=int, default=256, help="Memory ceiling for the live-data filter")
+    options = parser.parse_args(args)
+
+    report = collect_garbage(options.dest, options.dry_run, max_bloom_mb=options.max_memory_mb)
+    print(json.dumps(report.to_dict(), indent=2))
+    return 0
+
+
+def run_scrub_command(args):
+    """
+    Verify a backup destination against its recorded hashes.
+
+    Args:
+        args: Command line arguments after 'scrub'
+
+    Returns:
+        Process exit code (1 if problems were found)
+    """
+    import argparse
+    from backup_core import run_scrub
+    from engine.scrub import ScrubOptions
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe scrub", description="Verify stored backup data")
+    parser.add_argument("dest", help="Backup destination folder")
+    parser.add_argument("--full", action="store_true", help="Verify everything instead of today's sample")
+    parser.add_argument("--days", type=int, default=7, help="Days for a rotating sample to cover all data")
+    parser.add_argument("--max-mbps", type=float, default=0.0, help="Read throttle in MB/s (0 = unthrottled)")
+    parser.add_argument("--workers", type=int, default=2, help="Parallel verifications")
+    options = parser.parse_args(args)
+
+    scrub_options = ScrubOptions("full" if options.full else "sample", options.days, options.max_mbps, options.workers)
+    is_valid, error = scrub_options.validate()
+    if not is_valid:
+        print(error, file=sys.stderr)
+        return 2
+
+    setup_logging(log_level="INFO", log_dir="logs", enable_console=True)
+    clean, report = run_scrub(options.dest, "logs", scrub_options)
+    print(f"{report.objects_checked} of {report.objects_total} objects verified, "
+          f"{report.bytes_read:,} bytes read, {len(report.findings)} problems")
+    for finding in report.findings:
+        print(f"{finding.problem:<10}  {finding.kind:<7}  {finding.run_id}  {finding.path}  {finding.message}")
+    return 0 if clean else 1
+
+
+def run_repair_command(args):
+    """
+    Compute parity sidecars for a backup destination, or repair it from them.
+
+    Args:
+        args: Command line arguments after 'repair'
+
+    Returns:
+        Process exit code (1 if something could not be repaired)
+    """
+    import argparse
+    from engine.parity import ParityOptions, protect_destination, repair_destination
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe repair", description="Repair backup data from parity")
+    parser.add_argument("dest", help="Backup destination folder")
+    parser.add_argument("--protect", type=int, metavar="PERCENT",
+                        help="Compute missing parity sidecars with this overhead instead of repairing")
+    parser.add_argument("--min-mb", type=int, default=64, help="Smallest mirror file to protect")
+    parser.add_argument("--dry-run", action="store_true", help="Only report damaged blocks")
+    options = parser.parse_args(args)
+
+    setup_logging(log_level="INFO", log_dir="logs", enable_console=True)
+    if options.protect is not None:
+        parity_options = ParityOptions(percent=options.protect, min_bytes=options.min_mb * 1024 * 1024)
+        is_valid, error = parity_options.validate()
+        if not is_valid:
+            print(error, file=sys.stderr)
+            return 2
+        stats = protect_destination(options.dest, parity_options)
+        print(f"{stats['files']} files protected, {stats['written']} sidecars written "
+              f"({stats['parity_bytes']:,} bytes), {stats['removed']} stale sidecars removed")
+        return 0
+
+    repairs = repair_destination(options.dest, dry_run=options.dry_run)
+    for repair in repairs:
+        status = repair.error or (f"{len(repair.unrecoverable_stripes)} stripes unrecoverable"
+                                  if repair.unrecoverable_stripes else "ok")
+        print(f"{repair.path}: {repair.damaged_blocks} damaged, {repair.repaired_blocks} repaired, {status}")
+    if not repairs:
+        print("Nothing to repair: the last scrub found no corrupt objects with parity")
+    return 0 if all(repair.ok for repair in repairs) else 1
+
+
+def run_tier_command(args):
+    """
+    Move a backup destination's aged archive runs to a slower storage tier.
+
+    Args:
+        args: Command line arguments after 'tier'
+
+    Returns:
+        Process exit code (1 if a run could not be moved)
+    """
+    import argparse
+    from backup_core import run_tiering
+    from engine.tiering import TieringOptions
+
+    parser = argparse.ArgumentParser(prog="RoboBackup.exe tier", description="Move old backup runs to slower storage")
+    parser.add_argument("dest", help="Backup destination folder")
+    parser.add_argument("target", help="Folder or s3://bucket/prefix?endpoint=... URL to move runs to")
+    parser.add_argument("--older-than", type=float, default=30.0, metavar="DAYS", help="Age of the runs to move")
+    parser.add_argument("--keep-recent", type=int, default=1, help="Newest runs that always stay")
+    parser.add_argument("--workers", type=int, default=4, help="Runs moved at once")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would move without moving it")
+    options = parser.parse_args(args)
+
+    # Object store keys come from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY, never the command line
+    tiering_options = TieringOptions(options.target, options.older_than, options.keep_recent, options.workers)
+    is_valid, error = tiering_options.validate()
+    if not is_valid:
+        print(error, file=sys.stderr)
+        return 2
+
+    setup_logging(log_level="INFO", log_dir="logs", enable_console=True)
+    success, report = run_tiering(options.dest, "logs", tiering_options, options.dry_run)
+    runs = report.runs_planned if options.dry_run else report.runs_moved
+    for run_id in runs:
+        print(f"{'would move' if options.dry_run else 'moved'}  {run_id}")
+    for run_id, message in report.failures.items():
+        print(f"failed      {run_id}  {message}", file=sys.stderr)
+    print(f"{len(runs)} runs, {report.bytes_freed:,} bytes {'to free' if options.dry_run else 'freed'} "
+          f"on the destination")
+    return 0 if success else 1
+
+
 def print_usage():
     """Print usage information for the GUI application"""
     print("\nRoboBackup Tool - Windows Backup Solution v1.0.0")
@@ -78,6 +380,14 @@ def print_usage():
     print("\nUsage:")
     print("  RoboBackup.exe                    Start GUI application (default)")
     print("  RoboBackup.exe help               Show this help")
+    print("  RoboBackup.exe tar SRC OUT|-      Write SRC as a tar stream (--index FILE for a sidecar)")
+    print("  RoboBackup.exe restore DEST TARGET [PATH...]  Restore files from a backup destination")
+    print("  RoboBackup.exe catalog DEST [TEXT]  Search backed-up files by name, or list runs")
+    print("  RoboBackup.exe prune DEST --daily N ...  Delete runs outside a retention policy (--dry-run)")
+    print("  RoboBackup.exe scrub DEST         Verify stored data against recorded hashes (--full)")
+    print("  RoboBackup.exe repair DEST        Rebuild corrupt data from parity (--protect PERCENT to compute it)")
+    print("  RoboBackup.exe gc DEST            Remove data no remaining run references (--dry-run)")
+    print("  RoboBackup.exe tier DEST TARGET   Move archive runs older than --older-than DAYS to slower storage")
     print("\nFeatures:")
     print("  • Manual backup execution")
     print("  • Robocopy integration") 
@@ -89,6 +399,24 @@ def print_usage():
 
 def main():
     """Main application entry point"""
+    # Command line tools run without the GUI checks and set up their own logging
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "tar":
+        sys.exit(run_tar_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "restore":
+        sys.exit(run_restore_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "catalog":
+        sys.exit(run_catalog_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "prune":
+        sys.exit(run_prune_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "gc":
+        sys.exit(run_gc_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "scrub":
+        sys.exit(run_scrub_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "repair":
+        sys.exit(run_repair_command(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "tier":
+        sys.exit(run_tier_command(sys.argv[2:]))
+
     # Initialize logging
     logger = setup_logging(
         log_level="INFO",
@@ -145,4 +473,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Required for the native engine's process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+Shared fixtures for the RoboBackup engine tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_tree(root, files):
+    """Create files under root from a {relative path: bytes} mapping"""
+    for rel_path, data in files.items():
+        path = os.path.join(root, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def tree_files(root):
+    """{relative path: bytes} of every file under root, engine metadata excluded"""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".robobackup"]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return files
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "src"
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def dst(tmp_path):
+    path = tmp_path / "dst"
+    path.mkdir()
+    return str(path)
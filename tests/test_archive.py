@@ -0,0 +1,66 @@
+"""
+Tests for archive extraction
+"""
+
+import os
+import stat
+import sys
+
+import pytest
+
+from conftest import tree_files, write_tree
+from engine import EngineOptions, write_archive
+from engine.archive import ArchiveReader, ArchiveWriter, archive_path
+from engine.paths import UnsafePathError
+
+
+def _archive_of(src, dst):
+    result = write_archive(src, dst, EngineOptions(destination_format="archive"))
+    assert result.success
+    return archive_path(dst, result.run_id)
+
+
+def test_extract_all_restores_files_folders_and_times(tmp_path, src, dst):
+    write_tree(src, {"a": b"1", "sub/b": b"22"})
+    os.mkdir(os.path.join(src, "empty"))
+    os.utime(os.path.join(src, "a"), ns=(1_000_000_000, 1_000_000_000))
+    target = str(tmp_path / "out")
+    with ArchiveReader(_archive_of(src, dst)) as reader:
+        result = reader.extract_all(target)
+    assert result.success
+    assert tree_files(target) == {"a": b"1", "sub/b": b"22"}
+    assert os.path.isdir(os.path.join(target, "empty"))
+    assert os.stat(os.path.join(target, "a")).st_mtime_ns == 1_000_000_000
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="POSIX permission bits")
+def test_extract_restores_modes(tmp_path, src, dst):
+    write_tree(src, {"run.sh": b"#!/bin/sh\n", "private": b"p"})
+    os.chmod(os.path.join(src, "run.sh"), 0o755)
+    os.chmod(os.path.join(src, "private"), 0o600)
+    target = str(tmp_path / "out")
+    with ArchiveReader(_archive_of(src, dst)) as reader:
+        assert reader.extract_all(target).success
+    assert stat.S_IMODE(os.stat(os.path.join(target, "run.sh")).st_mode) == 0o755
+    assert stat.S_IMODE(os.stat(os.path.join(target, "private")).st_mode) == 0o600
+
+
+@pytest.mark.parametrize("rel_path", ["../x", "a/../../x", "..\\x", "/abs/x"])
+def test_extract_refuses_members_leaving_the_target(tmp_path, rel_path):
+    payload = tmp_path / "payload"
+    payload.write_bytes(b"owned")
+    path = str(tmp_path / "evil.rba")
+    writer = ArchiveWriter(path)
+    for name in (rel_path, "ok"):
+        with open(payload, "rb") as f:
+            writer.add_file(name, f, os.fstat(f.fileno()))
+    writer.close("evil")
+
+    target = tmp_path / "deep" / "target"
+    with ArchiveReader(path) as reader:
+        with pytest.raises(UnsafePathError):
+            reader.extract(rel_path, str(target))
+        result = reader.extract_all(str(target))
+    assert [(f.path, f.error_class) for f in result.failures] == [(rel_path, "invalid_path")]
+    assert tree_files(str(target)) == {"ok": b"owned"}
+    assert not (tmp_path / "x").exists() and not (tmp_path / "deep" / "x").exists()
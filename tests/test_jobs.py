@@ -0,0 +1,57 @@
+"""
+Tests for running configured backup jobs
+"""
+
+import os
+
+import backup_core
+from conftest import tree_files, write_tree
+from backup_core import run_job, run_jobs
+from engine.archive import list_archives, open_archive
+from utils.config import BackupJobConfig
+
+
+def _job(name, src, dst, **settings):
+    return BackupJobConfig(name=name, source_path=src, destination_path=dst, **settings)
+
+
+def test_native_job_runs_the_native_engine(tmp_path, src, dst, monkeypatch):
+    monkeypatch.setattr(backup_core, "run_backup", lambda *args, **kwargs: (False, "robocopy"))
+    write_tree(src, {"a": b"1", "sub/b": b"22"})
+    success, log_file = run_job(_job("native", src, dst, copy_engine="native"), str(tmp_path / "logs"))
+    assert success
+    assert os.path.isfile(log_file)
+    assert tree_files(dst) == {"a": b"1", "sub/b": b"22"}
+
+
+def test_native_job_applies_its_settings(tmp_path, src, dst):
+    write_tree(src, {"a": b"1", "skip/b": b"22"})
+    job = _job("native", src, dst, copy_engine="native", exclude_folders=["skip"], engine_destination_format="archive")
+    success, _ = run_job(job, str(tmp_path / "logs"))
+    assert success
+    runs = list_archives(dst)
+    assert len(runs) == 1
+    with open_archive(dst, runs[0]) as reader:
+        assert sorted(reader.members) == ["a"]
+
+
+def test_robocopy_job_runs_robocopy(tmp_path, src, dst, monkeypatch):
+    calls = []
+    monkeypatch.setattr(backup_core, "run_backup", lambda *args, **kwargs: calls.append(args) or (True, "log"))
+    assert run_job(_job("robo", src, dst), str(tmp_path / "logs")) == (True, "log")
+    assert calls[0][:3] == (src, dst, "/MIR /FFT /R:3 /W:10 /XJD /XJF")
+
+
+def test_run_jobs_dispatches_each_job(tmp_path, src, monkeypatch):
+    calls = []
+    monkeypatch.setattr(backup_core, "run_backup", lambda *args, **kwargs: calls.append(args[:2]) or (True, "log"))
+    write_tree(src, {"a": b"1"})
+    jobs = [
+        _job("native", src, str(tmp_path / "d1"), copy_engine="native"),
+        _job("robo", src, str(tmp_path / "d2")),
+    ]
+    outcomes = run_jobs(jobs, str(tmp_path / "logs"))
+    assert outcomes["native"][0] and os.path.isfile(outcomes["native"][1])
+    assert outcomes["robo"] == (True, "log")
+    assert calls == [(src, str(tmp_path / "d2"))]
+    assert tree_files(str(tmp_path / "d1")) == {"a": b"1"}
@@ -0,0 +1,90 @@
+"""
+Tests for mirror runs and their /MIR purge
+"""
+
+import os
+import shutil
+
+import pytest
+
+from conftest import tree_files, write_tree
+from engine import EngineOptions, NativeCopyEngine
+from engine.columnar import NUMPY_AVAILABLE
+from engine.manifest import Manifest, ManifestEntry, diff_manifests
+
+COLUMNAR = pytest.mark.skipif(not NUMPY_AVAILABLE, reason="columnar manifests need numpy")
+
+TREE = {"keep/a": b"1", "gone/b": b"22", "gone/sub/c": b"333", "top": b"4"}
+
+
+def _mirror(src, dst, **options):
+    result = NativeCopyEngine(src, dst, EngineOptions(**options)).run()
+    assert result.success
+    return result
+
+
+def _remove_source_folders(src):
+    shutil.rmtree(os.path.join(src, "gone"))
+    shutil.rmtree(os.path.join(src, "empty"))
+    os.remove(os.path.join(src, "top"))
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"trust_manifest": True, "columnar_manifest": False},
+    pytest.param({"trust_manifest": True}, marks=COLUMNAR),
+], ids=["scan", "manifest", "columnar"])
+def test_mirror_purges_removed_files_and_folders(src, dst, options):
+    write_tree(src, TREE)
+    os.makedirs(os.path.join(src, "empty", "deeper"))
+    _mirror(src, dst, **options)
+    assert os.path.isdir(os.path.join(dst, "empty", "deeper"))
+
+    _remove_source_folders(src)
+    result = _mirror(src, dst, **options)
+    assert result.files_deleted == 3
+    assert tree_files(dst) == {"keep/a": b"1"}
+    assert not os.path.exists(os.path.join(dst, "gone"))
+    assert not os.path.exists(os.path.join(dst, "empty"))
+
+
+@pytest.mark.parametrize("columnar", [False, pytest.param(True, marks=COLUMNAR)], ids=["manifest", "columnar"])
+def test_trust_manifest_removes_an_empty_source_folder(src, dst, columnar):
+    write_tree(src, {"a": b"1"})
+    os.mkdir(os.path.join(src, "empty"))
+    options = {"trust_manifest": True, "columnar_manifest": columnar}
+    _mirror(src, dst, **options)
+
+    os.rmdir(os.path.join(src, "empty"))
+    result = _mirror(src, dst, **options)
+    assert result.stats.get("columnar_diff", False) == columnar
+    assert not result.stats.get("noop")
+    assert not os.path.exists(os.path.join(dst, "empty"))
+
+
+@COLUMNAR
+def test_columnar_plan_creates_a_new_empty_folder(src, dst):
+    write_tree(src, {"a": b"1"})
+    _mirror(src, dst, trust_manifest=True)
+    os.mkdir(os.path.join(src, "new"))
+    result = _mirror(src, dst, trust_manifest=True)
+    assert not result.stats.get("noop")
+    assert os.path.isdir(os.path.join(dst, "new"))
+
+
+def test_mirror_off_keeps_extra_files(src, dst):
+    write_tree(src, TREE)
+    _mirror(src, dst)
+    os.remove(os.path.join(src, "top"))
+    _mirror(src, dst, mirror=False)
+    assert tree_files(dst)["top"] == b"4"
+
+
+def test_diff_manifests_reports_removed_folders():
+    old = Manifest("old", [ManifestEntry("gone/sub/c", 1, 1, ""), ManifestEntry("keep/a", 1, 1, "")])
+    old.add_dir("empty")
+    new = Manifest("new", [ManifestEntry("keep/a", 1, 1, "")])
+    diff = diff_manifests(old, new)
+    assert diff.removed == ["gone/sub/c"]
+    assert sorted(diff.removed_dirs) == ["empty", "gone", "gone/sub"]
+    assert not diff.unchanged
@@ -0,0 +1,87 @@
+"""
+Tests for restores and the path checks that keep them inside the target folder
+"""
+
+import os
+import sys
+
+import pytest
+
+from conftest import tree_files, write_tree
+from engine import EngineOptions, NativeCopyEngine
+from engine.archive import ArchiveReader, ArchiveWriter
+from engine.paths import UnsafePathError, safe_join
+from engine.restore import ArchiveRestoreSource, MirrorRestoreSource, RestoreEngine
+
+UNSAFE = ["../x", "a/../../x", "..\\..\\x", "a\\..\\..\\x", "/etc/passwd", "\\\\server\\share\\x"]
+
+
+@pytest.mark.parametrize("rel_path", UNSAFE)
+def test_safe_join_refuses_paths_leaving_the_root(tmp_path, rel_path):
+    with pytest.raises(UnsafePathError):
+        safe_join(str(tmp_path), rel_path)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("win"), reason="drive letters only mean something on Windows")
+@pytest.mark.parametrize("rel_path", ["C:\\x", "C:x", "a/C:x", "C:/Windows/x"])
+def test_safe_join_refuses_drive_letters(tmp_path, rel_path):
+    with pytest.raises(UnsafePathError):
+        safe_join(str(tmp_path), rel_path)
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="symlinks need privileges on Windows")
+def test_safe_join_refuses_a_parent_that_resolves_outside(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    os.symlink(tmp_path, root / "link")
+    with pytest.raises(UnsafePathError):
+        safe_join(str(root), "link/x")
+
+
+def test_safe_join_keeps_ordinary_paths(tmp_path):
+    root = str(tmp_path)
+    assert safe_join(root, "") == root
+    assert safe_join(root, "a/b..c/d") == os.path.join(root, "a", "b..c", "d")
+
+
+def _malicious_archive(tmp_path, members):
+    """An archive whose members have the given (unchecked) paths"""
+    path = str(tmp_path / "evil.rba")
+    payload = tmp_path / "payload"
+    payload.write_bytes(b"owned")
+    writer = ArchiveWriter(path)
+    for rel_path in members:
+        with open(payload, "rb") as f:
+            writer.add_file(rel_path, f, os.fstat(f.fileno()))
+    writer.close("evil")
+    return path
+
+
+@pytest.mark.parametrize("rel_path", UNSAFE[:4])
+def test_restore_refuses_archive_members_leaving_the_target(tmp_path, rel_path):
+    target = tmp_path / "deep" / "target"
+    target.mkdir(parents=True)
+    archive = _malicious_archive(tmp_path, [rel_path, "ok"])
+    source = ArchiveRestoreSource(ArchiveReader(archive))
+    result = RestoreEngine(source, str(target), skip_unchanged=False).run()
+    assert [(f.path, f.error_class) for f in result.failures] == [(rel_path, "invalid_path")]
+    assert tree_files(str(target)) == {"ok": b"owned"}
+    assert not (tmp_path / "x").exists() and not (tmp_path / "deep" / "x").exists()
+
+
+def test_mirror_restore_round_trip(tmp_path, src, dst):
+    write_tree(src, {"a": b"1", "sub/b": b"22"})
+    os.mkdir(os.path.join(src, "empty"))
+    assert NativeCopyEngine(src, dst, EngineOptions()).run().success
+    target = str(tmp_path / "restored")
+    result = RestoreEngine(MirrorRestoreSource(dst), target).run()
+    assert result.success
+    assert tree_files(target) == {"a": b"1", "sub/b": b"22"}
+    assert os.path.isdir(os.path.join(target, "empty"))
+
+
+def test_mirror_restore_ignores_selection_outside_the_backup(tmp_path, dst):
+    write_tree(str(tmp_path), {"secret": b"s"})
+    source = MirrorRestoreSource(dst)
+    assert source.lookup("../secret") is None
+    assert list(source.items(["../secret"])) == []
@@ -0,0 +1,68 @@
+"""
+Tests for retention of runs, tiered ones included
+"""
+
+import os
+
+from conftest import write_tree
+from engine import (
+    EngineOptions, RetentionPolicy, TieringOptions, list_snapshots, migrate_runs, prune_destination,
+    write_archive,
+)
+from engine.archive import list_archives
+
+POLICY = RetentionPolicy(keep_last=1, daily=1)
+
+
+def _archive_runs(src, dst, count):
+    """Write count archive runs, oldest first, and return their run IDs"""
+    runs = []
+    for n in range(count):
+        write_tree(src, {"f": str(n).encode()})
+        result = write_archive(src, dst, EngineOptions(destination_format="archive"))
+        assert result.success
+        runs.append(result.run_id)
+    return runs
+
+
+def _remote_files(root):
+    return sorted(
+        os.path.relpath(os.path.join(folder, name), root).replace(os.sep, "/")
+        for folder, _, names in os.walk(root) for name in names
+    )
+
+
+def test_prune_removes_old_archive_runs(src, dst):
+    runs = _archive_runs(src, dst, 3)
+    plan, stats = prune_destination(dst, POLICY)
+    assert plan.prune == runs[1::-1]
+    assert stats["runs_pruned"] == sorted(runs[:2])
+    assert list_snapshots(dst) == runs[2:]
+
+
+def test_prune_deletes_runs_moved_to_another_tier(tmp_path, src, dst):
+    runs = _archive_runs(src, dst, 3)
+    tier = str(tmp_path / "tier")
+    report = migrate_runs(dst, TieringOptions(target=tier, older_than_days=0, keep_recent=1))
+    assert report.runs_moved == runs[:2]
+    assert list_archives(dst) == runs[2:]
+    assert list_snapshots(dst) == runs
+    assert _remote_files(tier)
+
+    plan, stats = prune_destination(dst, POLICY)
+    assert sorted(plan.remote) == runs[:2]
+    assert not stats["failures"]
+    assert stats["runs_pruned"] == runs[:2]
+    assert _remote_files(tier) == []
+    assert list_snapshots(dst) == runs[2:]
+
+
+def test_dry_run_keeps_tiered_runs(tmp_path, src, dst):
+    runs = _archive_runs(src, dst, 2)
+    tier = str(tmp_path / "tier")
+    migrate_runs(dst, TieringOptions(target=tier, older_than_days=0, keep_recent=1))
+    plan, stats = prune_destination(dst, POLICY, dry_run=True)
+    assert plan.prune == runs[:1]
+    assert "prune  " + runs[0] + "  (at " in plan.report()
+    assert stats == {}
+    assert _remote_files(tier)
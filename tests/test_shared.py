@@ -0,0 +1,128 @@
+"""
+Tests for shared source runs
+"""
+
+import os
+import sys
+
+import pytest
+
+from conftest import tree_files, write_tree
+from engine import EngineOptions, NativeCopyEngine
+from engine.shared import SharedJob, SharedSourceRun, find_overlaps, slice_scan
+from engine.native import scan_table
+
+
+def test_slice_scan_matches_standalone_scan(src):
+    write_tree(src, {"a": b"1", "inner/b": b"22", "inner/sub/c": b"333", "other/d": b"4"})
+    directories = []
+    table = scan_table(src, [], [], directories)
+    sub, sub_dirs = slice_scan(table, directories, "inner", [], [])
+    assert sorted(e.rel_path for e in sub) == ["b", "sub/c"]
+    assert [d.rel_path for d in sub_dirs] == ["sub"]
+
+
+def test_shared_run_copies_each_job(tmp_path, src):
+    write_tree(src, {"a": b"1", "inner/b": b"22"})
+    outer = SharedJob("outer", src, str(tmp_path / "d1"))
+    inner = SharedJob("inner", os.path.join(src, "inner"), str(tmp_path / "d2"))
+    assert [[j.name for j in g] for g in find_overlaps([outer, inner])] == [["outer", "inner"]]
+    results = SharedSourceRun([outer, inner]).run()
+    assert all(r.success for r in results.values())
+    assert tree_files(outer.dest) == {"a": b"1", "inner/b": b"22"}
+    assert tree_files(inner.dest) == {"b": b"22"}
+
+
+def _seed(job, files):
+    """Give a job's destination a previous full copy"""
+    write_tree(job.source, files)
+    assert NativeCopyEngine(job.source, job.dest, job.options).run().success
+
+
+def test_inner_root_excluded_from_shared_scan_is_not_purged(tmp_path, src):
+    write_tree(src, {"a": b"1"})
+    options = EngineOptions(exclude_folders=["x"])
+    outer = SharedJob("outer", src, str(tmp_path / "d1"), options)
+    inner = SharedJob("inner", os.path.join(src, "x"), str(tmp_path / "d2"), options)
+    _seed(inner, {"f1": b"keep"})
+    results = SharedSourceRun([outer, inner]).run()
+    assert results["inner"].success
+    assert results["inner"].files_total == 1
+    assert tree_files(inner.dest) == {"f1": b"keep"}
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="symlinks need privileges on Windows")
+def test_inner_root_behind_symlink_is_not_purged(tmp_path, src):
+    real = tmp_path / "elsewhere"
+    real.mkdir()
+    write_tree(src, {"a": b"1"})
+    os.symlink(real, os.path.join(src, "link"))
+    outer = SharedJob("outer", src, str(tmp_path / "d1"))
+    inner = SharedJob("inner", os.path.join(src, "link"), str(tmp_path / "d2"))
+    _seed(inner, {"f3": b"keep", "x/f1": b"keep too"})
+    # Grouped by where the link points, the jobs do not overlap
+    assert len(find_overlaps([outer, inner])) == 2
+    # Forced into one group, the inner job still runs on its own scan
+    results = SharedSourceRun([outer, inner]).run()
+    assert results["inner"].success
+    assert tree_files(inner.dest) == {"f3": b"keep", "x/f1": b"keep too"}
+
+
+class _FullDisk:
+    """Output whose writes fail as on a full disk"""
+
+    def __init__(self, output):
+        self._output = output
+
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def __getattr__(self, name):
+        return getattr(self._output, name)
+
+
+@pytest.mark.parametrize("failure", ["open", "write"])
+def test_destination_error_fails_only_its_job(tmp_path, src, failure):
+    write_tree(src, {"a": b"1", "inner/b": b"22", "inner/c": b"333"})
+    options = EngineOptions(retry_attempts=0)
+    outer = SharedJob("outer", src, str(tmp_path / "d1"), options)
+    inner = SharedJob("inner", os.path.join(src, "inner"), str(tmp_path / "d2"), options)
+    run = SharedSourceRun([outer, inner])
+    engine = run.engines["inner"]
+    original = engine.open_output
+
+    def broken(unit):
+        if failure == "open":
+            raise PermissionError(13, "Access is denied")
+        return _FullDisk(original(unit))
+
+    engine.open_output = broken
+    results = run.run()
+    assert results["outer"].success
+    assert tree_files(outer.dest) == {"a": b"1", "inner/b": b"22", "inner/c": b"333"}
+    assert not results["inner"].success
+    assert sorted(f.path for f in results["inner"].failures) == ["b", "c"]
+    assert tree_files(inner.dest) == {}
+
+
+def test_transient_destination_error_retries_only_its_job(tmp_path, src):
+    write_tree(src, {"inner/b": b"22"})
+    options = EngineOptions(retry_base_delay=0.01, retry_max_delay=0.01)
+    outer = SharedJob("outer", src, str(tmp_path / "d1"), options)
+    inner = SharedJob("inner", os.path.join(src, "inner"), str(tmp_path / "d2"), options)
+    run = SharedSourceRun([outer, inner])
+    engine = run.engines["inner"]
+    original = engine.open_output
+    calls = []
+
+    def flaky(unit):
+        calls.append(unit.entry.rel_path)
+        if len(calls) == 1:
+            raise TimeoutError("share busy")
+        return original(unit)
+
+    engine.open_output = flaky
+    results = run.run()
+    assert results["outer"].success and results["outer"].retries == 0
+    assert results["inner"].success and results["inner"].retries == 1
+    assert tree_files(inner.dest) == {"b": b"22"}
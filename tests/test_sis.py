@@ -0,0 +1,65 @@
+"""
+Tests for the single-instance store
+"""
+
+import os
+
+from conftest import tree_files, write_tree
+from engine import EngineOptions, NativeCopyEngine, SingleInstanceIndex
+
+SIS = EngineOptions(single_instance=True, single_instance_min_bytes=1)
+
+
+def _touch(root, rel_path, mtime):
+    os.utime(os.path.join(root, rel_path), (mtime, mtime))
+
+
+def test_duplicate_files_are_linked(src, dst):
+    write_tree(src, {"a.bin": b"same", "b.bin": b"same", "c.bin": b"diff"})
+    for name in ("a.bin", "b.bin", "c.bin"):
+        _touch(src, name, 1_000_000)
+    result = NativeCopyEngine(src, dst, SIS).run()
+    assert result.success
+    assert tree_files(dst) == {"a.bin": b"same", "b.bin": b"same", "c.bin": b"diff"}
+    assert os.path.samefile(os.path.join(dst, "a.bin"), os.path.join(dst, "b.bin"))
+    assert not os.path.samefile(os.path.join(dst, "a.bin"), os.path.join(dst, "c.bin"))
+
+
+def test_run_without_single_instance_does_not_leave_a_stale_index(src, dst):
+    write_tree(src, {"y.bin": b"BBB"})
+    _touch(src, "y.bin", 1_000_000)
+    assert NativeCopyEngine(src, dst, SIS).run().success
+
+    # Rewritten by a run that does not maintain the index
+    write_tree(src, {"y.bin": b"AAA"})
+    _touch(src, "y.bin", 2_000_000)
+    assert NativeCopyEngine(src, dst, EngineOptions()).run().success
+
+    write_tree(src, {"z.bin": b"BBB"})
+    _touch(src, "z.bin", 2_000_000)
+    assert NativeCopyEngine(src, dst, SIS).run().success
+    assert tree_files(dst) == {"y.bin": b"AAA", "z.bin": b"BBB"}
+
+
+def test_lookup_drops_a_file_rewritten_behind_the_index(tmp_path):
+    root = str(tmp_path)
+    write_tree(root, {"y.bin": b"BBB"})
+    _touch(root, "y.bin", 1_000_000)
+    index = SingleInstanceIndex(str(tmp_path / "sis.json.gz"))
+    index.add("b" * 64, "y.bin", 3, 3, 1_000_000 * 10**9)
+    assert index.lookup("b" * 64, root) == "y.bin"
+
+    write_tree(root, {"y.bin": b"AAA"})
+    _touch(root, "y.bin", 2_000_000)
+    assert index.lookup("b" * 64, root) is None
+    assert len(index) == 0
+
+
+def test_index_round_trips(tmp_path):
+    path = str(tmp_path / "sis.json.gz")
+    index = SingleInstanceIndex(path)
+    index.add("a" * 64, "dir/x.bin", 10, 12, 123)
+    index.save()
+    loaded = SingleInstanceIndex.load(path)
+    assert loaded.digests() == ["a" * 64]
+    assert loaded.has_size(10)
@@ -34,6 +34,48 @@ class BackupJobConfig:
     last_run: Optional[str] = None
     last_success: Optional[str] = None
     
+    # Native engine settings
+    copy_engine: str = "robocopy"  # robocopy, native
+    engine_workers: int = 4
+    engine_chunk_size_kb: int = 1024
+    engine_buffer_count: int = 32
+    engine_io_hints: bool = False
+    engine_retry_attempts: int = 3
+    engine_retry_base_delay: float = 1.0
+    engine_retry_max_delay: float = 60.0
+    engine_free_space_policy: str = "refuse"  # off, warn, refuse
+    engine_free_space_reserve_mb: int = 0
+    engine_preallocate: bool = True
+    engine_durability: str = "job_end"  # none, per_file, batched, job_end
+    engine_sync_every_mb: int = 256
+    engine_sync_every_seconds: float = 30.0
+    engine_journal: bool = True
+    engine_writers: int = 2
+    engine_transforms: List[str] = field(default_factory=list)  # hash, compress, encrypt
+    engine_manifest: bool = True
+    engine_trust_manifest: bool = False
+    engine_columnar_manifest: bool = True
+    engine_dest_listing: bool = False
+    engine_dest_listing_revalidate_days: float = 7.0
+    engine_dest_listing_sample: int = 256
+    engine_single_instance: bool = False
+    engine_single_instance_min_kb: int = 64
+    engine_destination_format: str = "mirror"  # mirror, archive
+    engine_catalog: bool = True
+    engine_keep_last: int = 1
+    engine_keep_hourly: int = 0  # 0 disables a retention level
+    engine_keep_daily: int = 0
+    engine_keep_weekly: int = 0
+    engine_keep_monthly: int = 0
+    engine_keep_yearly: int = 0
+    engine_scrub_mode: str = "sample"  # full, sample
+    engine_scrub_days: int = 7
+    engine_scrub_mb_per_second: float = 0.0  # 0 = unthrottled
+    engine_parity_percent: int = 0  # parity sidecar overhead, 0 = none
+    engine_parity_min_mb: int = 64
+    engine_tier_target: str = ""  # folder or s3:// URL aged archive runs move to, "" = no tiering
+    engine_tier_after_days: int = 30
+    
     def validate(self) -> tuple[bool, str]:
         """Validate backup job configuration"""
         # Validate required fields
@@ -51,9 +93,14 @@ class BackupJobConfig:
         if not is_valid:
             return False, f"Invalid source path: {error}"
         
-        is_valid, error = validate_path(self.destination_path)
-        if not is_valid:
-            return False, f"Invalid destination path: {error}"
+        if self.destination_path.lower().startswith("s3://"):
+            # Object storage is written one archive per run by the native engine
+            if self.copy_engine != "native" or self.engine_destination_format != "archive":
+                return False, "Object storage destinations require the native engine and the archive format"
+        else:
+            is_valid, error = validate_path(self.destination_path)
+            if not is_valid:
+                return False, f"Invalid destination path: {error}"
         
         # Validate schedule if enabled
         if self.schedule_enabled:
@@ -70,6 +117,82 @@ class BackupJobConfig:
             except ValueError:
                 return False, "Schedule time must be in HH:MM format (24-hour)"
         
+        # Validate native engine settings
+        valid_engines = ["robocopy", "native"]
+        if self.copy_engine not in valid_engines:
+            return False, f"Invalid copy engine. Must be one of: {', '.join(valid_engines)}"
+        
+        if self.engine_workers < 1:
+            return False, "Engine workers must be at least 1"
+        
+        if self.engine_chunk_size_kb < 4:
+            return False, "Engine chunk size must be at least 4 KB"
+        
+        if self.engine_buffer_count < 1:
+            return False, "Engine buffer count must be at least 1"
+        
+        if self.engine_retry_attempts < 0:
+            return False, "Engine retry attempts cannot be negative"
+        
+        if self.engine_retry_base_delay < 0 or self.engine_retry_max_delay < self.engine_retry_base_delay:
+            return False, "Engine retry delays must satisfy 0 <= base delay <= max delay"
+        
+        valid_space_policies = ["off", "warn", "refuse"]
+        if self.engine_free_space_policy not in valid_space_policies:
+            return False, f"Invalid free space policy. Must be one of: {', '.join(valid_space_policies)}"
+        
+        if self.engine_free_space_reserve_mb < 0:
+            return False, "Free space reserve cannot be negative"
+        
+        valid_durability = ["none", "per_file", "batched", "job_end"]
+        if self.engine_durability not in valid_durability:
+            return False, f"Invalid durability mode. Must be one of: {', '.join(valid_durability)}"
+        
+        if self.engine_sync_every_mb < 0 or self.engine_sync_every_seconds < 0:
+            return False, "Sync thresholds cannot be negative"
+        
+        if self.engine_writers < 1:
+            return False, "Engine writers must be at least 1"
+        
+        if self.engine_single_instance_min_kb < 0:
+            return False, "Single-instance threshold cannot be negative"
+        
+        valid_transforms = ["hash", "compress", "encrypt"]
+        for transform in self.engine_transforms:
+            if transform not in valid_transforms:
+                return False, f"Invalid transform '{transform}'. Must be one of: {', '.join(valid_transforms)}"
+        
+        valid_formats = ["mirror", "archive"]
+        if self.engine_destination_format not in valid_formats:
+            return False, f"Invalid destination format. Must be one of: {', '.join(valid_formats)}"
+        
+        keep_counts = (self.engine_keep_last, self.engine_keep_hourly, self.engine_keep_daily,
+                       self.engine_keep_weekly, self.engine_keep_monthly, self.engine_keep_yearly)
+        if min(keep_counts) < 0:
+            return False, "Retention counts cannot be negative"
+        
+        valid_scrub_modes = ["full", "sample"]
+        if self.engine_scrub_mode not in valid_scrub_modes:
+            return False, f"Invalid scrub mode. Must be one of: {', '.join(valid_scrub_modes)}"
+        
+        if self.engine_scrub_days < 1:
+            return False, "Scrub rotation must be at least 1 day"
+        
+        if self.engine_scrub_mb_per_second < 0:
+            return False, "Scrub throttle cannot be negative"
+        
+        if not 0 <= self.engine_parity_percent <= 100:
+            return False, "Parity overhead must be between 0 and 100 percent"
+        
+        if self.engine_parity_min_mb < 0:
+            return False, "Parity threshold cannot be negative"
+        
+        if self.engine_dest_listing_revalidate_days < 0 or self.engine_dest_listing_sample < 0:
+            return False, "Destination listing revalidation period and sample size cannot be negative"
+        
+        if self.engine_tier_after_days < 0:
+            return False, "Tiering age cannot be negative"
+        
         return True, ""
 
 